@@ -0,0 +1,56 @@
+"""Measure the import time of floodsens entry points in fresh interpreters and guard against heavy
+dependencies being imported eagerly.
+
+    python benchmarks/bench_import.py --repeat 5 --max-seconds 0.5
+
+Exits with status 1 if torch, GDAL, pysheds, pandas, geopandas, boto3 or demloader are imported by
+any of the light entry points, or if an import takes longer than --max-seconds."""
+import sys
+import json
+import argparse
+import subprocess
+
+LIGHT_MODULES = ("floodsens", "floodsens.project", "floodsens.event", "floodsens.model", "floodsens.scheduler", "floodsens.state")
+HEAVY_DEPENDENCIES = ("torch", "torchvision", "osgeo", "pysheds", "pandas", "geopandas", "boto3", "demloader", "rasterio", "tifffile")
+
+PROBE = """
+import sys, time, json
+tic = time.perf_counter()
+import {module}
+wall = time.perf_counter() - tic
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"wall": wall, "heavy": heavy}}))
+"""
+
+
+def probe(module):
+    """Import module in a fresh interpreter. Returns (seconds, list of heavy dependencies imported)."""
+    output = subprocess.run([sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_DEPENDENCIES)],
+                            check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result["wall"], result["heavy"]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark and guard floodsens import time.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of fresh interpreters per module.")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fail if the best import time exceeds this.")
+    args = parser.parse_args(argv)
+
+    failed = False
+    print(f"{'module':<22}{'best':>10}{'median':>10}  heavy dependencies")
+    for module in LIGHT_MODULES:
+        walls, heavy = [], set()
+        for _ in range(args.repeat):
+            wall, imported = probe(module)
+            walls.append(wall)
+            heavy.update(imported)
+        walls.sort()
+        print(f"{module:<22}{walls[0]:>9.3f}s{walls[len(walls)//2]:>9.3f}s  {', '.join(sorted(heavy)) or '-'}")
+
+        if heavy or (args.max_seconds is not None and walls[0] > args.max_seconds):
+            failed = True
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""Time every pipeline stage on synthetic scenes of several sizes, offline and on CPU.
+
+    python benchmarks/bench_pipeline.py --sizes 488 976 1952 --out bench_results
+
+One JSON profile per scene size is written to the output folder together with a summary.json
+that collects the per-stage wall times of all sizes."""
+import json
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+import floodsens.inference as inference
+import floodsens.preprocessing as preprocessing
+from floodsens.model import FloodsensModel
+from floodsens.profiling import Profiler
+from floodsens.logger import logger
+from synthetic import make_sentinel2_archive, make_dem_directory, make_model_checkpoint
+
+
+def bench_scene(size, work_dir, model, dem_dir=None):
+    """Run preprocessing, inference and map creation for one synthetic scene and return its Profiler."""
+    event_folder = Path(work_dir)/f"scene_{size}"
+    archive = make_sentinel2_archive(work_dir/"archives", size=size)
+    if dem_dir is None:
+        dem_dir = make_dem_directory(work_dir/"dem", archive)
+
+    profiler = Profiler(f"scene_{size}")
+    tiles_folder = preprocessing.run_default_preprocessing(event_folder, [archive], delete_all=True, profiler=profiler, dem_dir=dem_dir)
+
+    with profiler.stage("inference") as stage:
+        inferred_folder = inference.run_inference(model, tiles_folder, cuda=False, sigmoid_end=True)
+        stage.tiles = sum(1 for _ in inferred_folder.iterdir())
+
+    with profiler.stage("map_creation") as stage:
+        inference.create_map(tiles_folder, inferred_folder, out_path=event_folder/"FloodSENS_results.tif")
+        stage.tiles = sum(1 for _ in tiles_folder.iterdir())
+
+    return profiler
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the floodsens pipeline on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[488, 976, 1952], help="Scene sizes in 10 m pixels.")
+    parser.add_argument("--out", type=Path, default=Path("bench_results"), help="Folder for the JSON results.")
+    parser.add_argument("--work-dir", type=Path, default=None, help="Scratch folder. Defaults to a temporary folder.")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch folder.")
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir if args.work_dir is not None else Path(tempfile.mkdtemp(prefix="floodsens_bench_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    args.out.mkdir(parents=True, exist_ok=True)
+
+    model = FloodsensModel(make_model_checkpoint(work_dir/"model"/"bench_model.tar"))
+
+    summary = {}
+    try:
+        for size in args.sizes:
+            logger.info(f"Benchmarking scene with {size}x{size} pixels.")
+            profiler = bench_scene(size, work_dir, model)
+            profiler.to_json(args.out/f"profile_{size}.json")
+            summary[size] = {name: entry["wall"] for name, entry in profiler.summary().items()}
+            summary[size]["total"] = profiler.elapsed
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.out/"summary.json", "w") as ostream:
+        json.dump(summary, ostream, indent=2)
+
+    stages = list(next(iter(summary.values())).keys()) if summary else []
+    print(f"{'stage':<18}" + "".join(f"{size:>12}" for size in summary))
+    for stage in stages:
+        print(f"{stage:<18}" + "".join(f"{summary[size].get(stage, 0):>11.2f}s" for size in summary))
+
+if __name__ == "__main__":
+    main()
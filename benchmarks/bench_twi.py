@@ -0,0 +1,64 @@
+"""Compare the TWI kernel backends with the former float64 implementation on synthetic blocks.
+
+    python benchmarks/bench_twi.py --sizes 1024 4096 --repeat 3
+
+Reports the best wall time and the peak of traced numpy allocations per backend, and the largest
+difference to the former implementation on valid cells."""
+import time
+import argparse
+import tracemalloc
+import importlib.util
+import numpy as np
+from floodsens._dem import twi_kernel, TWI_BACKENDS
+
+
+def twi_float64(flow_accumulation, slope_degrees):
+    """TWI as computed before the float32 kernel, with full-size float64 temporaries."""
+    slope_radians = np.radians(slope_degrees.astype(np.float64))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(slope_radians==0, 0, np.log(flow_accumulation.astype(np.float64)/np.tan(slope_radians)))
+
+def synthetic_block(size, seed=0):
+    rng = np.random.default_rng(seed)
+    flow_accumulation = rng.lognormal(1.0, 2.0, (size, size)).astype(np.float32) + 1
+    slope_degrees = rng.uniform(0, 45, (size, size)).astype(np.float32)
+    slope_degrees[rng.random((size, size)) < 0.05] = 0
+    return flow_accumulation, slope_degrees
+
+def measure(function, repeat):
+    """Best wall time of repeat calls and peak traced memory of one call in MB."""
+    function()
+    best = float("inf")
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - tic)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak/2**20
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the TWI kernel backends.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 4096], help="Block sizes in pixels (square).")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed repetitions.")
+    args = parser.parse_args(argv)
+
+    backends = [name for name in TWI_BACKENDS if name == "numpy" or importlib.util.find_spec(name) is not None]
+    print(f"{'size':>6} {'implementation':<16}{'time':>10}{'peak':>11}{'max diff':>11}")
+    for size in args.sizes:
+        flow_accumulation, slope_degrees = synthetic_block(size)
+        reference = twi_float64(flow_accumulation, slope_degrees)
+        wall, peak = measure(lambda: twi_float64(flow_accumulation, slope_degrees), args.repeat)
+        print(f"{size:>6} {'float64 (old)':<16}{wall:>9.3f}s{peak:>8.1f} MB{0:>11.2e}")
+
+        out = np.empty(flow_accumulation.shape, dtype=np.float32)
+        for backend in backends:
+            wall, peak = measure(lambda: twi_kernel(flow_accumulation, slope_degrees, out=out, backend=backend), args.repeat)
+            difference = np.nanmax(np.abs(out - reference))
+            print(f"{size:>6} {backend:<16}{wall:>9.3f}s{peak:>8.1f} MB{difference:>11.2e}")
+
+if __name__ == "__main__":
+    main()
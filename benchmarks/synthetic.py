@@ -0,0 +1,172 @@
+"""Synthetic inputs for offline benchmarks: Sentinel-2 L2A style zip archives, a local directory
+of Copernicus style DEM tiles and a randomly initialised MainNET checkpoint."""
+import math
+import zipfile
+from pathlib import Path
+import numpy as np
+from osgeo import gdal, osr
+from floodsens.constants import EXTRACT_LIST
+
+EPSG = 32632
+ORIGIN = (300000.0, 5600000.0)
+SENSING_TIME = "20230115T103421"
+TILE_ID = "T32ULV"
+
+
+def _band_driver():
+    """Sentinel-2 bands are JPEG2000. GDAL opens files by content, so GeoTIFF is used when the
+    JP2OpenJPEG driver is missing."""
+    driver = gdal.GetDriverByName("JP2OpenJPEG")
+    if driver is not None:
+        return driver, ["QUALITY=100", "REVERSIBLE=YES"]
+    return gdal.GetDriverByName("GTiff"), []
+
+def _write_band(out_path, array, resolution, epsg=EPSG, origin=ORIGIN):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+
+    data_type = gdal.GDT_UInt16 if array.dtype == np.uint16 else gdal.GDT_Byte
+    mem_ds = gdal.GetDriverByName("MEM").Create("", array.shape[1], array.shape[0], 1, data_type)
+    mem_ds.SetProjection(srs.ExportToWkt())
+    mem_ds.SetGeoTransform((origin[0], resolution, 0, origin[1], 0, -resolution))
+    mem_ds.GetRasterBand(1).WriteArray(array)
+
+    driver, options = _band_driver()
+    driver.CreateCopy(str(out_path), mem_ds, options=options)
+    mem_ds = None
+
+def _reflectance(shape, rng):
+    """Smooth reflectance field with a water body so that NDWI and the model see some structure."""
+    rows, cols = np.mgrid[0:shape[0], 0:shape[1]].astype(np.float32)
+    field = 1500 + 800*np.sin(rows/shape[0]*3*math.pi) * np.cos(cols/shape[1]*2*math.pi)
+    field += rng.normal(0, 50, shape).astype(np.float32)
+    water = (rows - shape[0]/2)**2 + (cols - shape[1]/3)**2 < (min(shape)/5)**2
+    field[water] = 300
+    return np.clip(field, 1, 10000).astype(np.uint16)
+
+def make_sentinel2_archive(out_dir, size=976, seed=0, extract_list=EXTRACT_LIST, tci=True):
+    """Create a Sentinel-2 L2A style zip archive with size x size pixels at 10 m.
+
+    Arguments:
+        out_dir {str, Path} -- Folder in which the archive is written.
+        (optional) size {int} -- Scene size in 10 m pixels. 20 m bands get size/2 pixels.
+        (optional) seed {int} -- Seed of the random generator.
+        (optional) extract_list {tuple} -- (band, resolution) pairs to include.
+        (optional) tci {bool} -- Include a 10 m true color image (used for label rasterization).
+
+    Returns:
+        zip_path {Path} -- Path to the archive."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    product = f"S2A_MSIL2A_{SENSING_TIME}_N0509_R108_{TILE_ID}_{SENSING_TIME[:8]}T140000"
+    granule = f"{product}.SAFE/GRANULE/L2A_{TILE_ID}_A000000_{SENSING_TIME}/IMG_DATA"
+    staging = out_dir/f"{product}_staging"
+    staging.mkdir(exist_ok=True)
+
+    members = []
+    bands = list(extract_list) + ([("TCI", "10m")] if tci else [])
+    for band, resolution in bands:
+        pixel_size = int(resolution[:-1])
+        shape = (size*10//pixel_size, size*10//pixel_size)
+        array = _reflectance(shape, rng)
+        if band == "TCI":
+            array = (array // 40).astype(np.uint8)
+
+        name = f"{TILE_ID}_{SENSING_TIME}_{band}_{resolution}.jp2"
+        _write_band(staging/name, array, pixel_size)
+        members.append((staging/name, f"{granule}/R{resolution}/{name}"))
+
+    zip_path = out_dir/f"{product}.zip"
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as archive:
+        for file_path, member in members:
+            archive.write(file_path, member)
+            file_path.unlink()
+    staging.rmdir()
+
+    return zip_path
+
+def _dem_prefix(lat, lon):
+    n_letter = "N" if lat >= 0 else "S"
+    e_letter = "E" if lon >= 0 else "W"
+    return f"Copernicus_DSM_COG_10_{n_letter}{abs(lat):02d}_00_{e_letter}{abs(lon):03d}_00_DEM"
+
+def make_dem_directory(out_dir, zip_path, pixels_per_degree=600, margin=2):
+    """Create a local stand-in for the Copernicus DEM bucket covering the footprint of the archive
+    plus margin degrees in every direction. Tiles are written as COGs at <prefix>/<prefix>.tif.
+
+    Arguments:
+        out_dir {str, Path} -- Folder in which the DEM tiles are written.
+        zip_path {str, Path} -- Synthetic archive whose footprint must be covered.
+        (optional) pixels_per_degree {int} -- Resolution of the synthetic tiles (3600 for the real 30 m DEM).
+        (optional) margin {int} -- Number of extra 1 degree tiles in every direction.
+
+    Returns:
+        out_dir {Path} -- Path to the DEM directory."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    with zipfile.ZipFile(zip_path, "r") as archive:
+        member = [x for x in archive.namelist() if "B02" in x][0]
+    ds = gdal.Open(f"/vsizip/{zip_path}/{member}")
+    gt = ds.GetGeoTransform()
+    corners = [(gt[0], gt[3]), (gt[0] + gt[1]*ds.RasterXSize, gt[3] + gt[5]*ds.RasterYSize)]
+
+    source = osr.SpatialReference()
+    source.ImportFromWkt(ds.GetProjection())
+    target = osr.SpatialReference()
+    target.ImportFromEPSG(4326)
+    target.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    source.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(source, target)
+    lonlat = [transform.TransformPoint(x, y)[:2] for x, y in corners]
+    ds = None
+
+    lons = [int(math.floor(lon)) for lon, _ in lonlat]
+    lats = [int(math.floor(lat)) for _, lat in lonlat]
+
+    driver = gdal.GetDriverByName("COG") or gdal.GetDriverByName("GTiff")
+    rows, cols = np.mgrid[0:pixels_per_degree, 0:pixels_per_degree].astype(np.float32) / pixels_per_degree
+    for lat in range(min(lats) - margin, max(lats) + margin + 1):
+        for lon in range(min(lons) - margin, max(lons) + margin + 1):
+            prefix = _dem_prefix(lat, lon)
+            tile_path = out_dir/prefix/f"{prefix}.tif"
+            if tile_path.exists():
+                continue
+            tile_path.parent.mkdir(exist_ok=True)
+
+            # Smooth hills and valleys, continuous across tile borders
+            y, x = lat + 1 - rows, lon + cols
+            elevation = 300 + 120*np.sin(3*x) * np.cos(2*y) + 40*np.sin(11*x + 7*y)
+
+            mem_ds = gdal.GetDriverByName("MEM").Create("", pixels_per_degree, pixels_per_degree, 1, gdal.GDT_Float32)
+            mem_ds.SetProjection(target.ExportToWkt())
+            mem_ds.SetGeoTransform((lon, 1/pixels_per_degree, 0, lat + 1, 0, -1/pixels_per_degree))
+            mem_ds.GetRasterBand(1).WriteArray(elevation.astype(np.float32))
+            driver.CreateCopy(str(tile_path), mem_ds)
+            mem_ds = None
+
+    return out_dir
+
+def make_model_checkpoint(out_path, in_channels=14, seed=0):
+    """Save a randomly initialised MainNET checkpoint in the format expected by FloodsensModel.
+
+    Arguments:
+        out_path {str, Path} -- Path of the .tar checkpoint.
+        (optional) in_channels {int} -- Number of input channels.
+        (optional) seed {int} -- Seed for the weight initialisation.
+
+    Returns:
+        out_path {Path} -- Path to the checkpoint."""
+    import torch
+    from floodsens._network import MainNET
+
+    torch.manual_seed(seed)
+    model = MainNET(in_channels=in_channels, out_channels=1)
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    torch.save({"model_state_dict": model.state_dict(),
+                "model_means": [1000.0]*in_channels,
+                "model_stds": [500.0]*in_channels}, out_path)
+    return out_path
@@ -1,6 +1,17 @@
 """FloodSENS Inference library. For intended use import floodsens.project to get
 started.
+
+Submodules are imported on first access (e.g. floodsens.inference) so that
+`import floodsens` does not pull in torch, GDAL or pysheds.
 """
-import floodsens.inference as inference
-import floodsens.preprocessing as preprocessing
-import floodsens.project as project
\ No newline at end of file
+import importlib
+
+_SUBMODULES = ("inference", "preprocessing", "project", "event", "model", "ndwi", "label", "utils")
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        module = importlib.import_module(f"{__name__}.{name}")
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,101 +1,197 @@
 """Module containing all DEM related functions. Includes download and processing."""
-import subprocess
+import uuid
+import importlib.util
 from pathlib import Path
 from pysheds.grid import Grid
-import pysheds.io
+from pysheds.sview import Raster, ViewFinder
 import numpy as np
 from osgeo import gdal
 from osgeo import gdalconst
 import demloader as dl
 from floodsens.logger import logger
 
-def download_dem(s2_path, out_dir, out_name="10_DEM.tif"):
-    """Download DEM from AWS and return path to file.
+def download_dem(s2_path, out_dir, out_name="10_DEM.tif", dem_dir=None):
+    """Download DEM from AWS and return path to file. If dem_dir is given, the DEM tiles
+    are read from this local directory instead, which mirrors the bucket layout
+    (<prefix>/<prefix>.tif). Used for offline runs and benchmarks.
 
     Parameters:
         s2_path (str): Path to Sentinel-2 file
         out_dir (str): Path to output directory
         out_name (str): Name of output file
+        dem_dir (str): Path to local directory with DEM tiles
 
     Returns:
         dem_path (str): Path to DEM file"""
     prefixes = dl.prefixes.get_from_raster(s2_path, 30)
+    if dem_dir is not None:
+        return dem_from_directory(prefixes, dem_dir, f"{out_dir}/{out_name}")
+
     dem_path = dl.download.from_aws(prefixes, 30, f"{out_dir}/{out_name}")
     return dem_path
 
-def slope(dem_path, out_dir, out_name="11_Slope.tif"):
-    """Calculate slope using gdaldem and write to disk. Return path to file.
-    
+def dem_from_directory(prefixes, dem_dir, out_path):
+    """Mosaic DEM tiles for the given prefixes from a local directory and return path to file.
+
     Parameters:
-        dem_path (str): Path to DEM file
-        out_dir (str): Path to output directory
-        out_name (str): Name of output file
-    
-    Returns:
+        prefixes (list): DEM tile prefixes as used in the Copernicus bucket
+        dem_dir (str): Path to local directory with DEM tiles
         out_path (str): Path to output file
-        """
-    out_path = Path(out_dir)/out_name
-    subprocess.call(['gdaldem', 'slope', '-p', str(dem_path), str(out_path)])
-    return out_path
 
-def flow_accumulation(dem_path, out_dir, out_name="12_Flowaccumulation.tif"):
-    """
-    Calculate flow accumulation using pysheds and write to disk. Return path to file.
-
-    Parameters:
-        dem_path (str): Path to DEM file
-        out_dir (str): Path to output directory
-        out_name (str): Name of output file
-    
     Returns:
-        out_path (str): Path to output file
-    """
-    dem_path = str(dem_path)
-    grid = Grid.from_raster(dem_path)
-    logger.debug("Grid created")
-    dem = grid.read_raster(dem_path)
-    dem = grid.fill_depressions(dem)
-    dem = grid.resolve_flats(dem)
-    dem = grid.flowdir(dem)
-    flowaccumulation = grid.accumulation(dem)
-    logger.debug(f"Flow accumulation calculated with shape: {flowaccumulation.shape}")
+        out_path (str): Path to output file"""
+    dem_dir = Path(dem_dir)
+    tiles = []
+    for prefix in prefixes:
+        prefix = Path(prefix).name
+        tile_path = dem_dir/prefix/f"{prefix}.tif"
+        if tile_path.exists():
+            tiles.append(str(tile_path))
+        else:
+            logger.debug(f"DEM tile {prefix} not found in {dem_dir}")
 
-    out_path = f"{out_dir}/{out_name}"
-    pysheds.io.to_raster(flowaccumulation, out_path)
-    logger.info("Flow accumulation written to disk at " + str(out_path) + "!")
+    if len(tiles) == 0:
+        raise FileNotFoundError(f"None of the DEM tiles {prefixes} found in {dem_dir}")
+
+    # Unique per call, events may build their DEM concurrently in one process
+    vrt_path = f"/vsimem/local_dem_{uuid.uuid4().hex}.vrt"
+    vrt = gdal.BuildVRT(vrt_path, tiles)
+    gdal.Translate(str(out_path), vrt)
+    vrt = None
+    gdal.Unlink(vrt_path)
 
     return out_path
 
-def hand(dem_path, out_dir, out_name="13_HAND.tif"):
-    """Calculate HAND using pysheds and write to disk. Return path to file.
-    
+def _write_like(array, reference_ds, out_path, nodata=None, block_rows=1024):
+    """Write array as a float32 GeoTIFF on the grid of reference_ds in blocks of block_rows lines,
+    so only one block is converted to float32 at a time. Return path to file."""
+    driver = gdal.GetDriverByName("GTiff")
+    outds = driver.Create(str(out_path), reference_ds.RasterXSize, reference_ds.RasterYSize, 1, gdal.GDT_Float32)
+    outds.SetGeoTransform(reference_ds.GetGeoTransform())
+    outds.SetProjection(reference_ds.GetProjection())
+    outband = outds.GetRasterBand(1)
+    for row in range(0, array.shape[0], block_rows):
+        outband.WriteArray(np.asarray(array[row:row+block_rows], dtype=np.float32), 0, row)
+    if nodata is not None:
+        outband.SetNoDataValue(float(nodata))
+    outband = None
+    outds = None
+    return Path(out_path)
+
+def flow_routing(dem_path, out_dir, fa_name="12_Flowaccumulation.tif", hand_name="13_HAND.tif"):
+    """Calculate flow accumulation and HAND from a single hydrological conditioning of the DEM
+    (fill depressions, resolve flats, flow direction) and write both as float32. The DEM is read as
+    float32, intermediate arrays are released as soon as they are no longer needed and the outputs
+    are written block by block from the pysheds arrays.
+
     Parameters:
         dem_path (str): Path to DEM file
         out_dir (str): Path to output directory
-        out_name (str): Name of output file
-    
+        fa_name (str): Name of flow accumulation file
+        hand_name (str): Name of HAND file
+
     Returns:
-        out_path (str): Path to output file"""
-    dem_path = str(dem_path)
+        fa_path, hand_path (Path, Path): Paths to output files"""
+    dem_path, out_dir = str(dem_path), Path(out_dir)
+    reference = gdal.Open(dem_path, gdal.GA_ReadOnly)
+
     grid = Grid.from_raster(dem_path)
-    dem = gdal.Open(str(dem_path), gdal.GA_ReadOnly).ReadAsArray()
-    dem = grid.read_raster(dem_path)
+    band = reference.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    viewfinder = ViewFinder(**{**grid.viewfinder.properties, "nodata": np.float32(nodata if nodata is not None else 0)})
+    dem = Raster(band.ReadAsArray(buf_type=gdal.GDT_Float32), viewfinder)
+    band = None
     dem = grid.fill_depressions(dem)
     dem = grid.resolve_flats(dem)
     flow_direction = grid.flowdir(dem)
-    flow_accumulation_raster = grid.accumulation(flow_direction)
+    accumulation = grid.accumulation(flow_direction)
+    fa_path = _write_like(accumulation, reference, out_dir/fa_name, nodata=getattr(accumulation, "nodata", None))
+    logger.info(f"Flow accumulation written to disk at {fa_path}!")
 
-    hand_raster = grid.compute_hand(flow_direction, dem, flow_accumulation_raster>1)
+    channels = accumulation > 1
+    del accumulation
+    hand_raster = grid.compute_hand(flow_direction, dem, channels)
+    del flow_direction, channels, dem
+    hand_path = _write_like(hand_raster, reference, out_dir/hand_name, nodata=getattr(hand_raster, "nodata", None))
+    logger.info(f"HAND calculated and written to disk at {hand_path}!")
 
-    out_path = f"{out_dir}/{out_name}"
-    pysheds.io.to_raster(hand_raster, out_path)
-    logger.info(f"HAND calculated and written to disk at {out_path}!")
+    del hand_raster
+    reference = None
+    return fa_path, hand_path
 
-    return out_path
+def _twi_numpy(flow_accumulation, slope_degrees, out):
+    flat = slope_degrees == 0
+    valid = (slope_degrees > 0) & (flow_accumulation > 0)
+    np.radians(slope_degrees, out=out)
+    np.tan(out, out=out, where=valid)
+    np.divide(flow_accumulation, out, out=out, where=valid)
+    np.log(out, out=out, where=valid)
+    out[~valid] = np.nan
+    out[flat] = 0
+    return out
+
+def _twi_numexpr(flow_accumulation, slope_degrees, out):
+    import numexpr
+    constants = {"zero": np.float32(0), "nan": np.float32(np.nan), "radians": np.float32(np.pi/180)}
+    return numexpr.evaluate("where(slope == zero, zero, where((slope < zero) | (fa <= zero), nan, log(fa / tan(slope * radians))))",
+                            local_dict={"fa": flow_accumulation, "slope": slope_degrees, **constants}, out=out, casting="same_kind")
+
+_numba_twi = None
+
+def _twi_numba(flow_accumulation, slope_degrees, out):
+    global _numba_twi
+    if _numba_twi is None:
+        import numba
+
+        @numba.njit(nogil=True)
+        def kernel(fa, slope, out):
+            radians = np.float32(np.pi/180)
+            for i in range(fa.shape[0]):
+                for k in range(fa.shape[1]):
+                    if slope[i, k] == 0:
+                        out[i, k] = 0
+                    elif slope[i, k] < 0 or fa[i, k] <= 0:
+                        out[i, k] = np.nan
+                    else:
+                        out[i, k] = np.log(fa[i, k] / np.tan(slope[i, k]*radians))
+            return out
+        _numba_twi = kernel
+    return _numba_twi(flow_accumulation, slope_degrees, out)
+
+TWI_BACKENDS = {"numpy": _twi_numpy, "numexpr": _twi_numexpr, "numba": _twi_numba}
+
+def twi_backend():
+    """Fastest available TWI backend: numexpr, numba or numpy."""
+    for name in ("numexpr", "numba"):
+        if importlib.util.find_spec(name) is not None:
+            return name
+    return "numpy"
+
+def twi_kernel(flow_accumulation, slope_degrees, out=None, backend=None):
+    """TWI = ln(FA / tan(slope)) of a block in float32, written to out. Cells with zero slope get 0,
+    cells with negative slope or non-positive flow accumulation (nodata) get NaN. Logarithm and
+    tangent are only evaluated on valid cells and no full-size temporaries are created apart from
+    two boolean masks (numpy backend).
 
-def twi(dem_path, flow_accumulation_path, out_dir, out_name="14_TWI.tif", save_slope=True):
-    """Calculate TWI using pysheds and write to disk. Return path to file.
+    Parameters:
+        flow_accumulation (ndarray): Flow accumulation, float32
+        slope_degrees (ndarray): Slope in degrees, float32
+        out (ndarray): Optional float32 output array of the same shape
+        backend (str): "numpy", "numexpr" or "numba". Defaults to the fastest available.
+
+    Returns:
+        out (ndarray): TWI"""
+    if out is None:
+        out = np.empty(flow_accumulation.shape, dtype=np.float32)
+    if backend is None:
+        backend = twi_backend()
+    return TWI_BACKENDS[backend](flow_accumulation, slope_degrees, out)
+
+def twi(dem_path, flow_accumulation_path, out_dir, out_name="14_TWI.tif", save_slope=True, block_rows=1024):
+    """Calculate TWI and write to disk. Return path to file.
     Computes slope as a by-product which is saved to disk if save_slope is True.
+    Slope is computed by GDAL, which streams the DEM with a 3x3 window, and TWI is computed in
+    blocks of block_rows lines, so memory does not grow with the DEM size.
     
     Parameters:
         dem_path (str): Path to DEM file
@@ -103,40 +199,42 @@ def twi(dem_path, flow_accumulation_path, out_dir, out_name="14_TWI.tif", save_s
         out_dir (str): Path to output directory
         out_name (str): Name of output file
         save_slope (bool): Save slope to disk or not
+        block_rows (int): Number of lines processed at once
         
     Returns:
         out_path (str): Path to output file"""
-    dem_path = str(dem_path)
-    flow_accumulation_array = gdal.Open(str(flow_accumulation_path), gdal.GA_ReadOnly).ReadAsArray()
     dem = gdal.Open(str(dem_path), gdal.GA_ReadOnly)
-
-    if save_slope:
-        slope_degrees = gdal.DEMProcessing(f"{out_dir}/11_Slope.tif", dem, "slope", computeEdges=True)
-    else:
-        slope_path = f"{str(out_dir)}/_twi_slope.tif"
-        slope_degrees = gdal.DEMProcessing(slope_path, dem, "slope", computeEdges=True)
-        Path(slope_path).unlink()
-
-    slope_degrees_array = slope_degrees.ReadAsArray()
-    slope_radians_array = np.radians(slope_degrees_array)
-
-    # twi_array = np.where(flow_accumulation_array==0, 0, np.log(flow_accumulation_array/np.tan(slope_radians_array)))
-    twi_array = np.where(slope_radians_array==0, 0, np.log(flow_accumulation_array/np.tan(slope_radians_array)))
+    slope_path = f"{out_dir}/11_Slope.tif" if save_slope else f"{out_dir}/_twi_slope.tif"
+    slope_ds = gdal.DEMProcessing(slope_path, dem, "slope", computeEdges=True)
+    fa_ds = gdal.Open(str(flow_accumulation_path), gdal.GA_ReadOnly)
 
     out_path = f"{out_dir}/{out_name}"
     driver = gdal.GetDriverByName("GTiff")
     driver.Register()
 
-    outds = driver.Create(str(out_path), dem.RasterXSize, dem.RasterYSize, 1, gdal.GDT_Float32)
+    xsize, ysize = dem.RasterXSize, dem.RasterYSize
+    outds = driver.Create(str(out_path), xsize, ysize, 1, gdal.GDT_Float32)
     outds.SetGeoTransform(dem.GetGeoTransform())
     outds.SetProjection(dem.GetProjection())
-
     outband = outds.GetRasterBand(1)
-    outband.WriteArray(twi_array)
     outband.SetNoDataValue(np.nan)
-    outband.FlushCache()
-    outband=0
-    outds=0
+
+    # Block buffers are allocated once and reused, GDAL converts to float32 on read
+    slope_band, fa_band = slope_ds.GetRasterBand(1), fa_ds.GetRasterBand(1)
+    backend = twi_backend()
+    fa_buffer, slope_buffer, twi_buffer = (np.empty((min(block_rows, ysize), xsize), dtype=np.float32) for _ in range(3))
+    for row in range(0, ysize, block_rows):
+        rows = min(block_rows, ysize - row)
+        fa_band.ReadAsArray(0, row, xsize, rows, buf_obj=fa_buffer[:rows])
+        slope_band.ReadAsArray(0, row, xsize, rows, buf_obj=slope_buffer[:rows])
+        outband.WriteArray(twi_kernel(fa_buffer[:rows], slope_buffer[:rows], out=twi_buffer[:rows], backend=backend), 0, row)
+
+    outband = None
+    outds = None
+    slope_band, fa_band = None, None
+    slope_ds, fa_ds, dem = None, None, None
+    if not save_slope:
+        Path(slope_path).unlink()
 
     return out_path
 
@@ -0,0 +1,23 @@
+"""Deferred imports. Modules depending on torch, GDAL, pysheds or pandas are only executed when one
+of their attributes is first used, so importing floodsens and managing projects stays fast."""
+import sys
+import importlib.util
+
+
+def lazy_import(name):
+    """Return module name, executing it on first attribute access instead of now.
+
+    Arguments:
+        name {str} -- Fully qualified module name, e.g. "floodsens.inference"."""
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
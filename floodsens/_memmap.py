@@ -0,0 +1,131 @@
+"""Merged stack stored as uncompressed, band-interleaved-by-pixel (BIP) memmaps, one per part of the
+stack, with a JSON sidecar holding the grid, parts, band information and tile windows. Windows are
+read as NumPy arrays of shape (rows, cols, bands), the layout tifffile returns for GeoTIFF tiles, so
+inference treats both sources alike. Windows of a single part are zero-copy views. Intended for
+scratch folders on local NVMe disks."""
+import json
+from pathlib import Path
+import numpy as np
+
+
+def write_memmap(raster_paths, out_dir, tile_size, data_type="stacked", mask_path=None, min_valid_fraction=0.0, block_rows=1024):
+    """
+    Write the rasters at raster_paths, the parts of a stack on the same grid, as memmaps
+    <out_dir>/<data_type>.bip, <out_dir>/<data_type>_part1.bip, ... with sidecar
+    <out_dir>/<data_type>.json. Every part keeps its storage type, half precision rasters
+    (NBITS=16) are stored as float16.
+
+    Arguments:
+        raster_paths (str, Path or list):
+            Raster (or VRT) to convert, or the parts of the merged stack in band order
+        out_dir (str or Path):
+            Folder of the memmap and sidecar
+        tile_size (int):
+            Size of the tile windows listed in the sidecar
+        data_type (str):
+            Name of the memmap and sidecar
+        mask_path (str or Path):
+            Optional validity mask, windows with at most "min_valid_fraction"
+            valid pixels are not listed
+        block_rows (int):
+            Number of rows copied at once
+
+    Returns:
+        sidecar_path (Path):
+            Path to the JSON sidecar, accepted by inference in place of a tiles folder
+    """
+    from osgeo import gdal
+    from floodsens._tile import read_mask_window, storage_dtype
+
+    if isinstance(raster_paths, (str, Path)):
+        raster_paths = [raster_paths]
+    out_dir = Path(out_dir)
+    out_dir.mkdir(exist_ok=True, parents=True)
+    sidecar_path = out_dir/f"{data_type}.json"
+
+    parts, band_info = [], []
+    for k, raster_path in enumerate(raster_paths):
+        data_path = out_dir/(f"{data_type}.bip" if k == 0 else f"{data_type}_part{k}.bip")
+        ds = gdal.Open(str(raster_path))
+        gt, proj = ds.GetGeoTransform(), ds.GetProjection()
+        xsize, ysize, bands = ds.RasterXSize, ds.RasterYSize, ds.RasterCount
+        first_band = ds.GetRasterBand(1)
+        dtype, nodata = np.dtype(storage_dtype(first_band)), first_band.GetNoDataValue()
+
+        array = np.memmap(data_path, dtype=dtype, mode="w+", shape=(ysize, xsize, bands))
+        for row in range(0, ysize, block_rows):
+            rows = min(block_rows, ysize - row)
+            block = ds.ReadAsArray(0, row, xsize, rows)
+            if bands == 1:
+                block = block[None]
+            array[row:row+rows] = np.moveaxis(block, 0, -1)
+        array.flush()
+        del array
+
+        for index in range(bands):
+            band = ds.GetRasterBand(index+1)
+            band_info.append({"name": band.GetDescription(), "scale": band.GetScale() or 1.0, "nodata": nodata})
+        parts.append({"data": data_path.name, "dtype": dtype.name, "shape": [ysize, xsize, bands], "nodata": nodata})
+        first_band = None
+        ds = None
+
+    mask_ds = gdal.Open(str(mask_path)) if mask_path is not None else None
+    tiles = []
+    for row in range(0, ysize - tile_size + 1, tile_size):
+        for col in range(0, xsize - tile_size + 1, tile_size):
+            tile_gt = (gt[0]+col*gt[1], gt[1], gt[2], gt[3]+row*gt[5], gt[4], gt[5])
+            if mask_ds is not None and read_mask_window(mask_ds, tile_gt, tile_size).mean() <= min_valid_fraction:
+                continue
+            tiles.append([f"Tile_{row}-{col}", row, col])
+    mask_ds = None
+
+    sidecar = {"interleave": "BIP", "parts": parts, "geotransform": list(gt), "projection": proj,
+               "tile_size": tile_size, "bands": band_info, "tiles": tiles}
+    with open(sidecar_path, "w") as ostream:
+        json.dump(sidecar, ostream)
+
+    return sidecar_path
+
+def tile_names(input_tiles):
+    """Sorted names of the tiles of a tiles folder or of a memmap stack (given by its sidecar)."""
+    input_tiles = Path(input_tiles)
+    if input_tiles.suffix == ".json":
+        with open(input_tiles, "r") as istream:
+            return sorted(name for name, _, _ in json.load(istream)["tiles"])
+    return sorted(x.stem for x in input_tiles.iterdir())
+
+
+class MemmapStack():
+    """Read-only view of a memmap stack written by write_memmap.
+
+    Arguments:
+        sidecar_path {str, Path} -- Path to the JSON sidecar.
+
+    Methods:
+        window -- (rows, cols, bands) array of a tile, a zero-copy view for a single part.
+        georeference -- Geotransform, projection and size of a tile."""
+    def __init__(self, sidecar_path):
+        self.sidecar_path = Path(sidecar_path)
+        with open(self.sidecar_path, "r") as istream:
+            info = json.load(istream)
+        self.geotransform = tuple(info["geotransform"])
+        self.projection = info["projection"]
+        self.tile_size = info["tile_size"]
+        self.offsets = {name: (row, col) for name, row, col in info["tiles"]}
+        self.names = sorted(self.offsets)
+        self.arrays = [np.memmap(self.sidecar_path.with_name(part["data"]), dtype=part["dtype"], mode="r", shape=tuple(part["shape"]))
+                       for part in info["parts"]]
+
+    def __repr__(self) -> str:
+        bands = sum(x.shape[-1] for x in self.arrays)
+        return f'{self.__class__.__name__}({self.sidecar_path}, {len(self.arrays)} parts, {bands} bands, {len(self.names)} tiles)'
+
+    def window(self, name):
+        row, col = self.offsets[name]
+        windows = [x[row:row+self.tile_size, col:col+self.tile_size] for x in self.arrays]
+        return windows[0] if len(windows) == 1 else np.concatenate(windows, axis=-1)
+
+    def georeference(self, name):
+        row, col = self.offsets[name]
+        gt = self.geotransform
+        return (gt[0]+col*gt[1], gt[1], gt[2], gt[3]+row*gt[5], gt[4], gt[5]), self.projection, self.tile_size
@@ -1,14 +1,19 @@
+import os
 from osgeo import gdal
 from osgeo import gdalconst
+from osgeo import osr
 from pathlib import Path
 import numpy as np
 
+WARP_THREADS = "ALL_CPUS"
+WARP_MEMORY_MB = 512
+
 
 def _get_information(raster_path):
     """
     Extracts geotransform, projection, nan value and output boundaries from
-    raster and returns it in a dictionary which also includes the raster
-    itself.
+    raster and returns it in a dictionary. The dataset is closed before
+    returning, no GDAL handle is kept alive.
 
     Parameters
     ----------
@@ -19,100 +24,191 @@ def _get_information(raster_path):
     ----------
     information :   dict
                     dictionary containing the following key, value pairs:
-                        "raster": raster (gdal.Dataset)
+                        "path": raster_path (Path)
                         "projection": projection (str)
                         "geotransform": geotransform (tuple, 6 values)
                         "output_bounds": outputBbox (tuple, 4 values)
+                        "size": (columns, rows) (tuple, 2 values)
                         "nan_value": raster_NA_value (nan or int or float)
+                        "data_type": data type of the first band (int)
     """
     if not Path(raster_path).exists():
-        print(f"{raster_path} does not exist!")
+        raise FileNotFoundError(f"{raster_path} does not exist!")
     raster = gdal.Open(str(raster_path), gdal.GA_ReadOnly)
     if raster is None:
-        print(f"Opening {raster_path} failed resulting in NoneType")
-    raster_band1 = raster.GetRasterBand(1)
-    projection = raster.GetProjection()
-    geotransform = raster.GetGeoTransform()
-
-    raster_NA_value = raster_band1.GetNoDataValue()
+        raise RuntimeError(f"Opening {raster_path} failed resulting in NoneType")
+    try:
+        raster_band1 = raster.GetRasterBand(1)
+        projection = raster.GetProjection()
+        geotransform = raster.GetGeoTransform()
+        raster_NA_value = raster_band1.GetNoDataValue()
+        data_type = raster_band1.DataType
+        size = (raster.RasterXSize, raster.RasterYSize)
+        raster_band1 = None
+    finally:
+        raster = None
 
     minX, maxY = geotransform[0], geotransform[3]
-    maxX = minX + geotransform[1] * raster.RasterXSize
-    minY = maxY + geotransform[5] * raster.RasterYSize
+    maxX = minX + geotransform[1] * size[0]
+    minY = maxY + geotransform[5] * size[1]
 
     outputBbox = (minX, minY, maxX, maxY)
 
     information = {
-        "raster": raster,
-        "path": Path(raster.GetDescription()),
+        "path": Path(raster_path),
         "projection": projection,
         "geotransform": geotransform,
         "output_bounds": outputBbox,
-        "nan_value": raster_NA_value
+        "size": size,
+        "nan_value": raster_NA_value,
+        "data_type": data_type
     }
 
     return information
 
+
+class WarpPlan():
+    """
+    Target grid (projection, bounds, resolution) and warp settings computed
+    once and applied to any number of rasters. Rasters already on the target
+    grid with a matching nodata value are only converted, not warped.
+
+    Parameters
+    ----------
+    projection :    str
+                    WKT of the target projection
+    output_bounds : tuple
+                    (minX, minY, maxX, maxY) of the target grid
+    x_res, y_res :  float
+                    target resolution
+    nan_value :     int or float
+                    nodata value of the outputs
+    output_type :   int
+                    GDAL data type of the outputs
+    resampling :    str
+                    default resampling algorithm, e.g. "bilinear" or "near"
+    num_threads :   str or int
+                    NUM_THREADS of the GDAL warper
+    warp_memory :   int
+                    warp memory limit in MB
+    """
+    def __init__(self, projection, output_bounds, x_res, y_res, nan_value=-9999, output_type=gdalconst.GDT_Float32,
+                 resampling="bilinear", num_threads=WARP_THREADS, warp_memory=WARP_MEMORY_MB):
+        self.projection = projection
+        self.output_bounds = tuple(output_bounds)
+        self.x_res, self.y_res = abs(x_res), abs(y_res)
+        self.nan_value = nan_value
+        self.output_type = output_type
+        self.resampling = resampling
+        self.num_threads = num_threads
+        self.warp_memory = warp_memory
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.output_bounds}, {self.x_res}, {self.y_res}, {self.resampling})'
+
+    @classmethod
+    def from_raster(cls, target_path, nan_value=-9999, x_res=None, y_res=None, **kwargs):
+        """
+        Plan for the grid of the raster at target_path. x_res and y_res
+        override the resolution of the target raster.
+        """
+        information = _get_information(target_path)
+        if x_res is None: x_res = information["geotransform"][1]
+        if y_res is None: y_res = information["geotransform"][5]
+        if nan_value is None: nan_value = np.nan
+        return cls(information["projection"], information["output_bounds"], x_res, y_res, nan_value=nan_value, **kwargs)
+
+    def is_aligned(self, information):
+        """True if a raster (as returned by _get_information) already lies on the target grid."""
+        geotransform = information["geotransform"]
+        if geotransform[2] != 0 or geotransform[4] != 0:
+            return False
+        if not np.isclose(abs(geotransform[1]), self.x_res) or not np.isclose(abs(geotransform[5]), self.y_res):
+            return False
+        if not np.allclose(information["output_bounds"], self.output_bounds):
+            return False
+        source_srs, target_srs = osr.SpatialReference(), osr.SpatialReference()
+        source_srs.ImportFromWkt(information["projection"])
+        target_srs.ImportFromWkt(self.projection)
+        return bool(source_srs.IsSame(target_srs))
+
+    def apply(self, source_path, out_path=None, resampling=None):
+        """
+        Reproject the raster at source_path onto the target grid. The result
+        is written to a temporary file next to out_path and moved into place,
+        so out_path may be the source itself. Returns out_path.
+        """
+        source_path = Path(source_path)
+        out_path = source_path if out_path is None else Path(out_path)
+        tmp_path = out_path.with_name(f"{out_path.stem}.warp{out_path.suffix}")
+        source_information = _get_information(source_path)
+
+        source_nan = source_information["nan_value"]
+        if self.is_aligned(source_information) and (source_nan is None or source_nan == self.nan_value):
+            options = gdal.TranslateOptions(outputType=self.output_type, noData=self.nan_value)
+            out_ds = gdal.Translate(str(tmp_path), str(source_path), options=options)
+        else:
+            options = gdal.WarpOptions(resampleAlg=resampling if resampling is not None else self.resampling,
+                                       srcSRS=source_information["projection"],
+                                       dstSRS=self.projection,
+                                       xRes=self.x_res,
+                                       yRes=self.y_res,
+                                       outputBounds=self.output_bounds,
+                                       srcNodata=source_information["nan_value"],
+                                       dstNodata=self.nan_value,
+                                       outputType=self.output_type,
+                                       multithread=True,
+                                       warpMemoryLimit=self.warp_memory,
+                                       warpOptions=[f"NUM_THREADS={self.num_threads}"])
+            out_ds = gdal.Warp(str(tmp_path), str(source_path), options=options)
+
+        if out_ds is None:
+            raise RuntimeError(f"Reprojecting {source_path} failed.")
+        out_ds = None
+        os.replace(tmp_path, out_path)
+        return out_path
+
+    def apply_all(self, *raster_paths, out_dir=None, resampling=None):
+        """Apply the plan to several rasters. Returns the output paths as strings."""
+        out_paths = []
+        for raster_path in raster_paths:
+            raster_path = Path(raster_path)
+            out_path = raster_path if out_dir is None else Path(out_dir)/raster_path.name
+            out_paths.append(str(self.apply(raster_path, out_path, resampling=resampling)))
+        return out_paths
+
+
 def reproject_from_parameters(source_path, target_information, target_nan, out_dir=None, xRes=None, yRes=None, output_type=gdalconst.GDT_Float32):
     """
-    Reproject raster at source_path based on information provided through 
+    Reproject raster at source_path based on information provided through
     target information which is a dictionary.
     """
+    source_path = Path(source_path)
     if out_dir is None:
         out_dir = source_path.parent
-    source_path = Path(source_path)
-    source_information = _get_information(source_path)
-
-    if xRes is None: xRes = abs(target_information["geotransform"][1]) 
-    if yRes is None: yRes = abs(target_information["geotransform"][5]) 
-
-    aoWarpOptions = gdal.WarpOptions(resampleAlg=gdal.gdalconst.GRA_Bilinear,
-                                     srcSRS=source_information["projection"],
-                                     dstSRS=target_information["projection"],
-                                     xRes=xRes,
-                                     yRes=yRes,
-                                     outputBounds=target_information["output_bounds"],
-                                     srcNodata=source_information["nan_value"],
-                                     dstNodata=target_nan,
-                                     outputType=output_type)
 
-    out_path = out_dir/f"{source_path.name}"
+    if xRes is None: xRes = target_information["geotransform"][1]
+    if yRes is None: yRes = target_information["geotransform"][5]
 
-    reprojected_raster = gdal.Warp(str(out_path),
-                                   source_information["raster"],
-                                   options=aoWarpOptions)
-
-    return out_path
+    plan = WarpPlan(target_information["projection"], target_information["output_bounds"], xRes, yRes,
+                    nan_value=target_nan, output_type=output_type)
+    return plan.apply(source_path, Path(out_dir)/source_path.name)
 
 def reproject_from_raster(source_path, target_path, target_nan, out_dir=None, xRes=None, yRes=None, output_type=gdalconst.GDT_Float32):
     """
     Reprojects raster at source_path and reprojects in using information from
     raster at target_path.
     """
-    source_path, target_path = Path(source_path), Path(target_path)
-    if out_dir is None:
-        out_dir = source_path.parent
-    else:
-        out_dir = Path(out_dir)
-
-    if target_nan is None:
-        # target_nan = float('nan')
-        target_nan = np.nan
+    source_path = Path(source_path)
+    out_dir = source_path.parent if out_dir is None else Path(out_dir)
 
-    target_information = _get_information(target_path)
-    out_path = reproject_from_parameters(source_path, target_information, target_nan, out_dir=out_dir, xRes=xRes, yRes=yRes, output_type=output_type)
-    return out_path
+    plan = WarpPlan.from_raster(target_path, nan_value=target_nan, x_res=xRes, y_res=yRes, output_type=output_type)
+    return plan.apply(source_path, out_dir/source_path.name)
 
 def reproject_set(target_path, nan, *raster_paths, output_type=gdalconst.GDT_Float32):
-    
-    reprojected_rasters = []
-    for raster_path in raster_paths:
-        reprojected_path = reproject_from_raster(
-                                            raster_path, 
-                                            target_path, 
-                                            nan, 
-                                            out_dir=Path(raster_path).parent,
-                                            output_type=output_type)
-        reprojected_rasters.append(str(reprojected_path))
-    
-    return reprojected_rasters
+    """
+    Reprojects all rasters in place onto the grid of the raster at
+    target_path. The warp plan is built once for the whole set.
+    """
+    plan = WarpPlan.from_raster(target_path, nan_value=nan, output_type=output_type)
+    return plan.apply_all(*raster_paths)
@@ -1,9 +1,37 @@
+import uuid
 import numpy as np
 from pathlib import Path
-from osgeo import gdal
-
-
-def singleraster_tiling(tile_size, raster_path, data_type=None):
+from osgeo import gdal, gdal_array
+
+
+def _tile_layout(ds):
+    """Data type and creation options of the tiles of ds, so tiles are stored like their source
+    (e.g. half precision stacks written with NBITS=16)."""
+    band = ds.GetRasterBand(1)
+    nbits = band.GetMetadataItem("NBITS", "IMAGE_STRUCTURE")
+    options = [f"NBITS={nbits}"] if nbits is not None else []
+    return band.DataType, options
+
+def storage_dtype(band):
+    """NumPy name of the storage type of a GDAL band, "float16" for half precision (NBITS=16)."""
+    if band.GetMetadataItem("NBITS", "IMAGE_STRUCTURE") == "16" and band.DataType == gdal.GDT_Float32:
+        return "float16"
+    return np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType)).name
+
+def read_mask_window(mask_ds, tile_gt, tile_size):
+    """Validity mask (uint8, 1 = valid) under a square tile with geotransform tile_gt. The window is
+    located through the geotransforms, pixels outside the mask are invalid."""
+    mask_gt = mask_ds.GetGeoTransform()
+    col = int(round((tile_gt[0] - mask_gt[0])/mask_gt[1]))
+    row = int(round((tile_gt[3] - mask_gt[3])/mask_gt[5]))
+    window = np.zeros((tile_size, tile_size), dtype=np.uint8)
+    c0, r0 = max(col, 0), max(row, 0)
+    c1, r1 = min(col+tile_size, mask_ds.RasterXSize), min(row+tile_size, mask_ds.RasterYSize)
+    if c1 > c0 and r1 > r0:
+        window[r0-row:r1-row, c0-col:c1-col] = mask_ds.ReadAsArray(c0, r0, c1-c0, r1-r0)
+    return window
+
+def singleraster_tiling(tile_size, raster_path, data_type=None, mask_path=None, min_valid_fraction=0.0):
     """
     Tiles raster located at "raster_path" creating tiles of provided "tile_size".
 
@@ -15,34 +43,46 @@ def singleraster_tiling(tile_size, raster_path, data_type=None):
         data_type (str):
             Used to create name for folder containing the tiles. 
             Folder name will be: ./tiles/<data_type>/ 
+        mask_path (str or Path):
+            Optional validity mask (1 = valid), e.g. the cloud mask of
+            preprocessing. Tiles whose valid fraction does not exceed
+            "min_valid_fraction" are not written.
+        min_valid_fraction (float):
+            Tiles with at most this fraction of valid pixels are skipped.
     """
     result_dir = Path(raster_path).parent
     out_dir = result_dir/"tiles"/data_type
     out_dir.mkdir(exist_ok=True, parents=True)
     
     ds = gdal.Open(str(raster_path))
+    mask_ds = gdal.Open(str(mask_path)) if mask_path is not None else None
 
     gt = ds.GetGeoTransform()
     proj = ds.GetProjection()    
     xmax, ymax = ds.RasterXSize, ds.RasterYSize
-    
+    data_type_code, options = _tile_layout(ds)
 
     xi, yi, tile_size = 0, 0, tile_size
     while xi+tile_size <= ymax:
         while yi+tile_size <= xmax:
+            out_gt = (gt[0]+yi*gt[1], gt[1], gt[2],
+                                gt[3]+xi*gt[5],gt[4],gt[5])
+            if mask_ds is not None and read_mask_window(mask_ds, out_gt, tile_size).mean() <= min_valid_fraction:
+                yi += tile_size
+                continue
+
             sarr = ds.ReadAsArray(yi, xi, tile_size, tile_size)
             bands = sarr.shape[0]
             name = f'Tile_{xi}-{yi}.tif'
-            out_gt = (gt[0]+yi*gt[1], gt[1], gt[2],
-                                gt[3]+xi*gt[5],gt[4],gt[5])
 
             driver = gdal.GetDriverByName('GTiff')
             driver.Register()
             outds = driver.Create(f'{out_dir}/{name}',
-                                  xsize=sarr.shape[1],
-                                  ysize=sarr.shape[2],
+                                  xsize=sarr.shape[2],
+                                  ysize=sarr.shape[1],
                                   bands=bands,
-                                  eType=gdal.GDT_Float32)
+                                  eType=data_type_code,
+                                  options=options)
             outds.SetProjection(proj)
             outds.SetGeoTransform(out_gt)
 
@@ -54,7 +94,8 @@ def singleraster_tiling(tile_size, raster_path, data_type=None):
             yi += tile_size
         xi += tile_size
         yi = 0
-    
+
+    mask_ds = None
     return out_dir
 
 
@@ -81,13 +122,12 @@ def singleband_tiling(tile_size, raster_path, data_type=None):
     gt = ds.GetGeoTransform()
     proj = ds.GetProjection()    
     xmax, ymax = ds.RasterXSize, ds.RasterYSize
-    
+    data_type_code = ds.GetRasterBand(1).DataType
 
     xi, yi, tile_size = 0, 0, tile_size
     while xi+tile_size <= ymax:
         while yi+tile_size <= xmax:
             sarr = ds.ReadAsArray(yi, xi, tile_size, tile_size)
-            bands = sarr.shape[0]
             name = f'Tile_{xi}-{yi}.tif'
             out_gt = (gt[0]+yi*gt[1], gt[1], gt[2],
                                 gt[3]+xi*gt[5],gt[4],gt[5])
@@ -95,10 +135,10 @@ def singleband_tiling(tile_size, raster_path, data_type=None):
             driver = gdal.GetDriverByName('GTiff')
             driver.Register()
             outds = driver.Create(f'{out_dir}/{name}',
-                                  xsize=sarr.shape[0],
-                                  ysize=sarr.shape[1],
-                                  bands=bands,
-                                  eType=gdal.GDT_Float32)
+                                  xsize=sarr.shape[1],
+                                  ysize=sarr.shape[0],
+                                  bands=1,
+                                  eType=data_type_code)
             outds.SetProjection(proj)
             outds.SetGeoTransform(out_gt)
             outds.GetRasterBand(1).WriteArray(sarr)
@@ -108,4 +148,108 @@ def singleband_tiling(tile_size, raster_path, data_type=None):
         xi += tile_size
         yi = 0
     
-    return out_dir
\ No newline at end of file
+    return out_dir
+
+def paired_tiling(tile_size, raster_path, label_path, data_type="stacked", label_type="label", mask_path=None, min_valid_fraction=0.0):
+    """
+    Tiles raster located at "raster_path" and label located at "label_path" in a
+    single pass. Both tiles of a pair are read from the same window, so they are
+    spatially aligned and carry the same name. The label is resampled on the fly
+    (nearest neighbour) onto the grid of the raster if the grids differ. Pairs are
+    skipped like the tiles of singleraster_tiling, so training and inference tiles
+    cover the same windows.
+
+    Arguments:
+        tile_size (int):    
+            Size of resulting tiles expressed in number of pixels
+        raster_path (str or Path):  
+            Path to (multiband) raster to be tiled
+        label_path (str or Path):
+            Path to singleband label raster
+        data_type (str):
+            Folder name for the raster tiles: ./tiles/<data_type>/
+        label_type (str):
+            Folder name for the label tiles: ./tiles/<label_type>/
+        mask_path (str or Path):
+            Optional validity mask (1 = valid), e.g. the cloud mask of
+            preprocessing. Pairs whose valid fraction does not exceed
+            "min_valid_fraction" are not written.
+        min_valid_fraction (float):
+            Pairs with at most this fraction of valid pixels are skipped.
+
+    Returns:
+        out_dir, label_out_dir (Path, Path):
+            Folders containing the raster and label tiles
+    """
+    result_dir = Path(raster_path).parent
+    out_dir = result_dir/"tiles"/data_type
+    label_out_dir = result_dir/"tiles"/label_type
+    out_dir.mkdir(exist_ok=True, parents=True)
+    label_out_dir.mkdir(exist_ok=True, parents=True)
+
+    ds = gdal.Open(str(raster_path))
+    gt = ds.GetGeoTransform()
+    proj = ds.GetProjection()
+    xmax, ymax = ds.RasterXSize, ds.RasterYSize
+    bands = ds.RasterCount
+    data_type_code, options = _tile_layout(ds)
+
+    # Unique per call, events may be tiled concurrently in one process
+    aligned_label_path = f"/vsimem/aligned_label_{uuid.uuid4().hex}.vrt"
+    label_ds = gdal.Open(str(label_path))
+    if label_ds.GetGeoTransform() != gt or (label_ds.RasterXSize, label_ds.RasterYSize) != (xmax, ymax):
+        bounds = (gt[0], gt[3]+ymax*gt[5], gt[0]+xmax*gt[1], gt[3])
+        label_ds = gdal.Warp(aligned_label_path, label_ds, format="VRT", dstSRS=proj,
+                             outputBounds=bounds, width=xmax, height=ymax,
+                             resampleAlg=gdal.GRA_NearestNeighbour)
+    mask_ds = gdal.Open(str(mask_path)) if mask_path is not None else None
+
+    driver = gdal.GetDriverByName('GTiff')
+    driver.Register()
+
+    xi, yi = 0, 0
+    while xi+tile_size <= ymax:
+        while yi+tile_size <= xmax:
+            name = f'Tile_{xi}-{yi}.tif'
+            out_gt = (gt[0]+yi*gt[1], gt[1], gt[2],
+                      gt[3]+xi*gt[5], gt[4], gt[5])
+            if mask_ds is not None and read_mask_window(mask_ds, out_gt, tile_size).mean() <= min_valid_fraction:
+                yi += tile_size
+                continue
+
+            sarr = ds.ReadAsArray(yi, xi, tile_size, tile_size)
+            if bands == 1:
+                sarr = sarr[None]
+            outds = driver.Create(f'{out_dir}/{name}',
+                                  xsize=tile_size,
+                                  ysize=tile_size,
+                                  bands=bands,
+                                  eType=data_type_code,
+                                  options=options)
+            outds.SetProjection(proj)
+            outds.SetGeoTransform(out_gt)
+            for band in range(bands):
+                outds.GetRasterBand(band+1).WriteArray(sarr[band])
+            outds = None
+
+            larr = label_ds.ReadAsArray(yi, xi, tile_size, tile_size)
+            labelds = driver.Create(f'{label_out_dir}/{name}',
+                                    xsize=tile_size,
+                                    ysize=tile_size,
+                                    bands=1,
+                                    eType=gdal.GDT_Byte,
+                                    options=["COMPRESS=DEFLATE"])
+            labelds.SetProjection(proj)
+            labelds.SetGeoTransform(out_gt)
+            labelds.GetRasterBand(1).WriteArray(larr.astype(np.uint8, copy=False))
+            labelds = None
+
+            yi += tile_size
+        xi += tile_size
+        yi = 0
+
+    label_ds = None
+    mask_ds = None
+    gdal.Unlink(aligned_label_path)
+
+    return out_dir, label_out_dir
@@ -0,0 +1,122 @@
+"""Index of the image members of Sentinel-2 archives. The zip directory of an archive is parsed once
+into entries (band, resolution, tile id, sensing time -> member path and offsets) that are cached next
+to the archive as <archive>.index.json, so extraction, NDWI and label rasterization look bands up
+without scanning the member list again."""
+import re
+import json
+import zipfile
+from pathlib import Path
+from floodsens.logger import logger
+
+INDEX_VERSION = 1
+BAND_PATTERN = re.compile(r"(?:^|/)(?:L\w{2}_)?(T\d{2}[A-Z]{3})_(\d{8}T\d{6})_([A-Z0-9]{3})(?:_(\d{2}m))?\.jp2$")
+METADATA_PATTERN = re.compile(r"MTD_MSIL(1C|2A)\.xml$")
+
+_memory = {}
+
+
+def _archive_key(zip_path):
+    stat = Path(zip_path).stat()
+    return f"{stat.st_size}|{stat.st_mtime_ns}"
+
+def _parse(zip_path):
+    entries, metadata = [], None
+    with zipfile.ZipFile(zip_path, "r") as archive:
+        for info in archive.infolist():
+            if METADATA_PATTERN.search(info.filename):
+                metadata = info.filename
+                continue
+            match = BAND_PATTERN.search(info.filename)
+            if match is None:
+                continue
+            tile_id, sensing_time, band, resolution = match.groups()
+            entries.append({"band": band, "resolution": resolution, "tile_id": tile_id, "sensing_time": sensing_time,
+                            "member": info.filename, "header_offset": info.header_offset, "compress_type": info.compress_type,
+                            "compress_size": info.compress_size, "file_size": info.file_size})
+    return entries, metadata
+
+
+class ArchiveIndex():
+    """Parsed member list of a Sentinel-2 archive. Use archive_index to get a cached instance.
+
+    Arguments:
+        zip_path {str, Path} -- Path to the Sentinel-2 archive.
+        entries {list} -- One dict per image member (band, resolution, tile_id, sensing_time, member, offsets).
+        (optional) metadata {str} -- Member path of the product metadata (MTD_MSIL2A.xml).
+
+    Methods:
+        find -- Entry of a band and resolution.
+        member / vsizip -- Member path or GDAL /vsizip/ path of a band.
+        select -- Member paths of an extract list."""
+    def __init__(self, zip_path, entries, metadata=None):
+        self.zip_path = Path(zip_path)
+        self.entries = entries
+        self.metadata = metadata
+        self._lookup = {}
+        for entry in entries:
+            self._lookup.setdefault((entry["band"], entry["resolution"]), []).append(entry)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.zip_path.name}, {len(self.entries)} bands)'
+
+    @property
+    def tile_id(self):
+        return self.entries[0]["tile_id"] if self.entries else None
+
+    @property
+    def sensing_time(self):
+        return self.entries[0]["sensing_time"] if self.entries else None
+
+    def find(self, band, resolution=None):
+        """Entry of band at resolution. Archives without resolutions in the member names (L1C) match
+        any resolution. Raises ValueError unless exactly one member matches."""
+        if resolution is None:
+            matches = [x for key, values in self._lookup.items() if key[0] == band for x in values]
+        else:
+            matches = self._lookup.get((band, resolution), []) + self._lookup.get((band, None), [])
+        if len(matches) != 1:
+            raise ValueError(f"Expected exactly one {band} ({resolution}) band in {self.zip_path}. Found {len(matches)}.")
+        return matches[0]
+
+    def member(self, band, resolution=None):
+        return self.find(band, resolution)["member"]
+
+    def vsizip(self, band, resolution=None):
+        return f"/vsizip/{self.zip_path}/{self.member(band, resolution)}"
+
+    def select(self, extract_list):
+        """Member paths of the (band, resolution) pairs in extract_list, in archive order."""
+        selected = {self.member(band, resolution) for band, resolution in extract_list}
+        return [x["member"] for x in self.entries if x["member"] in selected]
+
+    def to_dict(self):
+        return {"version": INDEX_VERSION, "key": _archive_key(self.zip_path), "metadata": self.metadata, "entries": self.entries}
+
+
+def archive_index(zip_path):
+    """Index of a Sentinel-2 archive. Reused from memory or from <archive>.index.json while the archive
+    is unchanged (size and modification time), otherwise parsed and written next to the archive."""
+    zip_path = Path(zip_path)
+    key = _archive_key(zip_path)
+    cached = _memory.get(zip_path.resolve())
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    index_path = zip_path.with_name(f"{zip_path.name}.index.json")
+    index = None
+    if index_path.exists():
+        with open(index_path, "r") as istream:
+            data = json.load(istream)
+        if data.get("version") == INDEX_VERSION and data.get("key") == key:
+            index = ArchiveIndex(zip_path, data["entries"], data["metadata"])
+
+    if index is None:
+        index = ArchiveIndex(zip_path, *_parse(zip_path))
+        try:
+            with open(index_path, "w") as ostream:
+                json.dump(index.to_dict(), ostream)
+        except OSError:
+            logger.debug(f"Archive index of {zip_path} not cached, {index_path.parent} is not writable.")
+
+    _memory[zip_path.resolve()] = (key, index)
+    return index
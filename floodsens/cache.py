@@ -0,0 +1,247 @@
+"""Stage cache for resumable processing. Each completed stage of an event is recorded in a small
+JSON manifest together with a key derived from its inputs and parameters and the artifacts it
+produced. A stage is skipped on rerun if its key is unchanged and its artifacts still exist.
+
+The derivative cache keeps the DEM and its derivatives of a grid as COGs shared between events, so
+events over the same area crop them instead of conditioning the DEM again."""
+import os
+import json
+import time
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from floodsens.utils import fingerprint
+from floodsens.logger import logger
+
+try:
+    import fcntl
+except ImportError: # Not available on Windows
+    fcntl = None
+
+
+class StageCache():
+    """Manifest of completed (and started) stages stored in a folder.
+
+    Arguments:
+        folder {str, Path} -- Folder in which the manifest is stored, usually the event folder.
+        (optional) name {str} -- File name of the manifest.
+
+    Methods:
+        key -- Compute the key of a stage from input files and parameters.
+        is_valid -- Check if a stage completed with the given key and its artifacts exist.
+        is_pending -- Check if a stage was started with the given key but never completed.
+        begin -- Record that a stage was started.
+        store -- Record that a stage completed and which artifacts it produced.
+        artifacts -- Artifacts of a recorded stage.
+        invalidate -- Remove stages from the manifest."""
+    def __init__(self, folder, name="stage_cache.json"):
+        self.path = Path(folder)/name
+        self.stages = {}
+        if self.path.exists():
+            with open(self.path, "r") as istream:
+                self.stages = json.load(istream)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.path.parent}, {list(self.stages.keys())})'
+
+    @staticmethod
+    def key(*paths, **params):
+        """Key of a stage. Input files are identified by path, size and modification time, parameters
+        (including keys of upstream stages) by their string representation."""
+        return fingerprint(*paths, **params)
+
+    def is_valid(self, stage, key):
+        entry = self.stages.get(stage)
+        if entry is None or entry["key"] != key or not entry["complete"]:
+            return False
+        return all(Path(artifact).exists() for artifact in entry["artifacts"])
+
+    def is_pending(self, stage, key):
+        entry = self.stages.get(stage)
+        return entry is not None and entry["key"] == key and not entry["complete"]
+
+    def begin(self, stage, key):
+        self.stages[stage] = {"key": key, "complete": False, "artifacts": []}
+        self.save()
+
+    def store(self, stage, key, *artifacts):
+        self.stages[stage] = {"key": key, "complete": True, "artifacts": [str(x) for x in artifacts]}
+        self.save()
+
+    def artifacts(self, stage):
+        return [Path(x) for x in self.stages[stage]["artifacts"]]
+
+    def invalidate(self, *stages):
+        """Remove the given stages from the manifest. Removes all stages if none are given."""
+        if len(stages) == 0:
+            stages = list(self.stages.keys())
+        for stage in stages:
+            self.stages.pop(stage, None)
+        logger.debug(f"Stages {stages} invalidated in {self.path}")
+        self.save()
+
+    def save(self):
+        """Write the manifest atomically so an interrupted run never leaves a corrupt file."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as ostream:
+            json.dump(self.stages, ostream, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class DerivativeCache():
+    """Size bounded cache of DEM derivatives (DEM, slope, flow accumulation, HAND, TWI) stored as
+    COGs. Entries are identified by DEM source, projection and resolution and cover the bounds they
+    were computed for; a later request is served by cropping any entry whose bounds contain the
+    requested bounds on the same pixel grid. The least recently used entries are evicted once the
+    cache exceeds max_size_gb. Lookups, index updates, crops and evictions hold an exclusive lock on
+    <folder>/index.lock, so the cache can be shared by parallel workers. Without fcntl (Windows) the
+    cache is not locked and must not be shared by parallel workers.
+
+    Arguments:
+        folder {str, Path} -- Folder of the cache, can be shared by all events of a project.
+        (optional) max_size_gb {float} -- Size limit of the cache.
+
+    Methods:
+        lookup -- Find an entry covering a grid.
+        crop -- Write the layers of an entry cropped to a grid.
+        store -- Add the layers computed for a grid.
+        evict -- Remove least recently used entries until the cache fits its size limit."""
+    def __init__(self, folder, max_size_gb=20.0):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.folder/"index.json"
+        self.lock_path = self.folder/"index.lock"
+        self.max_size = max_size_gb*2**30
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.folder}, {len(self._load())} entries)'
+
+    @contextmanager
+    def _lock(self):
+        if fcntl is None:
+            yield
+            return
+
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        # Reloaded under the lock before every change, the cache may be shared by parallel workers
+        if not self.index_path.exists():
+            return {}
+        with open(self.index_path, "r") as istream:
+            return json.load(istream)
+
+    def _save(self, index):
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as ostream:
+            json.dump(index, ostream, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def _covers(entry, source, projection, bounds, x_res, y_res, tolerance=1e-6):
+        from osgeo import osr
+
+        if entry["source"] != str(source) or entry["x_res"] != x_res or entry["y_res"] != y_res:
+            return False
+        min_x, min_y, max_x, max_y = entry["bounds"]
+        if bounds[0] < min_x or bounds[1] < min_y or bounds[2] > max_x or bounds[3] > max_y:
+            return False
+        offsets = ((bounds[0] - min_x)/x_res, (max_y - bounds[3])/y_res)
+        if any(abs(x - round(x)) > tolerance for x in offsets):
+            return False
+        entry_srs, srs = osr.SpatialReference(), osr.SpatialReference()
+        entry_srs.ImportFromWkt(entry["projection"])
+        srs.ImportFromWkt(projection)
+        return bool(entry_srs.IsSame(srs))
+
+    def lookup(self, source, projection, bounds, x_res, y_res):
+        """Key of an entry covering the grid, or None."""
+        with self._lock():
+            index = self._load()
+        for key, entry in index.items():
+            if self._covers(entry, source, projection, bounds, x_res, y_res):
+                return key
+        return None
+
+    def crop(self, key, bounds, out_dir):
+        """Write the layers of entry key cropped to bounds into out_dir as GeoTIFFs with their
+        original names. Returns the paths in the order they were stored, or None if the entry was
+        evicted since it was looked up."""
+        from osgeo import gdal
+
+        with self._lock():
+            index = self._load()
+            entry = index.get(key)
+            if entry is None:
+                return None
+            entry["last_used"] = time.time()
+            self._save(index)
+
+            out_paths = []
+            for name in entry["layers"]:
+                out_path = Path(out_dir)/name
+                options = gdal.TranslateOptions(format="GTiff", projWin=[bounds[0], bounds[3], bounds[2], bounds[1]])
+                gdal.Translate(str(out_path), str(self.folder/key/name), options=options)
+                out_paths.append(out_path)
+        logger.info(f"DEM derivatives cropped from cache entry {key}.")
+        return out_paths
+
+    def store(self, source, projection, bounds, x_res, y_res, *layer_paths):
+        """Add the layers computed for a grid as COGs and evict old entries if needed. The COGs are
+        written to a temporary folder outside the lock and renamed into place, an entry stored by
+        another worker in the meantime is kept. Returns the key."""
+        from osgeo import gdal
+
+        key = fingerprint(source=source, projection=projection, bounds=tuple(bounds), x_res=x_res, y_res=y_res)
+        entry_folder = self.folder/key
+        tmp_folder = self.folder/f"{key}.tmp{os.getpid()}"
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        tmp_folder.mkdir()
+
+        size = 0
+        options = gdal.TranslateOptions(format="COG", creationOptions=["COMPRESS=DEFLATE", "PREDICTOR=YES", "BIGTIFF=IF_SAFER"])
+        for layer_path in layer_paths:
+            cog_path = tmp_folder/Path(layer_path).name
+            gdal.Translate(str(cog_path), str(layer_path), options=options)
+            size += cog_path.stat().st_size
+
+        with self._lock():
+            index = self._load()
+            if key in index and entry_folder.exists():
+                shutil.rmtree(tmp_folder, ignore_errors=True)
+                index[key]["last_used"] = time.time()
+                self._save(index)
+                logger.info(f"DEM derivatives already stored in cache entry {key}.")
+                return key
+
+            shutil.rmtree(entry_folder, ignore_errors=True)
+            os.replace(tmp_folder, entry_folder)
+            index[key] = {"source": str(source), "projection": projection, "bounds": list(bounds), "x_res": x_res, "y_res": y_res,
+                          "layers": [Path(x).name for x in layer_paths], "size": size, "last_used": time.time()}
+            logger.info(f"DEM derivatives stored in cache entry {key} ({size/2**20:.1f} MB).")
+            self._evict(index, keep=key)
+        return key
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits max_size_gb. The entry keep is never removed."""
+        with self._lock():
+            self._evict(self._load(), keep=keep)
+
+    def _evict(self, index, keep=None):
+        # Called with the lock held, saves the index
+        total = sum(entry["size"] for entry in index.values())
+        for key in sorted(index, key=lambda x: index[x]["last_used"]):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            total -= index.pop(key)["size"]
+            shutil.rmtree(self.folder/key, ignore_errors=True)
+            logger.info(f"DEM derivative cache entry {key} evicted.")
+        self._save(index)
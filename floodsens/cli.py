@@ -0,0 +1,173 @@
+"""Command line interface for unattended runs, e.g. on a cluster or in a container.
+
+    floodsens preprocess S2_ARCHIVE.zip [...] --event-folder EVENT [--tile-size 244] [--dem-dir DEM]
+    floodsens infer TILES --model MODEL.tar [--batch-size 4] [--cuda] [--resume]
+    floodsens map TILES INFERRED --out RESULT.tif [--format COG]
+    floodsens ndwi S2_ARCHIVE.zip [...] --out NDWI.tif [--threshold 0.0]
+    floodsens run-project PROJECT [--models MODELS] [--events A B] [--preprocess-workers 2] [--inference-workers 1]
+
+No command ever prompts for input. The exit code is 0 on success and 1 if anything failed. Heavy
+dependencies are only imported by the command that needs them."""
+import sys
+import logging
+import argparse
+from pathlib import Path
+from floodsens.logger import logger
+
+
+def _preprocess(args):
+    from floodsens.event import Event
+
+    event = Event(args.event_folder, args.archives, None, name=args.name, tile_size=args.tile_size, dem_dir=args.dem_dir, overlap=args.overlap,
+                  dem_cache_dir=args.dem_cache, cloud_mask=not args.no_cloud_mask, min_valid_fraction=args.min_valid_fraction,
+                  memmap=args.memmap)
+    tiles_folder = event.run_preprocessing(force=args.force)
+    event.save_to_yaml()
+    print(tiles_folder)
+    return 0
+
+def _infer(args):
+    import floodsens.inference as inference
+    from floodsens.model import FloodsensModel
+
+    model = FloodsensModel(args.model)
+    inferred_folder = inference.run_inference(model, args.tiles, mini_batch_size=args.batch_size, cuda=args.cuda, sigmoid_end=True, resume=args.resume)
+    print(inferred_folder)
+    return 0
+
+def _map(args):
+    import floodsens.inference as inference
+    from floodsens.stats import MapStatistics
+
+    statistics = MapStatistics(args.thresholds) if args.stats is not None else None
+    inference.create_map(args.tiles, args.inferred, out_path=args.out, clean=not args.keep_tiles,
+                         importances_path=args.importances, output_format=args.format, mask_path=args.mask,
+                         polygons_path=args.polygons, threshold=args.threshold, importances_table=args.importances_table,
+                         statistics=statistics, flood_mask_path=args.flood_mask)
+    if statistics is not None:
+        statistics.to_json(args.stats)
+    print(args.out)
+    return 0
+
+def _ndwi(args):
+    import floodsens.ndwi as ndwi
+
+    out_path = ndwi.compute_ndwi(args.archives, args.out, threshold=args.threshold)
+    print(out_path)
+    return 0
+
+def _run_project(args):
+    from floodsens.project import Project
+
+    project = Project(args.project_folder)
+    if args.models is not None:
+        project.load_models(args.models)
+
+    model = None
+    if args.model is not None:
+        if args.model not in project.models:
+            raise ValueError(f"Model {args.model} not found in the project. Loaded models: {list(project.models.keys())}.")
+        model = project.models[args.model]
+
+    event_names = args.events if args.events is not None else list(project.event_collection.keys())
+    for event_name in event_names:
+        event = project.event_collection[event_name]
+        if model is not None:
+            event.model = model
+        if args.tile_size is not None:
+            event.tile_size = args.tile_size
+        if args.dem_dir is not None:
+            event.dem_dir = Path(args.dem_dir)
+        if args.dem_cache is not None:
+            event.dem_cache_dir = Path(args.dem_cache)
+    project.save_state(event_names)
+
+    summary = project.run_all(event_names=event_names, model=model, preprocess_workers=args.preprocess_workers,
+                              inference_workers=args.inference_workers, force=args.force,
+                              batch_size=args.batch_size, output_format=args.format, vector_format=args.polygons,
+                              flood_mask=args.flood_mask)
+    return 1 if summary.failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="floodsens", description="Flood segmentation on Sentinel-2 images.")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Logging verbosity.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    preprocess = commands.add_parser("preprocess", help="Extract, stack and tile Sentinel-2 archives of one event.")
+    preprocess.add_argument("archives", type=Path, nargs="+", help="Sentinel-2 L2A zip archives.")
+    preprocess.add_argument("--event-folder", type=Path, required=True, help="Folder of the event. Tiles and the stage cache are kept here.")
+    preprocess.add_argument("--name", default=None, help="Name of the event. Defaults to the folder name.")
+    preprocess.add_argument("--tile-size", type=int, default=244, help="Tile size in pixels.")
+    preprocess.add_argument("--dem-dir", type=Path, default=None, help="Local directory with Copernicus DEM tiles instead of the download.")
+    preprocess.add_argument("--dem-cache", type=Path, default=None, help="Folder of a DEM derivative cache shared between events.")
+    preprocess.add_argument("--overlap", default="first-valid", choices=["first-valid", "least-cloudy", "max"], help="Which archive is used where archives overlap.")
+    preprocess.add_argument("--no-cloud-mask", action="store_true", help="Do not mask clouds and nodata with the scene classification.")
+    preprocess.add_argument("--min-valid-fraction", type=float, default=0.0, help="Skip tiles with at most this fraction of valid pixels.")
+    preprocess.add_argument("--memmap", action="store_true", help="Keep the stack as one memory-mapped file instead of tile GeoTIFFs.")
+    preprocess.add_argument("--force", action="store_true", help="Ignore the stage cache.")
+    preprocess.set_defaults(func=_preprocess)
+
+    infer = commands.add_parser("infer", help="Run a model over a folder of preprocessed tiles.")
+    infer.add_argument("tiles", type=Path, help="Folder of preprocessed tiles or the .json sidecar of a memmap stack.")
+    infer.add_argument("--model", type=Path, required=True, help="Model checkpoint (.tar).")
+    infer.add_argument("--batch-size", type=int, default=4, help="Number of tiles per forward pass.")
+    infer.add_argument("--cuda", action="store_true", help="Run on the GPU.")
+    infer.add_argument("--resume", action="store_true", help="Skip tiles that already have an output.")
+    infer.set_defaults(func=_infer)
+
+    map_ = commands.add_parser("map", help="Mosaic inferred tiles into a single raster.")
+    map_.add_argument("tiles", type=Path, help="Folder of preprocessed tiles or memmap sidecar (for the georeferencing).")
+    map_.add_argument("inferred", type=Path, help="Folder of inferred tiles.")
+    map_.add_argument("--out", type=Path, required=True, help="Output raster.")
+    map_.add_argument("--importances", type=Path, default=None, help="Optional output raster of the channel importances.")
+    map_.add_argument("--importances-table", type=Path, default=None, help="Table of the channel importances per tile (.csv or .parquet).")
+    map_.add_argument("--format", default="GTiff", help="GDAL driver of the output raster, e.g. GTiff or COG.")
+    map_.add_argument("--mask", type=Path, default=None, help="Validity mask of preprocessing. Invalid pixels are nodata in the output.")
+    map_.add_argument("--polygons", type=Path, default=None, help="Also write flood polygons with their area (.gpkg or .geojson).")
+    map_.add_argument("--threshold", type=float, default=0.5, help="Probability threshold of the flood polygons and the flood mask.")
+    map_.add_argument("--flood-mask", type=Path, default=None, help="Also write the map thresholded at --threshold as a uint8 raster.")
+    map_.add_argument("--stats", type=Path, default=None, help="Write flooded areas and the probability histogram to this JSON file.")
+    map_.add_argument("--thresholds", type=float, nargs="+", default=[0.3, 0.5, 0.7], help="Probabilities at which the flooded area is counted.")
+    map_.add_argument("--keep-tiles", action="store_true", help="Keep the intermediate per-tile rasters.")
+    map_.set_defaults(func=_map)
+
+    ndwi = commands.add_parser("ndwi", help="Compute the NDWI baseline for Sentinel-2 archives.")
+    ndwi.add_argument("archives", type=Path, nargs="+", help="Sentinel-2 L2A zip archives.")
+    ndwi.add_argument("--out", type=Path, required=True, help="Output raster.")
+    ndwi.add_argument("--threshold", type=float, default=None, help="Write a binary water mask with this NDWI threshold.")
+    ndwi.set_defaults(func=_ndwi)
+
+    run_project = commands.add_parser("run-project", help="Run FloodSENS on several or all events of a project.")
+    run_project.add_argument("project_folder", type=Path, help="Project folder with a project_state.sqlite.")
+    run_project.add_argument("--models", type=Path, default=None, help="Load all models from this folder first.")
+    run_project.add_argument("--model", default=None, help="Name of the model used for all events. Defaults to the model of each event.")
+    run_project.add_argument("--events", nargs="+", default=None, help="Names of the events to run. Defaults to all events.")
+    run_project.add_argument("--preprocess-workers", type=int, default=2, help="Number of events preprocessed concurrently.")
+    run_project.add_argument("--inference-workers", type=int, default=1, help="Number of events inferred concurrently.")
+    run_project.add_argument("--batch-size", type=int, default=4, help="Number of tiles per forward pass.")
+    run_project.add_argument("--tile-size", type=int, default=None, help="Tile size in pixels. Defaults to the setting of each event.")
+    run_project.add_argument("--dem-dir", type=Path, default=None, help="Local directory with Copernicus DEM tiles instead of the download.")
+    run_project.add_argument("--dem-cache", type=Path, default=None, help="Folder of a DEM derivative cache shared between events.")
+    run_project.add_argument("--format", default="GTiff", help="GDAL driver of the output rasters, e.g. GTiff or COG.")
+    run_project.add_argument("--polygons", default=None, choices=["gpkg", "geojson"], help="Also write flood polygons in this format.")
+    run_project.add_argument("--flood-mask", action="store_true", help="Also write thresholded uint8 flood masks.")
+    run_project.add_argument("--force", action="store_true", help="Ignore the stage caches.")
+    run_project.set_defaults(func=_run_project)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.getLogger().setLevel(getattr(logging, args.log_level))
+
+    try:
+        return args.func(args)
+    except Exception as error:
+        logger.error(f"floodsens {args.command} failed: {error!r}")
+        if args.log_level == "DEBUG":
+            raise
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
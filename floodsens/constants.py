@@ -11,3 +11,36 @@ EXTRACT_LIST = (("B02", "10m"),
                 ("B07", "20m"),
                 ("B11", "20m"),
                 ("B12", "20m"))
+
+"""Storage policy of the preprocessing stack. Every layer is warped with the data type and resampling
+of its kind; layers not listed in LAYER_KINDS are Sentinel-2 reflectances. A GeoTIFF holds a single
+data type, so the stack, the merged raster and the tiles are split into one part per kind in
+STACK_KINDS, in band order, stored as STACK_DTYPE of that kind: reflectances as uint16 DNs (exact)
+and DEM derivatives as float32. Parts after the first carry the suffix "_<kind>", e.g. the tiles
+folders tiles/stacked and tiles/stacked_derivative, whose tiles have the same names. Inference
+concatenates the parts and converts them to float32 at model input only.
+
+Derivatives may be stored as "float16" (half precision, Float32 with NBITS=16) to halve their size.
+This keeps 11 significant bits, e.g. DEM and HAND values between 1024 and 2048 m are rounded to 1 m.
+Layers in STACK_SCALES exceed the float16 range and are then divided by their scale before storing
+and multiplied again at model input."""
+LAYER_POLICY = {"reflectance": ("uint16", "bilinear", 0),
+                "categorical": ("uint8", "near", 0),
+                "derivative": ("float32", "bilinear", -9999)}
+
+LAYER_KINDS = {"10_DEM": "derivative",
+               "11_Slope": "derivative",
+               "12_Flowaccumulation": "derivative",
+               "13_HAND": "derivative",
+               "14_TWI": "derivative",
+               "SCL": "categorical"}
+
+STACK_KINDS = ("reflectance", "derivative")
+STACK_DTYPE = {"reflectance": "uint16", "derivative": "float32"}
+STACK_NODATA = {"uint16": 0, "float16": -10000, "float32": -9999}
+STACK_SCALES = {"12_Flowaccumulation": 1024.0}
+
+"""Scene classification (SCL) classes of Sentinel-2 L2A products treated as invalid by the validity
+mask: no data, saturated or defective, cloud shadows, medium and high probability clouds and thin
+cirrus. Water (6) and snow (11) stay valid."""
+INVALID_SCL_CLASSES = (0, 1, 3, 8, 9, 10)
@@ -1,15 +1,25 @@
 """The event module contains the Event class which represents a single event.
 All processing methods are called from the Event class."""
 from pathlib import Path, PurePath
-import zipfile
+import json
 import shutil
 import yaml
-import floodsens.preprocessing as preprocessing
-import floodsens.label as label
-import floodsens.inference as inference
-from floodsens._tile import singleband_tiling
+import floodsens.utils as utils
+from floodsens._lazy import lazy_import
 from floodsens.logger import logger
 from floodsens.model import FloodsensModel
+from floodsens.profiling import Profiler
+from floodsens.cache import StageCache, DerivativeCache
+from floodsens.archive import archive_index
+from floodsens.state import read_yaml_checkpoint
+from floodsens.constants import EXTRACT_LIST, STACK_KINDS, STACK_DTYPE, INVALID_SCL_CLASSES
+
+preprocessing = lazy_import("floodsens.preprocessing")
+label = lazy_import("floodsens.label")
+inference = lazy_import("floodsens.inference")
+ndwi = lazy_import("floodsens.ndwi")
+stats = lazy_import("floodsens.stats")
+memmap = lazy_import("floodsens._memmap")
 
 class Event():
     """Event class to manage a single event. The event class contains all processing methods.
@@ -17,11 +27,26 @@ class Event():
     Arguments:
         event_folder {str, Path} -- Path to the event folder. Created if it does not exist.
         sentinel_archives {str, Path, list} -- Path to the Sentinel archive(s).
-        (optional) model {FloodsensModel} -- FloodsensModel instance.
+        (optional) model {FloodsensModel, dict} -- FloodsensModel instance or its to_dict representation.
         (optional) name {str} -- Name of the event. Defaults to the name of the event folder.
         (optional) inferred_raster {str, Path} -- Path to the inferred raster. Defaults to None.
-        (optional) ndwi_raster {str, Path} -- Path to the NDWI raster. Defaults to None."""
-    def __init__(self, event_folder, sentinel_archives, model, name=None, inferred_raster=None, ndwi_raster=None):
+        (optional) ndwi_raster {str, Path} -- Path to the NDWI raster. Defaults to None.
+        (optional) ndwi_fingerprint {str} -- Fingerprint of the inputs used for ndwi_raster. Defaults to None.
+        (optional) model_rasters {dict} -- Paths to the rasters created by run_models. Defaults to None.
+        (optional) tile_size {int} -- Size of the preprocessed tiles in pixels. Defaults to 244.
+        (optional) dem_dir {str, Path} -- Local directory with DEM tiles used instead of the download. Defaults to None.
+        (optional) overlap {str} -- Which archive is used where archives overlap: "first-valid", "least-cloudy" or "max". Defaults to "first-valid".
+        (optional) dem_cache_dir {str, Path} -- Folder of a DEM derivative cache, can be shared between events. Defaults to None.
+        (optional) cloud_mask {bool} -- Mask clouds, cloud shadows and nodata using the scene classification of the archives.
+            Fully masked tiles are not inferred and masked pixels are nodata in the results. Defaults to True.
+        (optional) min_valid_fraction {float} -- Tiles with at most this fraction of valid pixels are skipped. Defaults to 0.0.
+        (optional) flood_polygons {str, Path} -- Path to the flood polygons of the last run. Defaults to None.
+        (optional) flood_mask {str, Path} -- Path to the thresholded flood mask of the last run. Defaults to None.
+        (optional) memmap {bool} -- Keep the preprocessed stack as one memory-mapped file that inference reads tiles from,
+            instead of tile GeoTIFFs. Fastest on local NVMe scratch disks. Defaults to False."""
+    def __init__(self, event_folder, sentinel_archives, model, name=None, inferred_raster=None, ndwi_raster=None, ndwi_fingerprint=None, model_rasters=None,
+                 tile_size=244, dem_dir=None, overlap="first-valid", dem_cache_dir=None, cloud_mask=True, min_valid_fraction=0.0,
+                 flood_polygons=None, flood_mask=None, memmap=False):
         self.event_folder = Path(event_folder)
         if not self.event_folder.exists():
             self.event_folder.mkdir(parents=True, exist_ok=True)
@@ -34,9 +59,22 @@ class Event():
         else:
             raise ValueError(f"sentinel_archives must be of type str, pathlib Path, or list. Got {type(sentinel_archives)} instead.")
 
+        if isinstance(model, dict):
+            model = FloodsensModel(**model)
         self.model = model if isinstance(model, FloodsensModel) else None
         self.inferred_raster = Path(inferred_raster) if inferred_raster is not None else None
         self.ndwi_raster = Path(ndwi_raster) if ndwi_raster is not None else None
+        self.ndwi_fingerprint = ndwi_fingerprint
+        self.model_rasters = {key: Path(value) for key, value in model_rasters.items()} if model_rasters is not None else {}
+        self.tile_size = tile_size
+        self.dem_dir = Path(dem_dir) if dem_dir is not None else None
+        self.overlap = overlap
+        self.dem_cache_dir = Path(dem_cache_dir) if dem_cache_dir is not None else None
+        self.cloud_mask = cloud_mask
+        self.min_valid_fraction = min_valid_fraction
+        self.flood_polygons = Path(flood_polygons) if flood_polygons is not None else None
+        self.flood_mask = Path(flood_mask) if flood_mask is not None else None
+        self.memmap = memmap
 
     def __repr__(self) -> str:
         return f'{self.__class__.__name__}({self.event_folder}, {self.sentinel_archives}, {self.model}, {self.inferred_raster}, {self.ndwi_raster})'
@@ -55,14 +93,66 @@ class Event():
 
         return output
 
-    def run_floodsens(self):
+    @property
+    def map_statistics(self):
+        """Statistics of the last map written by run_floodsens (flooded area per threshold, histogram,
+        pixel counts per archive), see MapStatistics. None before the first run."""
+        statistics_path = self.event_folder/"FloodSENS_statistics.json"
+        if not statistics_path.exists():
+            return None
+        with open(statistics_path, "r") as istream:
+            return json.load(istream)
+
+    def run_floodsens(self, force=False, clean=False, interactive=True, batch_size=4, output_format="GTiff", vector_format=None, threshold=0.5,
+                      thresholds=None, flood_mask=False):
         """Run FloodSENS on the event. This method will run preprocessing, inference, and postprocessing.
         The output raster will be saved to the event folder with file name "FloodSENS_results.tif".
+        Per-stage timings and memory use are saved alongside as "FloodSENS_profile.json". Statistics of the
+        map are accumulated while it is written and saved as "FloodSENS_statistics.json", see map_statistics.
+
+        Completed stages are recorded in "stage_cache.json" in the event folder. On a rerun, stages whose
+        inputs and parameters are unchanged are skipped, an interrupted inference resumes from the last
+        written batch and changing the model only reruns inference and map creation.
+
+        Arguments:
+            (optional) force {bool} -- Ignore cached stages and run everything again.
+            (optional) clean {bool} -- Remove all intermediate products (tiles, stacks) after the run.
+                Subsequent runs will then start from scratch.
+            (optional) interactive {bool} -- Ask before overwriting an existing output raster.
+            (optional) batch_size {int} -- Number of tiles per forward pass.
+            (optional) output_format {str} -- GDAL driver of the output raster, e.g. "GTiff" or "COG".
+            (optional) vector_format {str} -- "gpkg" or "geojson" to also write the flooded regions (probability
+                >= threshold) as polygons with their area to "FloodSENS_results.<vector_format>".
+            (optional) threshold {float} -- Probability threshold of the flood polygons and the flood mask.
+            (optional) thresholds {tuple} -- Probabilities at which the flooded area is counted. Defaults to (0.3, 0.5, 0.7).
+            (optional) flood_mask {bool} -- Also write the map thresholded at threshold as a uint8 raster
+                "FloodSENS_flood_mask.tif" (1 flooded, 0 dry, 255 nodata).
         """
         if self.model is None or not isinstance(self.model, FloodsensModel):
             raise ValueError(f"Model not found at {self.model} or not of type FloodsensModel.")
 
-        if self.inferred_raster is not None:
+        cache = StageCache(self.event_folder)
+        if force:
+            cache.invalidate()
+
+        out_path = self.event_folder/"FloodSENS_results.tif"
+        preprocessing_key = self._preprocessing_key(cache)
+        inference_key = cache.key(self.model.path, upstream=preprocessing_key, channels=self.model.channels, sigmoid_end=True)
+        thresholds = tuple(thresholds) if thresholds is not None else stats.DEFAULT_THRESHOLDS
+        map_key = cache.key(upstream=inference_key, output_format=output_format, vector_format=vector_format, thresholds=thresholds,
+                            flood_mask=flood_mask, threshold=threshold if vector_format is not None or flood_mask else None)
+        polygons_path = self.event_folder/f"FloodSENS_results.{vector_format}" if vector_format is not None else None
+        flood_mask_path = self.event_folder/"FloodSENS_flood_mask.tif" if flood_mask else None
+        statistics_path = self.event_folder/"FloodSENS_statistics.json"
+
+        if cache.is_valid("map", map_key):
+            self.inferred_raster = cache.artifacts("map")[0]
+            self.flood_polygons = polygons_path
+            self.flood_mask = flood_mask_path
+            logger.info(f"{self.inferred_raster} is up to date. Nothing to do.")
+            return
+
+        if interactive and self.inferred_raster is not None and self.inferred_raster.exists():
             logger.warning(f"{self.inferred_raster} already exists and will be overwritten if you choose to continue.")
             interrupt = input("Do you want to continue? (y/n): ")
             if interrupt.lower() == "n":
@@ -70,72 +160,275 @@ class Event():
                 return
             logger.info("Continuing FloodSENS run. This may take a while...")
 
-        preprocessed_tiles_folder = preprocessing.run_default_preprocessing(self.event_folder, self.sentinel_archives, delete_all=True)
-        logger.info(f"Successfully preprocessed {len(self.sentinel_archives)} Sentinel Archives.")
-        inferred_tiles_folder = inference.run_inference(self.model.path, preprocessed_tiles_folder, self.model.channels, cuda=False, sigmoid_end=True)
-        logger.info(f"Successfully ran inference on {len(self.sentinel_archives)} Sentinel Archives.")
-        out_name = f"{self.event_folder}/FloodSENS_results.tif"
-        inference.create_map(preprocessed_tiles_folder, inferred_tiles_folder, out_path=out_name)
-        self.inferred_raster = Path(out_name)
+        profiler = Profiler(self.name)
+        preprocessed_tiles_folder = self._preprocess(cache, preprocessing_key, profiler)
+
+        if cache.is_valid("inference", inference_key):
+            inferred_tiles_folder = cache.artifacts("inference")[0]
+            logger.info(f"Inferred tiles are up to date. Skipping inference.")
+        else:
+            resume = cache.is_pending("inference", inference_key)
+            if not resume:
+                shutil.rmtree(preprocessed_tiles_folder.parent/"out_tiles", ignore_errors=True)
+            cache.begin("inference", inference_key)
+            with profiler.stage("inference") as stage:
+                inferred_tiles_folder = inference.run_inference(self.model, preprocessed_tiles_folder, mini_batch_size=batch_size, cuda=False, sigmoid_end=True, resume=resume)
+                stage.tiles = sum(1 for _ in inferred_tiles_folder.iterdir())
+            cache.store("inference", inference_key, inferred_tiles_folder)
+            logger.info(f"Successfully ran inference on {len(self.sentinel_archives)} Sentinel Archives.")
+
+        with profiler.stage("map_creation") as stage:
+            statistics = stats.MapStatistics(thresholds, archives=self.sentinel_archives)
+            inference.create_map(preprocessed_tiles_folder, inferred_tiles_folder, out_path=out_path, output_format=output_format,
+                                 mask_path=self._validity_mask(cache), polygons_path=polygons_path, threshold=threshold,
+                                 statistics=statistics, flood_mask_path=flood_mask_path)
+            statistics.to_json(statistics_path)
+            stage.tiles = len(memmap.tile_names(preprocessed_tiles_folder))
+        cache.store("map", map_key, out_path, statistics_path, *[x for x in (polygons_path, flood_mask_path) if x is not None])
+        self.inferred_raster = out_path
+        self.flood_polygons = polygons_path
+        self.flood_mask = flood_mask_path
         logger.info(f"Successfully created output map for {len(self.sentinel_archives)} Sentinel Archvies.")
+        profiler.to_json(self.event_folder/"FloodSENS_profile.json")
 
-        shutil.rmtree(preprocessed_tiles_folder.parent)
+        if clean:
+            self.clean_intermediate_products(cache)
 
-        logger.info("Successfully cleaned up intermediate products.")
         logger.info(f"Successfully ran FloodSENS on {self.sentinel_archives}.")
 
         self.save_to_yaml()
 
-    def run_ndwi(self): #TODO: Implement NDWI
-        raise NotImplementedError("This feature has not been implemented yet.")
+    def run_preprocessing(self, force=False):
+        """Run only the preprocessing of the event. The tiles are cached and picked up by a subsequent
+        run_floodsens or run_models call.
 
-    def extract_truecolor(self):
-        raise NotImplementedError("This feature has not been implemented yet.")
+        Arguments:
+            (optional) force {bool} -- Ignore cached stages and run everything again.
+
+        Returns:
+            preprocessed_tiles_folder {Path} -- Folder containing the tiles."""
+        cache = StageCache(self.event_folder)
+        if force:
+            cache.invalidate()
+
+        profiler = Profiler(self.name)
+        preprocessed_tiles_folder = self._preprocess(cache, self._preprocessing_key(cache), profiler)
+        if len(profiler.records) > 0:
+            profiler.to_json(self.event_folder/"FloodSENS_preprocessing_profile.json")
+        return preprocessed_tiles_folder
+
+    def _preprocessing_key(self, cache):
+        return cache.key(*self.sentinel_archives, extract_list=EXTRACT_LIST, tile_size=self.tile_size, dem_dir=self.dem_dir,
+                         stack_kinds=STACK_KINDS, stack_dtype=STACK_DTYPE, overlap=self.overlap, cloud_mask=INVALID_SCL_CLASSES if self.cloud_mask else None,
+                         min_valid_fraction=self.min_valid_fraction, memmap=self.memmap)
+
+    @staticmethod
+    def _validity_mask(cache):
+        """Validity mask written with the cached tiles, None if preprocessing did not mask."""
+        masks = [x for x in cache.artifacts("preprocessing") if x.name == preprocessing.VALIDITY_MASK]
+        return masks[0] if len(masks) > 0 else None
+
+    def _derivative_cache(self):
+        return DerivativeCache(self.dem_cache_dir) if self.dem_cache_dir is not None else None
+
+    def _preprocess(self, cache, preprocessing_key, profiler):
+        """Run preprocessing unless the cached tiles are up to date. Returns the tiles folder."""
+        if cache.is_valid("preprocessing", preprocessing_key):
+            logger.info(f"Preprocessed tiles are up to date. Skipping preprocessing.")
+            return cache.artifacts("preprocessing")[0]
+
+        shutil.rmtree(self.event_folder/"tiles", ignore_errors=True)
+        preprocessed_tiles_folder = preprocessing.run_default_preprocessing(self.event_folder, self.sentinel_archives, delete_all=True, profiler=profiler,
+                                                                            cache=cache, dem_dir=self.dem_dir, tile_size=self.tile_size, overlap=self.overlap,
+                                                                            derivative_cache=self._derivative_cache(), cloud_mask=self.cloud_mask,
+                                                                            min_valid_fraction=self.min_valid_fraction, memmap=self.memmap)
+        # Parts of the stack, band information and memmaps next to the tiles folder (or sidecar)
+        artifacts = [preprocessed_tiles_folder, *sorted(x for x in preprocessed_tiles_folder.parent.iterdir() if x != preprocessed_tiles_folder)]
+        if (self.event_folder/preprocessing.VALIDITY_MASK).exists():
+            artifacts.append(self.event_folder/preprocessing.VALIDITY_MASK)
+        cache.store("preprocessing", preprocessing_key, *artifacts)
+        logger.info(f"Successfully preprocessed {len(self.sentinel_archives)} Sentinel Archives.")
+        return preprocessed_tiles_folder
 
-    def generate_training_data(self, label_path=None):
-        preprocessed_tiles_folder = preprocessing.run_default_preprocessing(self.event_folder, self.sentinel_archives, delete_all=True)
-        logger.info(f"Successfully preprocessed {len(self.sentinel_archives)} Sentinel Archives. Tiles saved to {preprocessed_tiles_folder}.")
+    def run_models(self, models, ensemble=True, force=False):
+        """Run several models on the event while preprocessing and reading every tile only once.
+        One raster per model is saved to the event folder as "FloodSENS_results_<model name>.tif"
+        and, if ensemble is True, the mean of all models as "FloodSENS_results_ensemble.tif".
 
-        if label_path is None:
-            logger.info(f"No labels provided. Please do not use validation functionalities.")
-            return preprocessed_tiles_folder
+        Arguments:
+            models {list, dict} -- FloodsensModel instances (or a dictionary of them as in Project.models).
+            (optional) ensemble {bool} -- Also create the averaged map of all models.
+            (optional) force {bool} -- Ignore cached stages and run everything again.
+
+        Returns:
+            model_rasters {dict} -- Model names (and "ensemble") mapped to the output rasters."""
+        if isinstance(models, dict):
+            models = list(models.values())
+        if len(models) == 0 or not all(isinstance(model, FloodsensModel) for model in models):
+            raise ValueError(f"models must be a non-empty list of FloodsensModel. Got {models} instead.")
+
+        cache = StageCache(self.event_folder)
+        if force:
+            cache.invalidate()
+
+        profiler = Profiler(self.name)
+        preprocessing_key = self._preprocessing_key(cache)
+        inference_key = cache.key(*[model.path for model in models], upstream=preprocessing_key,
+                                  channels=[model.channels for model in models], ensemble=ensemble, sigmoid_end=True)
+
+        names = [model.name for model in models] + (["ensemble"] if ensemble else [])
+        out_paths = {name: self.event_folder/f"FloodSENS_results_{name}.tif" for name in names}
+        if cache.is_valid("multi_model_map", inference_key):
+            logger.info(f"Results of {names} are up to date. Nothing to do.")
+            self.model_rasters.update(out_paths)
+            return out_paths
+
+        preprocessed_tiles_folder = self._preprocess(cache, preprocessing_key, profiler)
+
+        with profiler.stage("inference") as stage:
+            output_folders = inference.run_multi_inference(models, preprocessed_tiles_folder, cuda=False, sigmoid_end=True, ensemble=ensemble)
+            stage.tiles = len(memmap.tile_names(preprocessed_tiles_folder))
+        logger.info(f"Successfully ran {len(models)} models on {len(self.sentinel_archives)} Sentinel Archives.")
+
+        with profiler.stage("map_creation") as stage:
+            for name, output_folder in output_folders.items():
+                inference.create_map(preprocessed_tiles_folder, output_folder, out_path=out_paths[name],
+                                     importances_path=self.event_folder/f"channel_importances_{name}.tif", mask_path=self._validity_mask(cache))
+                shutil.rmtree(output_folder)
+            stage.tiles = len(output_folders)*len(memmap.tile_names(preprocessed_tiles_folder))
+        cache.store("multi_model_map", inference_key, *out_paths.values())
+        logger.info(f"Successfully created {len(out_paths)} output maps.")
+        profiler.to_json(self.event_folder/"FloodSENS_multi_model_profile.json")
+
+        self.model_rasters.update(out_paths)
+        self.save_to_yaml()
+        return out_paths
+
+    def clean_intermediate_products(self, cache=None):
+        """Remove tiles, inferred tiles and cached per-archive stacks of the event. The output raster is kept."""
+        cache = cache if cache is not None else StageCache(self.event_folder)
+        shutil.rmtree(self.event_folder/"tiles", ignore_errors=True)
+
+        stack_stages = [stage for stage in cache.stages if stage.startswith("stack_")]
+        for stage in stack_stages:
+            for artifact in cache.artifacts(stage):
+                shutil.rmtree(artifact.parent, ignore_errors=True)
+        cache.invalidate("preprocessing", "inference", *stack_stages)
+
+        logger.info("Successfully cleaned up intermediate products.")
+
+    def run_ndwi(self, threshold=None, force=False):
+        """Compute NDWI for the event as a fast baseline. The output raster is saved to the event folder
+        with file name "NDWI_results.tif". The computation is skipped if the Sentinel archives and threshold
+        are unchanged since the last run.
+
+        Arguments:
+            (optional) threshold {float} -- If given, a binary water mask (NDWI > threshold) is saved instead.
+            (optional) force {bool} -- Recompute even if a cached result exists."""
+        fingerprint = utils.fingerprint(*self.sentinel_archives, threshold=threshold)
+        if not force and self.ndwi_raster is not None and self.ndwi_raster.exists() and self.ndwi_fingerprint == fingerprint:
+            logger.info(f"NDWI for {self.name} is up to date. Skipping computation.")
+            return self.ndwi_raster
+
+        out_path = self.event_folder/"NDWI_results.tif"
+        self.ndwi_raster = ndwi.compute_ndwi(self.sentinel_archives, out_path, threshold=threshold)
+        self.ndwi_fingerprint = fingerprint
+        logger.info(f"Successfully computed NDWI for {len(self.sentinel_archives)} Sentinel Archives.")
 
+        self.save_to_yaml()
+        return self.ndwi_raster
+
+    def extract_truecolor(self):
+        raise NotImplementedError("This feature has not been implemented yet.")
+
+    def _prepare_label(self, label_path):
+        """Rasterize (if needed) and binarize the label. Returns the binary label path or None."""
         label_path = Path(label_path)
         if label_path.suffix == ".shp":
 
-            raster_paths = []
-            for zip_archive in self.sentinel_archives:
-                archive = zipfile.ZipFile(zip_archive, "r")
-                file_list = archive.namelist()
-                archive.close()
-                tci_path = [x for x in file_list if ("10m" in x and "TCI" in x)][0]
-                raster_paths.append("/vsizip/%s/%s" % (zip_archive, tci_path))
+            raster_paths = [archive_index(zip_archive).vsizip("TCI", "10m") for zip_archive in self.sentinel_archives]
 
             label_raster_path = self.event_folder/f"{label_path.stem}.tif"
             label_path = label.rasterize(label_path, raster_paths, label_raster_path)
+            if label_path is None:
+                return None
+
+        if label_path.suffix != ".tif":
+            return None
 
-        if label_path.suffix == ".tif":
-            out_path = self.event_folder/"label_binary.tif"
-            label_binary_path = label.binarize(label_path, out_path)
+        out_path = self.event_folder/"label_binary.tif"
+        return label.binarize(label_path, out_path)
+
+    def generate_training_data(self, label_path=None):
+        """Preprocess the Sentinel archives into tiles. If a label (shapefile or GeoTIFF) is provided,
+        label tiles aligned to the image tiles are written in the same tiling pass.
+
+        Arguments:
+            (optional) label_path {str, Path} -- Path to the label shapefile or raster.
+
+        Returns:
+            preprocessed_tiles_folder {Path} -- or (preprocessed_tiles_folder, label_tiles_folder) if labels were provided."""
+        label_binary_path = None
+        if label_path is None:
+            logger.info(f"No labels provided. Please do not use validation functionalities.")
         else:
-            logger.warning("Unspecified error encountered. Please do not use validation functionalities.")
-            return preprocessed_tiles_folder
+            label_binary_path = self._prepare_label(label_path)
+            if label_binary_path is None:
+                logger.warning("Label processing skipped. Please do not use validation functionalities.")
+
+        output = preprocessing.run_default_preprocessing(self.event_folder, self.sentinel_archives, delete_all=True, label_path=label_binary_path,
+                                                         dem_dir=self.dem_dir, tile_size=self.tile_size, overlap=self.overlap,
+                                                         derivative_cache=self._derivative_cache(), cloud_mask=self.cloud_mask,
+                                                         min_valid_fraction=self.min_valid_fraction)
+        if label_binary_path is None:
+            logger.info(f"Successfully preprocessed {len(self.sentinel_archives)} Sentinel Archives. Tiles saved to {output}.")
+            return output
 
-        #NOTE Binary Labels still looking correct. Error in tiling.
-        #TODO Singleband_tiling not working! Large files with bad content
-        label_tiles_folder = singleband_tiling(244, label_binary_path, data_type="label")
+        preprocessed_tiles_folder, label_tiles_folder = output
+        logger.info(f"Successfully preprocessed {len(self.sentinel_archives)} Sentinel Archives. Tiles saved to {preprocessed_tiles_folder} and {label_tiles_folder}.")
 
         return preprocessed_tiles_folder, label_tiles_folder
 
+    def to_dict(self):
+        """Plain representation with the constructor arguments, safe to store as YAML or JSON."""
+        return {"event_folder": str(self.event_folder),
+                "sentinel_archives": [str(x) for x in self.sentinel_archives],
+                "model": self.model.to_dict() if self.model is not None else None,
+                "name": self.name,
+                "inferred_raster": str(self.inferred_raster) if self.inferred_raster is not None else None,
+                "ndwi_raster": str(self.ndwi_raster) if self.ndwi_raster is not None else None,
+                "ndwi_fingerprint": self.ndwi_fingerprint,
+                "model_rasters": {key: str(value) for key, value in self.model_rasters.items()},
+                "tile_size": self.tile_size,
+                "dem_dir": str(self.dem_dir) if self.dem_dir is not None else None,
+                "overlap": self.overlap,
+                "dem_cache_dir": str(self.dem_cache_dir) if self.dem_cache_dir is not None else None,
+                "cloud_mask": self.cloud_mask,
+                "min_valid_fraction": self.min_valid_fraction,
+                "flood_polygons": str(self.flood_polygons) if self.flood_polygons is not None else None,
+                "flood_mask": str(self.flood_mask) if self.flood_mask is not None else None,
+                "memmap": self.memmap}
+
+    @classmethod
+    def from_dict(cls, data, models=None):
+        """Restore an Event instance from its to_dict representation.
+
+        Arguments:
+            data {dict} -- Output of to_dict.
+            (optional) models {dict} -- Already loaded FloodsensModels by name, reused instead of loading the model again."""
+        data = dict(data)
+        model = data.get("model")
+        if isinstance(model, dict) and models is not None and model["name"] in models:
+            data["model"] = models[model["name"]]
+        return cls(**data)
+
     def save_to_yaml(self):
         """Save the event to a YAML file. This file can be used to recreate the event instance.
         The file will be named "event_checkpoint.yaml" and saved to the event folder."""
         filename = f"{self.event_folder}/event_checkpoint.yaml"
 
-        event_data = self.__dict__
-
         with open(filename, "w") as ostream:
-            yaml.dump(event_data, ostream)
+            yaml.safe_dump(self.to_dict(), ostream)
 
     @classmethod
     def from_yaml(cls, yaml_path):
@@ -143,11 +436,5 @@ class Event():
 
         Arguments:
             yaml_path {str, Path} -- Path to the YAML file."""
-        with open(yaml_path, "r") as istream:
-            data = yaml.load(istream, yaml.Loader)
-
-        # model_data = data.pop("model")
-        # model = FloodsensModel(**model_data)
-        # data["model"] = model
-
+        data = read_yaml_checkpoint(yaml_path)
         return cls(**data)
@@ -1,8 +1,19 @@
+import os
+import re
+import json
 import tifffile
 import pickle
 import torch
 import math
-from floodsens.model import MainNET
+from collections import namedtuple
+from functools import partial
+from floodsens._network import MainNET
+from floodsens._tile import read_mask_window
+from floodsens._memmap import MemmapStack
+from floodsens.model import FloodsensModel
+from floodsens.constants import STACK_NODATA
+from floodsens.vectorize import FloodVectorizer
+from floodsens.logger import logger
 import pandas as pd
 import numpy as np
 from osgeo import gdal
@@ -15,22 +26,128 @@ def choose_model():
     model_path = model_paths[int(model_idx)-1]/"model.pth.tar"
     return model_path
 
-def run_inference(model_path, input_tiles_folder, channels, mini_batch_size=4, cuda=True, sigmoid_end=True):
-
-    if cuda is True: model_dict = torch.load(model_path)
-    else: model_dict = torch.load(model_path, map_location=torch.device('cpu'))
-
-    model_weights = model_dict['model_state_dict']
-    model = MainNET(in_channels=len(model_dict['model_means']), out_channels=1)
-    model.load_state_dict(model_weights)
-    model.eval()
-
-    means, stds = model_dict['model_means'], model_dict['model_stds']
-    means = np.expand_dims(means, axis=(1, 2))
-    stds = np.expand_dims(stds, axis=(1, 2))
+def _dump_result(result_dict, output_path):
+    """Pickle result_dict to output_path. Written to a temporary file first so an interrupted run
+    never leaves a truncated output."""
+    tmp_path = output_path.with_suffix(".tmp")
+    with open(tmp_path, 'wb') as ostream:
+        pickle.dump(result_dict, ostream)
+    os.replace(tmp_path, output_path)
+
+def _band_info(input_tiles_folder):
+    """Per band scales and storage nodata values of the tiles, written by preprocessing next to the
+    tiles folder. (None, None) for tiles without band information, which are stored unscaled."""
+    info_path = Path(input_tiles_folder).with_suffix(".json")
+    if not info_path.exists():
+        return None, None
+    with open(info_path, "r") as istream:
+        info = json.load(istream)
+    scales = np.asarray([band["scale"] for band in info["bands"]], dtype=np.float32)
+    # Band information written before the stack was split into parts has a single nodata value
+    nodata = [band.get("nodata", info.get("nodata")) for band in info["bands"]]
+    nodata = np.asarray([np.nan if x is None else x for x in nodata], dtype=np.float32)
+    return scales, nodata
+
+def _model_input(image, channels, scales, nodata=None):
+    """Select channels of a (bands, rows, cols) tile and convert them to float32, undoing the
+    storage scale. Tiles are stored as uint16 reflectances and float32 (or float16) derivatives,
+    this is the only conversion to float32. Pixels equal to the storage nodata value of their band
+    are set to the float32 nodata value (-9999) the models were trained with, so the scale never
+    applies to them."""
+    image = image[channels]
+    invalid = image == np.asarray(nodata)[channels, None, None] if nodata is not None else None
+    image = image.astype(np.float32)
+    if scales is not None:
+        image *= scales[channels, None, None]
+    if invalid is not None:
+        image[invalid] = STACK_NODATA["float32"]
+    return image
+
+InputTile = namedtuple("InputTile", ["stem", "read", "georeference"])
+
+def _georeference(tile_path):
+    ds = gdal.Open(str(tile_path))
+    return ds.GetGeoTransform(), ds.GetProjection(), ds.RasterXSize
+
+def _part_folders(input_tiles_folder):
+    """Tiles folders of the parts of a stack, listed in the band information next to the first
+    folder. Tiles without band information or written before the split are a single part."""
+    input_tiles_folder = Path(input_tiles_folder)
+    info_path = input_tiles_folder.with_suffix(".json")
+    if not info_path.exists():
+        return [input_tiles_folder]
+    with open(info_path, "r") as istream:
+        parts = json.load(istream).get("parts")
+    if not parts:
+        return [input_tiles_folder]
+    return [input_tiles_folder.parent/part["name"] for part in parts]
+
+def _read_parts(*tile_paths):
+    """(rows, cols, bands) tile concatenated from the tiles of the parts of a stack."""
+    if len(tile_paths) == 1:
+        return tifffile.imread(tile_paths[0])
+    return np.concatenate([np.atleast_3d(tifffile.imread(x)) for x in tile_paths], axis=-1)
+
+def _tile_order(name):
+    """Sort key of a tile name "Tile_<row offset>-<column offset>": row by row from the top, then by
+    column. Other names follow in alphabetical order."""
+    match = re.match(r"Tile_(\d+)-(\d+)", name)
+    return (0, int(match.group(1)), int(match.group(2)), "") if match else (1, 0, 0, name)
+
+def _input_tiles(input_tiles):
+    """Tiles of a tiles folder or of a memmap stack, given by its .json sidecar, row by row (see
+    _tile_order), the order FloodVectorizer expects. read() returns
+    the (rows, cols, bands) tile, concatenated from all parts of the stack (a zero-copy view for
+    single part memmap stacks), and georeference() its geotransform, projection and size."""
+    input_tiles = Path(input_tiles)
+    if input_tiles.suffix == ".json":
+        stack = MemmapStack(input_tiles)
+        return [InputTile(name, partial(stack.window, name), partial(stack.georeference, name))
+                for name in sorted(stack.names, key=_tile_order)]
+    folders = _part_folders(input_tiles)
+    return [InputTile(x.stem, partial(_read_parts, *[folder/x.name for folder in folders]), partial(_georeference, x))
+            for x in sorted(input_tiles.iterdir(), key=lambda x: _tile_order(x.stem))]
+
+def run_inference(floodsens_model, input_tiles_folder, channels=None, mini_batch_size=4, cuda=True, sigmoid_end=True, resume=False):
+    """Run the model on all tiles in input_tiles_folder (or the sidecar of a memmap stack) and pickle map
+    and channel importances per tile to the sibling folder "out_tiles". With resume=True, tiles that already have an output are skipped,
+    so an interrupted run continues after the last written batch.
+
+    Arguments:
+        floodsens_model {FloodsensModel, str, Path} -- Model to run. The network is loaded through
+            FloodsensModel.load_network, so repeated runs of the same checkpoint do not reload it. A
+            checkpoint path is wrapped into a FloodsensModel.
+        input_tiles_folder {str, Path} -- Folder containing the preprocessed tiles or the sidecar of a memmap stack.
+        (optional) channels {list} -- Input channels. Defaults to the channels of the model.
+        (optional) mini_batch_size {int} -- Number of tiles per forward pass.
+        (optional) cuda {bool} -- Run on GPU.
+        (optional) sigmoid_end {bool} -- Apply a sigmoid to the model outputs.
+        (optional) resume {bool} -- Skip tiles that already have an output.
+
+    Returns:
+        output_tiles_folder {Path} -- Folder containing the pickled outputs."""
+    if not isinstance(floodsens_model, FloodsensModel):
+        floodsens_model = FloodsensModel(floodsens_model, channels=channels)
+    channels = floodsens_model.channels if channels is None else channels
+
+    device = torch.device('cuda' if cuda else 'cpu')
+    model = floodsens_model.load_network(device)
+
+    means = np.expand_dims(np.asarray(floodsens_model.means, dtype=np.float32), axis=(1, 2))
+    stds = np.expand_dims(np.asarray(floodsens_model.stds, dtype=np.float32), axis=(1, 2))
 
     input_tiles_folder = Path(input_tiles_folder)
-    tiles = list(input_tiles_folder.iterdir())
+    output_tiles_folder = input_tiles_folder.parent/"out_tiles"
+    output_tiles_folder.mkdir(exist_ok=True)
+    for partial_output in output_tiles_folder.glob("*.tmp"):
+        partial_output.unlink()
+    tiles = _input_tiles(input_tiles_folder)
+    scales, nodata = _band_info(input_tiles_folder)
+
+    if resume:
+        done = {x.stem for x in output_tiles_folder.glob("yhat_*.pkl")}
+        tiles = [x for x in tiles if f"yhat_{x.stem}" not in done]
+        logger.info(f"Resuming inference. {len(done)} tiles already inferred, {len(tiles)} remaining.")
 
     m = len(tiles)
     mini_batches = []
@@ -44,87 +161,215 @@ def run_inference(model_path, input_tiles_folder, channels, mini_batch_size=4, c
         mini_batch = tiles[-(m - mini_batch_size*math.floor(m/mini_batch_size)):]
         mini_batches.append(mini_batch)
 
+    activation = {}
+    def get_activation(name):
+        def hook(model, input, output):
+            activation[name] = output.detach().cpu()
+        return hook
+
+    # The network is cached across calls, so the hook is removed again at the end
+    hook_handle = model.predown.fc[3].register_forward_hook(get_activation('importance_weights'))
+
     num_mini_batches = len(mini_batches)
     for k, mini_batch in enumerate(mini_batches):
         batch = []
 
         for tile in mini_batch:
-            in_image = tifffile.imread(tile)
-            in_image = np.moveaxis(in_image, -1, 0)
-            image = np.empty((0, in_image.shape[1], in_image.shape[2]))
-
-            for channel in channels:
-                image = np.append(image, np.expand_dims(in_image[channel], axis=0), axis=0)
-
-            image = (image-means)/stds
+            in_image = np.moveaxis(tile.read(), -1, 0)
+            image = (_model_input(in_image, list(channels), scales, nodata)-means)/stds
             batch.append(image)
 
         x_batch = torch.from_numpy(np.array(batch))
-        x_batch = torch.Tensor.float(x_batch)
+        x_batch = torch.Tensor.float(x_batch).to(device)
 
-        activation = {}
-        def get_activation(name):
-            def hook(model, input, output):
-                activation[name] = output.detach()
-            return hook
-
-        model.predown.fc[3].register_forward_hook(get_activation('importance_weights'))
-
-        y_hat = model(x_batch)
+        with torch.no_grad():
+            y_hat = model(x_batch)
         if sigmoid_end: y_hat = torch.sigmoid(y_hat)
+        y_hat = y_hat.cpu()
 
-        input_array, output_array, importance_array = [], [], []
-        output_tiles_folder = input_tiles_folder.parent/"out_tiles"
-        output_tiles_folder.mkdir(exist_ok=True)
-
-        for i, m in enumerate(y_hat):
+        for i, y in enumerate(y_hat):
             input_name = mini_batch[i].stem
             output_path = output_tiles_folder/f"yhat_{input_name}.pkl"
 
             result_dict = {}
-            result_dict['map'] = m.detach().numpy()
+            result_dict['map'] = y.detach().numpy()
             imp = activation['importance_weights'][i]
             result_dict['importances'] = list(imp.numpy())
-            pickle.dump(result_dict, open(output_path, 'wb'))
 
-            input_array.append(str(input_tiles_folder/f"{input_name}.tif"))
-            output_array.append(str(output_path))
-            importance_array.append(list(imp.numpy()))
+            _dump_result(result_dict, output_path)
 
         print(f"{100*k/num_mini_batches:.2f}% Completion", end='\r')
 
-    df = pd.DataFrame.from_dict({'input_file': input_array,
-                                'output_file': output_array,
-                                'importances': importance_array})
-
+    hook_handle.remove()
     return output_tiles_folder
 
 
-def create_map(tile_dir, inferred_dir, out_path, clean=True):
-    input_tiles = [str(x) for x in tile_dir.iterdir()]
-    input_tiles.sort()
-    out_tiles = [str(x) for x in inferred_dir.iterdir()]
-    out_tiles.sort()
-    tiles_dict = {'input_tiles': input_tiles, 'output_tiles': out_tiles}
-    tiles_df = pd.DataFrame.from_dict(tiles_dict)
+def run_multi_inference(models, input_tiles_folder, mini_batch_size=4, cuda=False, sigmoid_end=True, ensemble=True):
+    """Run several models over the same tiles in one pass. Every tile is read once and fed to each
+    model with that model's channel subset, means and stds. Outputs are pickled per model to the
+    sibling folder "out_tiles_<model name>" in the format of run_inference. With ensemble=True the
+    mean of all model outputs is written to "out_tiles_ensemble" as well.
+
+    Arguments:
+        models {list} -- FloodsensModel instances.
+        input_tiles_folder {str, Path} -- Folder containing the preprocessed tiles or the sidecar of a memmap stack.
+        (optional) mini_batch_size {int} -- Number of tiles per forward pass.
+        (optional) cuda {bool} -- Run on GPU.
+        (optional) sigmoid_end {bool} -- Apply a sigmoid to the model outputs.
+        (optional) ensemble {bool} -- Also write the averaged output of all models.
+
+    Returns:
+        output_folders {dict} -- Model names (and "ensemble") mapped to their output folder."""
+    device = torch.device('cuda' if cuda else 'cpu')
+    input_tiles_folder = Path(input_tiles_folder)
+
+    networks, activations, hook_handles, output_folders = [], [], [], {}
+    for floodsens_model in models:
+        network = floodsens_model.load_network(device)
+
+        activation = {}
+        def hook(model, input, output, activation=activation):
+            activation['importance_weights'] = output.detach().cpu()
+        # Networks are cached across calls, so the hook is removed again at the end
+        hook_handles.append(network.predown.fc[3].register_forward_hook(hook))
+
+        means = np.expand_dims(np.asarray(floodsens_model.means, dtype=np.float32), axis=(1, 2))
+        stds = np.expand_dims(np.asarray(floodsens_model.stds, dtype=np.float32), axis=(1, 2))
+        networks.append((floodsens_model.name, network, list(floodsens_model.channels), means, stds))
+        activations.append(activation)
+
+        output_folders[floodsens_model.name] = input_tiles_folder.parent/f"out_tiles_{floodsens_model.name}"
+    if ensemble:
+        output_folders["ensemble"] = input_tiles_folder.parent/"out_tiles_ensemble"
+    for output_folder in output_folders.values():
+        output_folder.mkdir(exist_ok=True)
+
+    tiles = _input_tiles(input_tiles_folder)
+    scales, nodata = _band_info(input_tiles_folder)
+    mini_batches = [tiles[k:k+mini_batch_size] for k in range(0, len(tiles), mini_batch_size)]
+
+    num_mini_batches = len(mini_batches)
+    for k, mini_batch in enumerate(mini_batches):
+        in_images = [np.moveaxis(tile.read(), -1, 0) for tile in mini_batch]
+
+        maps = []
+        for (name, network, channels, means, stds), activation in zip(networks, activations):
+            x_batch = torch.from_numpy(np.stack([(_model_input(image, channels, scales, nodata)-means)/stds for image in in_images])).to(device)
+            with torch.no_grad():
+                y_hat = network(x_batch)
+            if sigmoid_end: y_hat = torch.sigmoid(y_hat)
+            y_hat = y_hat.cpu().numpy()
+            maps.append(y_hat)
+
+            for i, tile in enumerate(mini_batch):
+                result_dict = {'map': y_hat[i], 'importances': list(activation['importance_weights'][i].numpy())}
+                _dump_result(result_dict, output_folders[name]/f"yhat_{tile.stem}.pkl")
+
+        if ensemble:
+            ensemble_maps = np.mean(maps, axis=0)
+            for i, tile in enumerate(mini_batch):
+                result_dict = {'map': ensemble_maps[i], 'importances': []}
+                _dump_result(result_dict, output_folders["ensemble"]/f"yhat_{tile.stem}.pkl")
+
+        print(f"{100*k/num_mini_batches:.2f}% Completion", end='\r')
+
+    for hook_handle in hook_handles:
+        hook_handle.remove()
+
+    return output_folders
+
+
+def write_importances(tile_names, geotransforms, tile_size, importances, projection, raster_path, table_path=None, nodata=-9999):
+    """Write channel importances of all tiles at once: a multiband raster at raster_path with one pixel
+    per tile and one band per channel, and a table keyed by tile offset (tile, row_offset, col_offset,
+    channel_0, ...) at table_path. The table is Parquet for a .parquet suffix (requires pyarrow) and
+    CSV otherwise, it defaults to raster_path with a .csv suffix.
+
+    Arguments:
+        tile_names {list} -- Tile stems, "Tile_<row offset>-<column offset>".
+        geotransforms {list} -- Geotransform of every tile.
+        tile_size {int} -- Size of the tiles in pixels.
+        importances {ndarray} -- (tiles, channels) importances.
+        projection {str} -- WKT of the tile projection.
+        raster_path {str, Path} -- Output raster.
+        (optional) table_path {str, Path} -- Output table.
+        (optional) nodata {float} -- Value of pixels without a tile.
+
+    Returns:
+        raster_path, table_path {Path, Path}"""
+    raster_path = Path(raster_path)
+    table_path = raster_path.with_suffix(".csv") if table_path is None else Path(table_path)
+    geotransforms = np.asarray(geotransforms, dtype=np.float64)
+    pixel_width, pixel_height = geotransforms[0, 1]*tile_size, geotransforms[0, 5]*tile_size
+
+    origin_x, origin_y = geotransforms[:, 0].min(), geotransforms[:, 3].max()
+    cols = np.rint((geotransforms[:, 0] - origin_x)/pixel_width).astype(int)
+    rows = np.rint((geotransforms[:, 3] - origin_y)/pixel_height).astype(int)
+    grid = np.full((importances.shape[1], rows.max()+1, cols.max()+1), nodata, dtype=np.float32)
+    grid[:, rows, cols] = importances.T
+
+    out_ds = gdal.GetDriverByName('GTiff').Create(str(raster_path), grid.shape[2], grid.shape[1], grid.shape[0], gdal.GDT_Float32)
+    out_ds.SetProjection(projection)
+    out_ds.SetGeoTransform((origin_x, pixel_width, 0.0, origin_y, 0.0, pixel_height))
+    for band_number in range(grid.shape[0]):
+        band = out_ds.GetRasterBand(band_number+1)
+        band.SetNoDataValue(nodata)
+        band.WriteArray(grid[band_number])
+    out_ds = None
+
+    offsets = [re.match(r"Tile_(\d+)-(\d+)", name) for name in tile_names]
+    table = pd.DataFrame(importances, columns=[f"channel_{k}" for k in range(importances.shape[1])])
+    table.insert(0, "col_offset", [int(x.group(2)) if x else None for x in offsets])
+    table.insert(0, "row_offset", [int(x.group(1)) if x else None for x in offsets])
+    table.insert(0, "tile", tile_names)
+    if table_path.suffix == ".parquet":
+        table.to_parquet(table_path, index=False)
+    else:
+        table.to_csv(table_path, index=False)
+
+    return raster_path, table_path
+
+def create_map(tile_dir, inferred_dir, out_path, clean=True, importances_path=None, output_format="GTiff", mask_path=None,
+               polygons_path=None, threshold=0.5, importances_table=None, statistics=None, flood_mask_path=None):
+    """Mosaic inferred tiles into the raster out_path. Channel importances of all tiles are collected and
+    written once by write_importances, to importances_path (defaults to "channel_importances.tif" next to
+    out_path, one pixel per tile) and importances_table (defaults to the same path with a .csv suffix).
+    Tiles without importances (e.g. ensemble outputs) only contribute to the map. output_format is any GDAL raster driver, e.g. "GTiff" or "COG".
+    Pixels invalid in the optional validity mask at mask_path (e.g. clouds) are set to nodata, tiles
+    skipped during tiling are nodata as well. With polygons_path (.gpkg or .geojson), pixels with a
+    probability >= threshold are vectorized tile by tile in the same pass, see FloodVectorizer. A
+    MapStatistics instance passed as statistics accumulates every tile as it is written, and with
+    flood_mask_path a uint8 mask (1 flooded at threshold, 0 dry, 255 nodata) is written alongside."""
+    if importances_path is None:
+        importances_path = Path(out_path).parent/'channel_importances.tif'
+
+    input_tiles = _input_tiles(tile_dir)
 
     noData_value = -9999
 
     out_path = Path(out_path)
     out_path.parent.mkdir(exist_ok=True)
+    mask_ds = gdal.Open(str(mask_path)) if mask_path is not None else None
+    vectorizer = None
+    importance_names, importance_transforms, importance_rows = [], [], []
     
-    for row in tiles_df.iterrows():
-        input_tile = row[1]['input_tiles']
-        inferred_tile = row[1]['output_tiles']
+    for input_tile in input_tiles:
+        inferred_tile = Path(inferred_dir)/f"yhat_{input_tile.stem}.pkl"
         
         inferred_result = pickle.load(open(inferred_tile, 'rb'))
         inferred_map_array = inferred_result['map'][0,:,:]
         inferred_imp_array = inferred_result['importances']
 
-        input_raster = gdal.Open(str(input_tile))
-        gt = input_raster.GetGeoTransform()
-        proj = input_raster.GetProjection()
-        x_res, y_res = input_raster.RasterXSize, input_raster.RasterYSize
+        gt, proj, x_res = input_tile.georeference()
+        y_res = x_res
+        if mask_ds is not None:
+            inferred_map_array = np.where(read_mask_window(mask_ds, gt, x_res) == 1, inferred_map_array, noData_value)
+        if statistics is not None:
+            statistics.add(inferred_map_array, gt, projection=proj)
+        if polygons_path is not None:
+            if vectorizer is None:
+                vectorizer = FloodVectorizer(polygons_path, proj, threshold=threshold, nodata=noData_value)
+            vectorizer.add(inferred_map_array, gt)
 
         tile_basename = Path(inferred_tile).stem
         driver = gdal.GetDriverByName('GTiff')
@@ -138,39 +383,52 @@ def create_map(tile_dir, inferred_dir, out_path, clean=True):
         band.WriteArray(inferred_map_array)
         out_ds = None
 
-        gt_imp = list(gt)
-        gt_imp[1] = gt[1] * x_res
-        gt_imp[5] = gt[5] * y_res
-        gt_imp = tuple(gt_imp)
-
-        bands = len(inferred_imp_array)
-
-        importances_ds = gdal.GetDriverByName('GTiff').Create(str(out_path.parent/f"{tile_basename}_imp.tif"), 1, 1, bands, gdal.GDT_Float32)
-        importances_ds.SetProjection(proj)
-        importances_ds.SetGeoTransform(gt_imp)
-
-        for band_number in range(bands):
-            band = importances_ds.GetRasterBand(band_number+1)
-            band.SetNoDataValue(noData_value)
-            band.WriteArray(np.array([[inferred_imp_array[band_number]]])) #this should be a scalar; does it work?
-            band.FlushCache()
-        importances_ds = None
+        if flood_mask_path is not None:
+            flood_mask = np.where(inferred_map_array >= threshold, 1, 0).astype(np.uint8)
+            flood_mask[(inferred_map_array == noData_value) | np.isnan(inferred_map_array)] = 255
+            mask_tile_ds = driver.Create(str(out_path.parent/f"{tile_basename}_mask.tif"), x_res, y_res, 1, gdal.GDT_Byte)
+            mask_tile_ds.SetGeoTransform(gt)
+            mask_tile_ds.SetProjection(proj)
+            mask_tile_ds.GetRasterBand(1).SetNoDataValue(255)
+            mask_tile_ds.GetRasterBand(1).WriteArray(flood_mask)
+            mask_tile_ds = None
+
+        if len(inferred_imp_array) > 0:
+            importance_names.append(input_tile.stem)
+            importance_transforms.append(gt)
+            importance_rows.append(inferred_imp_array)
+
+    mask_ds = None
+    if vectorizer is not None:
+        vectorizer.close()
 
     map_tiles =  [str(x) for x in out_path.parent.iterdir() if x.is_file() and x.name.startswith('yhat_') and x.name.endswith('_map.tif')] # glob.glob('*map.tif')
     vrt_options = gdal.BuildVRTOptions()
-    map_vrt = gdal.BuildVRT('inferred_map.vrt', map_tiles, options=vrt_options)
-    gdal.Translate(str(out_path), map_vrt)
-
-    imp_tiles = [str(x) for x in out_path.parent.iterdir() if x.is_file() and x.name.startswith('yhat_') and x.name.endswith('_imp.tif')]
-    vrt_options = gdal.BuildVRTOptions()
-    imp_vrt = gdal.BuildVRT('channel_importances.vrt', imp_tiles, options=vrt_options)
-    gdal.Translate(str(out_path.parent/'channel_importances.tif'), imp_vrt)
+    # Next to the output, so events mapped concurrently from one working directory never share it
+    map_vrt_path = out_path.with_name(f"{out_path.stem}_tiles.vrt")
+    map_vrt = gdal.BuildVRT(str(map_vrt_path), map_tiles, options=vrt_options)
+    gdal.Translate(str(out_path), map_vrt, format=output_format)
+    map_vrt = None
+    map_vrt_path.unlink()
+
+    flood_mask_tiles = [str(x) for x in out_path.parent.iterdir() if x.is_file() and x.name.startswith('yhat_') and x.name.endswith('_mask.tif')]
+    if flood_mask_path is not None and len(flood_mask_tiles) > 0:
+        flood_mask_path = Path(flood_mask_path)
+        mask_vrt_path = flood_mask_path.with_name(f"{flood_mask_path.stem}_tiles.vrt")
+        mask_vrt = gdal.BuildVRT(str(mask_vrt_path), flood_mask_tiles, options=vrt_options)
+        gdal.Translate(str(flood_mask_path), mask_vrt, format=output_format, creationOptions=["COMPRESS=DEFLATE"])
+        mask_vrt = None
+        mask_vrt_path.unlink()
+
+    if len(importance_rows) > 0:
+        write_importances(importance_names, importance_transforms, x_res, np.asarray(importance_rows, dtype=np.float32),
+                          proj, importances_path, table_path=importances_table, nodata=noData_value)
 
     if clean:
         for map_tile in map_tiles:
             Path(map_tile).unlink()
-        for imp_tile in imp_tiles:
-            Path(imp_tile).unlink()
+        for flood_mask_tile in flood_mask_tiles:
+            Path(flood_mask_tile).unlink()
 
     # TODO Include below options cleanly in gdal.Translate() call
     # subprocess.call(['gdal_translate', '-of', 'COG', 'map.vrt', directory/'map.tif', '--config', 'CHECK_DISK_FREE_SPACE', 'NO'])
@@ -1,106 +1,155 @@
+import uuid
 from floodsens.logger import logger
-from osgeo import gdal, gdalconst, ogr
+from osgeo import gdal, gdalconst, ogr, osr
+from pathlib import Path
 import numpy as np
-import geopandas as gpd
 
+CREATION_OPTIONS = ["TILED=YES", "COMPRESS=DEFLATE"]
+
+
+def _target_grid(raster_paths, vrt_path):
+    """Opens the raster defining the target grid. Multiple rasters are combined into the
+    in-memory VRT vrt_path covering their union, so labels can be produced for mosaics.
+    Raises ValueError if the rasters do not share a projection, GDAL would silently leave
+    out the others."""
+    if len(raster_paths) == 1:
+        return gdal.Open(str(raster_paths[0]), gdalconst.GA_ReadOnly)
+
+    projections = []
+    for raster_path in raster_paths:
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(gdal.Open(str(raster_path), gdalconst.GA_ReadOnly).GetProjection())
+        projections.append(srs)
+    mixed = [str(x) for x, srs in zip(raster_paths, projections) if not srs.IsSame(projections[0])]
+    if mixed:
+        raise ValueError(f"Rasters {mixed} do not share the projection of {raster_paths[0]}. Reproject them onto a common grid first.")
+
+    ds = gdal.BuildVRT(vrt_path, [str(x) for x in raster_paths])
+    if ds is None:
+        raise ValueError(f"Rasters could not be combined into a common grid: {raster_paths}")
+    return ds
+
+def rasterize(shape_path, raster_path, out_path, no_data=None, burn_value=1, all_touched=True, attribute=None):
+    """Takes shapefile and turns it into a uint8 raster with the same resolution,
+    projection and geotransform as in the provided raster(s). The vector is read once
+    and burned directly onto the target grid.
 
-def rasterize(shape_path, raster_path, out_path, no_data=-9999):
-    """Takes shapefile and turns it into a raster with the same resolution, 
-    projection and geotransform as in the provided raster. Returns None if 
-    processing is skipped due to errors.
-    
     Parameters
     ----------
     shape_path:     str or PosixPath
                     path to shapefile to be transformed
-    raster_path:    str or PosixPath
-                    path to raster that provides target projection, geotransform
-                    and resolution. Tested for GeoTIFF and JP2000
+    raster_path:    str, PosixPath or list
+                    path(s) to raster(s) that provide target projection, geotransform
+                    and resolution. Multiple rasters are mosaicked into a common grid
+                    covering all of them. Tested for GeoTIFF and JP2000
     out_path:       str or PosixPath
                     path at which resulting output is saved
-    no_data:        int, float or np.nan
-                    no data value for output raster
-    
+    no_data:        int or None
+                    no data value for output raster (0-255), None to leave unset
+    burn_value:     int
+                    value burned into pixels covered by geometries
+    all_touched:    bool
+                    burn all pixels touched by geometries, not only those whose
+                    center lies within
+    attribute:      str or None
+                    burn values from this attribute field instead of burn_value
+
     Returns:
     ----------
     out_path:       PosixPath
                     path to output raster. Return None if processing was skipped.
 
     """
-    if isinstance(raster_path, list):
-        if len(raster_path) == 1:
-            raster_path = raster_path[0]
-        else:
-            logger.warning(f"Multiple Rasters provided for label rasterization. Label Processing skipped!")
-            return None
-
-    ds = gdal.Open(str(raster_path), gdalconst.GA_ReadOnly)
+    if not isinstance(raster_path, list):
+        raster_path = [raster_path]
 
+    # Unique per call, labels of several events may be rasterized concurrently
+    vrt_path = f"/vsimem/label_target_grid_{uuid.uuid4().hex}.vrt"
+    ds = _target_grid(raster_path, vrt_path)
     gt = ds.GetGeoTransform()
     x_res = ds.RasterXSize
     y_res = ds.RasterYSize
     raster_xmin = gt[0]
     raster_ymax = gt[3]
     raster_xmax = raster_xmin + gt[1] * ds.RasterXSize
-    raster_ymin = raster_ymax + gt[5] * ds.RasterYSize    
+    raster_ymin = raster_ymax + gt[5] * ds.RasterYSize
 
     shapefile = ogr.Open(str(shape_path))
+    if shapefile is None:
+        logger.warning(f"Could not open {shape_path}. Label processing skipped!")
+        ds = None
+        gdal.Unlink(vrt_path)
+        return None
     shapefile_layer = shapefile.GetLayer()
+    shp_xmin, shp_xmax, shp_ymin, shp_ymax = shapefile_layer.GetExtent()
 
-    gdf = gpd.read_file(shape_path)
-    shape_extent = gdf.geometry.total_bounds
-    shp_xmin, shp_ymin = shape_extent[0], shape_extent[2]
-    shp_xmax, shp_ymax = shape_extent[1], shape_extent[3]    
-
-    logger.info(f"Raster extent [{raster_xmin},{raster_xmax},{raster_xmin},{raster_ymax}] and Label extent [{shape_extent[0]},{shape_extent[1]},{shape_extent[2]},{shape_extent[3]}]")
-
-    # if (shp_xmin > raster_xmax or shp_xmax < raster_xmin or shp_ymax < raster_ymin or shp_ymin > raster_ymax):
-    #     logger.warning("The shapefile and raster do not overlap. Label processing skipped!")
-    #     return None    
+    logger.info(f"Raster extent [{raster_xmin},{raster_xmax},{raster_ymin},{raster_ymax}] and Label extent [{shp_xmin},{shp_xmax},{shp_ymin},{shp_ymax}]")
 
     driver = gdal.GetDriverByName('GTiff')
     driver.Register()
-    target_ds = driver.Create(str(out_path), x_res, y_res, 1, gdalconst.GDT_Byte)
+    target_ds = driver.Create(str(out_path), x_res, y_res, 1, gdalconst.GDT_Byte, options=CREATION_OPTIONS)
     target_ds.SetProjection(ds.GetProjection())
     target_ds.SetGeoTransform(gt)
     band = target_ds.GetRasterBand(1)
-    band.SetNoDataValue(no_data)
-    band.FlushCache()
-    gdal.RasterizeLayer(target_ds, [1], shapefile_layer)
+    if no_data is not None:
+        band.SetNoDataValue(no_data)
+    band.Fill(0)
+
+    options = [f"ALL_TOUCHED={'TRUE' if all_touched else 'FALSE'}"]
+    if attribute is not None:
+        options.append(f"ATTRIBUTE={attribute}")
+        gdal.RasterizeLayer(target_ds, [1], shapefile_layer, options=options)
+    else:
+        gdal.RasterizeLayer(target_ds, [1], shapefile_layer, burn_values=[burn_value], options=options)
+
+    band = None
     target_ds = None
+    shapefile = None
+    ds = None
+    gdal.Unlink(vrt_path)
 
-    return out_path
+    return Path(out_path)
 
 def binarize(label_path, out_path):
-    """Takes rasterized labels and creates a raster with binary entries. All entries larger than 0
-    will be assigned 1 while all negative values are assigned the value of 0.
-    
+    """Takes rasterized labels and creates a uint8 raster with binary entries. All entries larger than 0
+    will be assigned 1 while all other values are assigned the value of 0. The raster is processed
+    block by block so memory use does not depend on the raster size.
+
     Parameters
     ----------
     label_path:     str or PosixPath
                     path to raster GeoTIFF file
     out_path:       str or PosixPath
                     path at which resulting output is saved
-    
+
     Return
     ----------
     out_path:       PosixPath
                     path of computed output
     """
     ds = gdal.Open(str(label_path))
-    arr = ds.ReadAsArray()
-    arr = np.where(arr>0, 1, 0)
-    gt = ds.GetGeoTransform()
-    proj = ds.GetProjection()
+    in_band = ds.GetRasterBand(1)
+    x_size, y_size = ds.RasterXSize, ds.RasterYSize
+    block_rows = max(in_band.GetBlockSize()[1], 256)
+
     driver = gdal.GetDriverByName('GTiff')
     driver.Register()
     outds = driver.Create(str(out_path),
-                         xsize = arr.shape[1],
-                         ysize = arr.shape[0],
-                         bands = 1)
-    outds.SetProjection(proj)
-    outds.SetGeoTransform(gt)
-    outds.GetRasterBand(1).WriteArray(arr)
+                         xsize = x_size,
+                         ysize = y_size,
+                         bands = 1,
+                         eType = gdalconst.GDT_Byte,
+                         options = CREATION_OPTIONS)
+    outds.SetProjection(ds.GetProjection())
+    outds.SetGeoTransform(ds.GetGeoTransform())
+    out_band = outds.GetRasterBand(1)
+
+    for yoff in range(0, y_size, block_rows):
+        rows = min(block_rows, y_size - yoff)
+        arr = in_band.ReadAsArray(0, yoff, x_size, rows)
+        out_band.WriteArray(np.greater(arr, 0).view(np.uint8), 0, yoff)
+
+    out_band = None
     outds = None
 
-    return out_path
+    return Path(out_path)
@@ -1,137 +1,124 @@
-import torch
-import torch.nn as nn
-import torchvision.transforms.functional as TF
-
+"""The model module contains the FloodsensModel class describing a trained checkpoint. The network
+architecture lives in floodsens._network and, like torch, is only imported when weights are loaded."""
+import json
 from pathlib import Path
+from collections import OrderedDict
+import floodsens.utils as utils
+from floodsens.logger import logger
 
-class DoubleConv(nn.Module):
-    def __init__(self, in_channels, out_channels):
-        super(DoubleConv, self).__init__() # NOTE Check if working
-        self.conv = nn.Sequential(
-            nn.Conv2d(in_channels, out_channels, 3, 1, 1, bias = False),
-            nn.BatchNorm2d(out_channels),
-            nn.ReLU(inplace=True),
-            nn.Conv2d(out_channels, out_channels, 3, 1, 1, bias = False),
-            nn.BatchNorm2d(out_channels),
-            nn.ReLU(inplace=True)
-        )
-
-        self.initialize_weights()
-
-    def forward(self, x):
-        return self.conv(x)
-    
-    def initialize_weights(self):
-        for m in self.modules():
-            if isinstance(m, nn.Conv2d):
-                nn.init.xavier_uniform_(m.weight)
-            
-            if isinstance(m, nn.BatchNorm2d):
-                nn.init.constant_(m.weight, 1)
-                nn.init.constant_(m.bias, 0)
-            
-
-class SELayer(nn.Module):
-    """"https://github.com/moskomule/senet.pytorch/blob/master/senet/se_module.py"""
-    def __init__(self, channel, reduction=16):
-        super(SELayer, self).__init__()
-
-        reduction = channel if channel // reduction == 0 else 16
-        
-        self.avg_pool = nn.AdaptiveAvgPool2d(1)
-        self.fc = nn.Sequential(
-            nn.Linear(channel, channel // reduction, bias=False),
-            nn.ReLU(inplace=True),
-            nn.Linear(channel // reduction, channel, bias=False),
-            nn.Sigmoid()
-        )
-
-        self.initialize_weights()
-    
-    def forward(self, x): # NOTE Weird forward, don't know these functions
-        b, c, _, _ = x.size()
-        y = self.avg_pool(x).view(b, c)
-        y = self.fc(y)
-        y = y.view(b, c, 1, 1)
-        return x * y.expand_as(x)
-
-    def initialize_weights(self):
-        for m in self.modules():
-            if isinstance(m, nn.Linear):
-                nn.init.xavier_uniform_(m.weight)
-            
-
-class MainNET(nn.Module):
-    def __init__(self, in_channels, out_channels, features=[64,128,256,512]):
-        super(MainNET, self).__init__()
-
-        self.predown = SELayer(in_channels)
-        self.downs = nn.ModuleList()
-        self.ups = nn.ModuleList()
-        
-        self.pool = nn.MaxPool2d(kernel_size=2, stride=2)
-
-        for feature in features: # One Module per feature
-            self.downs.append(DoubleConv(in_channels, feature))
-            in_channels = feature
-
-        for feature in reversed(features): # Two Modules per feature
-            self.ups.append(nn.ConvTranspose2d(2*feature, feature, kernel_size=2, stride=2))
-            self.ups.append(DoubleConv(2*feature, feature))
-    
-        self.bottleneck = DoubleConv(features[-1], 2*features[-1])
-        self.out = nn.Conv2d(features[0], out_channels, kernel_size=1)
-
-        self.initialize_weights()
-
-
-    def forward(self, x):
-        x = self.predown(x)
+_NETWORK_CLASSES = ("DoubleConv", "SELayer", "MainNET")
 
-        skip_connections = []
-        for down in self.downs:
-            x = down(x)
-            skip_connections.append(x)
-            x = self.pool(x)
 
-        x = self.bottleneck(x)
-        
-        for idx, skip_connection in enumerate(reversed(skip_connections)):
-            x = self.ups[2*idx](x)
+def __getattr__(name):
+    # Keeps `from floodsens.model import MainNET` working without importing torch with this module
+    if name in _NETWORK_CLASSES:
+        import floodsens._network as _network
+        return getattr(_network, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-            if x.shape != skip_connection.shape:
-                x = TF.resize(x, size=skip_connection.shape[2:])
-
-            concat_skip = torch.cat((skip_connection, x), dim=1)
-            x = self.ups[2*idx + 1](concat_skip)
-        
-        return self.out(x)
-
-    def initialize_weights(self):
-        for m in self.modules():
-            if isinstance(m, nn.ConvTranspose2d):
-                nn.init.xavier_uniform_(m.weight)
-
-            if isinstance(m, nn.Conv2d):
-                nn.init.xavier_uniform_(m.weight)
+NETWORK_CACHE_SIZE = 2
+_network_cache = OrderedDict()
 
 
 class FloodsensModel():
-    def __init__(self, path, name=None, means=None, stds=None, channels=None, device="cpu"):
-        model_dict = torch.load(path, map_location=torch.device(device))
+    """Metadata of a trained FloodSENS checkpoint. Only name, channels, means and stds are kept in memory;
+    the weights are loaded on demand with load_network. The metadata is read from a JSON sidecar
+    (<checkpoint>.json) when it matches the checkpoint, otherwise from the checkpoint itself, after
+    which the sidecar is written so later scans of a model zoo do not load any weights.
+
+    Arguments:
+        path {str, Path} -- Path to the checkpoint (.tar).
+        (optional) name {str} -- Name of the model. Defaults to the file name.
+        (optional) means, stds {list} -- Normalisation of the input channels. Read from the checkpoint if None.
+        (optional) channels {list} -- Input channels used by the model. Defaults to all channels.
+        (optional) device {str} -- Default device for load_network.
+        (optional) fingerprint {str} -- Fingerprint of the checkpoint file the metadata was read from."""
+    def __init__(self, path, name=None, means=None, stds=None, channels=None, device="cpu", fingerprint=None):
         self.path = Path(path)
+        self.device = device
+        self.fingerprint = fingerprint if fingerprint is not None or not self.path.exists() else utils.fingerprint(self.path)
+
+        if means is None or stds is None:
+            metadata = self._read_metadata()
+            means = means if means is not None else metadata["model_means"]
+            stds = stds if stds is not None else metadata["model_stds"]
 
         self.name = self.path.stem if name is None else name
-        self.means = means if means is not None else model_dict["model_means"]
-        self.stds = stds if stds is not None else model_dict["model_stds"]
+        self.means = means
+        self.stds = stds
 
         if channels is not None:
             self.channels = channels
-        elif len(self.stds) == 14:
-            self.channels = [0,1,2,3,4,5,6,7,8,9,10,11,12,13]
-    
+        else:
+            self.channels = list(range(len(self.stds)))
+
+    def _sidecar_path(self):
+        return self.path.with_name(f"{self.path.name}.json")
+
+    def _read_metadata(self):
+        """Read means and stds from the sidecar if it matches the checkpoint, otherwise from the checkpoint."""
+        sidecar_path = self._sidecar_path()
+        if sidecar_path.exists():
+            with open(sidecar_path, "r") as istream:
+                metadata = json.load(istream)
+            if metadata.get("fingerprint") == self.fingerprint:
+                return metadata
+
+        import torch
+        try: # Memory maps the checkpoint instead of reading all weights (torch >= 2.1)
+            model_dict = torch.load(self.path, map_location=torch.device("cpu"), mmap=True)
+        except (TypeError, RuntimeError):
+            model_dict = torch.load(self.path, map_location=torch.device("cpu"))
+        metadata = {"fingerprint": self.fingerprint,
+                    "model_means": [float(x) for x in model_dict["model_means"]],
+                    "model_stds": [float(x) for x in model_dict["model_stds"]]}
+        del model_dict
+
+        try:
+            with open(sidecar_path, "w") as ostream:
+                json.dump(metadata, ostream)
+        except OSError:
+            logger.debug(f"Could not write model metadata sidecar {sidecar_path}")
+
+        return metadata
+
+    def load_network(self, device=None):
+        """Return the MainNET with the weights of this checkpoint in eval mode. The most recently used
+        networks (NETWORK_CACHE_SIZE) are kept in memory and returned without reloading.
+
+        Arguments:
+            (optional) device {str} -- Device to load the network on. Defaults to the device of the model."""
+        device = self.device if device is None else device
+        key = (str(self.path), self.fingerprint, str(device))
+        if key in _network_cache:
+            _network_cache.move_to_end(key)
+            return _network_cache[key]
+
+        import torch
+        from floodsens._network import MainNET
+
+        model_dict = torch.load(self.path, map_location=torch.device(device))
+        network = MainNET(in_channels=len(model_dict["model_means"]), out_channels=1)
+        network.load_state_dict(model_dict["model_state_dict"])
+        network.to(device).eval()
+
+        _network_cache[key] = network
+        while len(_network_cache) > NETWORK_CACHE_SIZE:
+            _network_cache.popitem(last=False)
+
+        return network
+
     def __repr__(self):
         return f'{self.__class__.__name__}({self.path}, {self.name}, {self.channels}, {self.means}, {self.stds})'.format(self=self)
+
+    def to_dict(self):
+        """Plain representation with the constructor arguments, safe to store as YAML or JSON."""
+        return {"path": str(self.path),
+                "name": self.name,
+                "means": [float(x) for x in self.means],
+                "stds": [float(x) for x in self.stds],
+                "channels": [int(x) for x in self.channels],
+                "fingerprint": self.fingerprint}
     
     def __str__(self) -> str:
         s = f"\tName: {self.name}\n" 
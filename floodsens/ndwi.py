@@ -1,49 +1,119 @@
-import floodsens.utils as utils
-from osgeo import gdal
-from pathlib import Path
+"""NDWI baseline. Computes the Normalized Difference Water Index (McFeeters) from the green (B03)
+and near infrared (B08) bands, read directly from the Sentinel-2 archives without extraction."""
 import shutil
+import numbers
+import warnings
+from pathlib import Path
+import numpy as np
+from osgeo import gdal
+from floodsens.archive import archive_index
+from floodsens.logger import logger
 
-def compute_ndwi(archives, threshold, project_dir):
-    temp_dir = Path(f"{project_dir}/temp")
-    temp_dir.mkdir(exist_ok=True)
+NDWI_BANDS = (("B03", "10m"), ("B08", "10m"))
 
-    ndwi_paths = []
-    for k, archive in enumerate(archives):
-        # Setup save path
-        ndwi_path = Path(f"{temp_dir}/ndwi_{k}.tif")
+def _band_paths(zip_path, bands=NDWI_BANDS):
+    """Return GDAL /vsizip/ paths for the requested (band, resolution) pairs of a Sentinel-2 archive."""
+    index = archive_index(zip_path)
+    return [index.vsizip(band, resolution) for band, resolution in bands]
+
+def ndwi_raster(zip_path, out_path, threshold=None, no_data=-9999, block_rows=1024):
+    """Compute NDWI for a single Sentinel-2 archive and write it to out_path. The raster is
+    processed in blocks of block_rows lines in float32 so memory stays bounded for full scenes.
+
+    Arguments:
+        zip_path {str, Path} -- Path to the Sentinel-2 archive.
+        out_path {str, Path} -- Path of the output GeoTIFF.
+        (optional) threshold {float} -- If given, a uint8 water mask (NDWI > threshold) is written instead.
+        (optional) no_data {int, float} -- No data value of the float output. The mask uses 255.
+        (optional) block_rows {int} -- Number of raster lines processed at once.
+
+    Returns:
+        out_path {Path} -- Path to the output raster."""
+    green_path, nir_path = _band_paths(zip_path)
+    green_ds = gdal.Open(green_path, gdal.GA_ReadOnly)
+    nir_ds = gdal.Open(nir_path, gdal.GA_ReadOnly)
+    x_size, y_size = green_ds.RasterXSize, green_ds.RasterYSize
+
+    driver = gdal.GetDriverByName("GTiff")
+    driver.Register()
+    if threshold is None:
+        out_ds = driver.Create(str(out_path), x_size, y_size, 1, gdal.GDT_Float32, options=["TILED=YES", "COMPRESS=DEFLATE"])
+        out_no_data = no_data
+    else:
+        out_ds = driver.Create(str(out_path), x_size, y_size, 1, gdal.GDT_Byte, options=["TILED=YES", "COMPRESS=DEFLATE"])
+        out_no_data = 255
+    out_ds.SetProjection(green_ds.GetProjection())
+    out_ds.SetGeoTransform(green_ds.GetGeoTransform())
+    out_band = out_ds.GetRasterBand(1)
+    out_band.SetNoDataValue(out_no_data)
 
-        # Extract B08 and B03 from archive
-        extracted_bands = utils.extract(archive, project_dir/"ndwi", (("B03", "10m"), ("B08", "10m")))
+    green_band, nir_band = green_ds.GetRasterBand(1), nir_ds.GetRasterBand(1)
+    for yoff in range(0, y_size, block_rows):
+        rows = min(block_rows, y_size - yoff)
+        green = green_band.ReadAsArray(0, yoff, x_size, rows).astype(np.float32)
+        nir = nir_band.ReadAsArray(0, yoff, x_size, rows).astype(np.float32)
 
-        # Read B08 and B03 as arrays with gdal
-        b03 = gdal.Open(str(extracted_bands[0]))
-        b03_arr = b03.ReadAsArray()
-        b08 = gdal.Open(str(extracted_bands[1]))
-        b08_arr = b08.ReadAsArray()
+        total = green + nir
+        valid = total > 0
+        np.subtract(green, nir, out=green)
+        ndwi = np.full(green.shape, no_data, dtype=np.float32)
+        np.divide(green, total, out=ndwi, where=valid)
 
-        # Compute NDWI
-        ndwi = (b08_arr - b03_arr) / (b08_arr + b03_arr)
+        if threshold is None:
+            out_band.WriteArray(ndwi, 0, yoff)
+        else:
+            mask = np.full(ndwi.shape, out_no_data, dtype=np.uint8)
+            mask[valid] = ndwi[valid] > threshold
+            out_band.WriteArray(mask, 0, yoff)
 
-        # Save NDWI to disk with gdal
-        driver = gdal.GetDriverByName("GTiff")
-        driver.Register()
-        ndwi_ds = driver.Create(str(ndwi_path), ndwi.shape[1], ndwi.shape[0], 1, gdal.GDT_Float32)
-        ndwi_ds.GetRasterBand(1).WriteArray(ndwi)
+    out_band.FlushCache()
+    out_band, out_ds, green_ds, nir_ds = None, None, None, None
 
-        # Set projection and geotransform based on B03
-        ndwi_ds.SetProjection(b03.GetProjection())
-        ndwi_ds.SetGeoTransform(b03.GetGeoTransform())
+    return Path(out_path)
 
-        # Save ndwi_ds to disk
-        ndwi_ds.FlushCache()
+def compute_ndwi(archives, out_path, threshold=None, no_data=-9999):
+    """Compute NDWI for one or more Sentinel-2 archives and merge the results into a single raster.
 
+    The former signature compute_ndwi(archives, threshold, project_dir), writing
+    project_dir/ndwi/ndwi.tif, is still accepted with a DeprecationWarning.
+
+    Arguments:
+        archives {list} -- Paths to Sentinel-2 archives.
+        out_path {str, Path} -- Path of the merged output GeoTIFF.
+        (optional) threshold {float} -- If given, a uint8 water mask is written instead of NDWI values.
+        (optional) no_data {int, float} -- No data value of the output.
+
+    Returns:
+        out_path {Path} -- Path to the merged raster (str for the former signature)."""
+    if out_path is None or isinstance(out_path, numbers.Number):
+        warnings.warn("compute_ndwi(archives, threshold, project_dir) is deprecated, "
+                      "use compute_ndwi(archives, out_path, threshold=threshold)", DeprecationWarning, stacklevel=2)
+        if threshold is None:
+            raise TypeError("compute_ndwi() missing the project_dir of the former signature")
+        out_path, threshold = Path(threshold)/"ndwi"/"ndwi.tif", out_path
+        return str(compute_ndwi(archives, out_path, threshold=threshold, no_data=no_data))
+
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if len(archives) == 1:
+        ndwi_raster(archives[0], out_path, threshold=threshold, no_data=no_data)
+        logger.info(f"NDWI computed for {archives[0]}.")
+        return out_path
+
+    temp_dir = out_path.parent/f"{out_path.stem}_temp"
+    temp_dir.mkdir(exist_ok=True)
+
+    ndwi_paths = []
+    for k, archive in enumerate(archives):
+        ndwi_path = ndwi_raster(archive, temp_dir/f"ndwi_{k}.tif", threshold=threshold, no_data=no_data)
         ndwi_paths.append(str(ndwi_path))
-    
-    # Create vrt from ndwi_paths
-    gdal.BuildVRT(str(temp_dir/"ndwi.vrt"), ndwi_paths)
-    merged_ndwi_path = str(project_dir/"ndwi"/"ndwi.tif")
-    gdal.Translate(merged_ndwi_path, str(temp_dir/"ndwi.vrt"), format="GTiff")
-    
+        logger.info(f"NDWI computed for {archive} ({k+1}/{len(archives)}).")
+
+    vrt_path = temp_dir/"ndwi.vrt"
+    gdal.BuildVRT(str(vrt_path), ndwi_paths)
+    gdal.Translate(str(out_path), str(vrt_path), format="GTiff", creationOptions=["TILED=YES", "COMPRESS=DEFLATE"])
+
     shutil.rmtree(temp_dir)
 
-    return merged_ndwi_path
+    return out_path
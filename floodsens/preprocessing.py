@@ -1,26 +1,36 @@
-import time
+import json
 import shutil
+import uuid
 from pathlib import Path
+import numpy as np
 from osgeo import gdal
 from osgeo import gdalconst
-from floodsens._tile import singleraster_tiling
-from floodsens._dem import flow_accumulation, hand, slope, twi, download_dem
-from floodsens._reproject import reproject_set, reproject_from_raster
-from floodsens.utils import extract
+from floodsens._tile import singleraster_tiling, paired_tiling, storage_dtype
+from floodsens._memmap import write_memmap, tile_names
+from floodsens._dem import flow_routing, twi, download_dem
+from floodsens._reproject import WarpPlan, reproject_set
+from floodsens.utils import extract, cloud_cover
+from floodsens.archive import archive_index
 from floodsens.logger import logger
-from floodsens.constants import EXTRACT_LIST
+from floodsens.profiling import Profiler
+from floodsens.constants import EXTRACT_LIST, LAYER_POLICY, LAYER_KINDS, STACK_KINDS, STACK_DTYPE, STACK_NODATA, STACK_SCALES, INVALID_SCL_CLASSES
+
+GDAL_TYPES = {"uint8": gdal.GDT_Byte, "uint16": gdal.GDT_UInt16, "float32": gdal.GDT_Float32}
+MASK_OPTIONS = ["NBITS=1", "COMPRESS=DEFLATE"]
+VALIDITY_MASK = "validity_mask.tif"
 
 
 def clip_dem(dem_path, target_raster_path, project_dir):
-    reproject_from_raster(dem_path, target_raster_path, -9999, project_dir, xRes=30.0, yRes=30.0)
-    return dem_path
+    plan = WarpPlan.from_raster(target_raster_path, nan_value=-9999, x_res=30.0, y_res=30.0)
+    return plan.apply(dem_path, Path(project_dir)/Path(dem_path).name)
 
 def process_dem(dem_path, out_dir):
+    """Compute slope, flow accumulation, HAND and TWI of the DEM. Flow accumulation and HAND share
+    one hydrological conditioning, slope and TWI are computed in blocks."""
     dem_path = Path(dem_path)
-    slope_path = slope(dem_path, out_dir)
-    fa_path = flow_accumulation(dem_path, out_dir, out_name="FA.tif")
-    hand_path = hand(dem_path, out_dir, out_name="HAND.tif")
-    twi_path = twi(dem_path, fa_path, out_dir, out_name="TWI.tif")
+    fa_path, hand_path = flow_routing(dem_path, out_dir)
+    twi_path = twi(dem_path, fa_path, out_dir, save_slope=True)
+    slope_path = Path(out_dir)/"11_Slope.tif"
 
     paths_list = [dem_path, slope_path, fa_path, hand_path, twi_path]
     return paths_list
@@ -44,109 +54,461 @@ def reproject_resample(*raster_paths, target_raster_path=None, nan_value=-9999,
 
     return reprojected_raster_paths
 
-def stack(out_dir, *input_paths, data_type=None):
-    options = gdal.BuildVRTOptions(separate=True, srcNodata=-9999, VRTNodata=-9999)
-    to_merge = [str(x) for x in input_paths]
+def _lookup(layer_name, table, default):
+    """Value of the first key of table contained in layer_name."""
+    for key, value in table.items():
+        if key in layer_name:
+            return value
+    return default
+
+def layer_kind(raster_path):
+    """Kind of a layer in LAYER_POLICY, derived from its file name."""
+    return _lookup(Path(raster_path).stem, LAYER_KINDS, "reflectance")
+
+def stack_kind(raster_path):
+    """Kind in STACK_KINDS of the stack part holding a layer. Categorical layers are stored exactly
+    with the reflectances."""
+    kind = layer_kind(raster_path)
+    return kind if kind in STACK_KINDS else STACK_KINDS[0]
+
+def stack_part_name(name, kind):
+    """Name of the part of a stack, mosaic or tiles folder holding the layers of kind, see STACK_KINDS."""
+    return name if kind == STACK_KINDS[0] else f"{name}_{kind}"
+
+def stack_options(dtype):
+    """GDAL data type and GeoTIFF creation options for a stack of storage type dtype. float16 is
+    stored as Float32 with NBITS=16, which GDAL writes as half precision."""
+    if dtype == "float16":
+        return gdal.GDT_Float32, ["NBITS=16"]
+    return GDAL_TYPES[dtype], []
+
+def reproject_layers(*raster_paths, target_raster_path):
+    """Reproject layers in place onto the grid of target_raster_path with the data type, resampling
+    and nodata value of their kind in LAYER_POLICY. One warp plan is built per kind."""
+    plans, reprojected_raster_paths = {}, []
+    for raster_path in raster_paths:
+        kind = layer_kind(raster_path)
+        if kind not in plans:
+            dtype, resampling, nodata = LAYER_POLICY[kind]
+            plans[kind] = WarpPlan.from_raster(target_raster_path, nan_value=nodata, output_type=GDAL_TYPES[dtype], resampling=resampling)
+        reprojected_raster_paths.append(str(plans[kind].apply(raster_path)))
+    return reprojected_raster_paths
+
+def validity_mask(s2_zip_path, target_raster_path, out_path, invalid_classes=INVALID_SCL_CLASSES, block_rows=1024):
+    """Validity mask of a Sentinel-2 archive on the grid of target_raster_path, read from the scene
+    classification layer (SCL) inside the archive. Pixels are valid (1) unless their class is in
+    invalid_classes. The mask is written bit-packed (NBITS=1) and compressed.
+
+    Arguments:
+        s2_zip_path {str, Path} -- Path to the Sentinel-2 L2A archive.
+        target_raster_path {str, Path} -- Raster defining the grid of the mask.
+        out_path {str, Path} -- Path of the mask.
+        (optional) invalid_classes {tuple} -- SCL classes masked out.
+        (optional) block_rows {int} -- Number of rows classified at once.
+
+    Returns:
+        out_path {Path} -- or None for archives without scene classification (L1C)."""
+    try:
+        scl_path = archive_index(s2_zip_path).vsizip("SCL", "20m")
+    except ValueError:
+        logger.warning(f"No scene classification in {Path(s2_zip_path).name}. Pixels are not masked.")
+        return None
+
+    out_path = Path(out_path)
+    plan = WarpPlan.from_raster(target_raster_path, nan_value=0)
+    # The stem is the same for every archive, the name has to be unique per call
+    warped_path = f"/vsimem/{out_path.stem}_scl_{uuid.uuid4().hex}.vrt"
+    scl_ds = gdal.Warp(warped_path, scl_path, format="VRT", dstSRS=plan.projection, outputBounds=plan.output_bounds,
+                       xRes=plan.x_res, yRes=plan.y_res, resampleAlg="near", outputType=gdal.GDT_Byte)
+    xsize, ysize = scl_ds.RasterXSize, scl_ds.RasterYSize
+
+    out_ds = gdal.GetDriverByName("GTiff").Create(str(out_path), xsize, ysize, 1, gdal.GDT_Byte, options=MASK_OPTIONS)
+    out_ds.SetProjection(scl_ds.GetProjection())
+    out_ds.SetGeoTransform(scl_ds.GetGeoTransform())
+    out_band, scl_band = out_ds.GetRasterBand(1), scl_ds.GetRasterBand(1)
+    for row in range(0, ysize, block_rows):
+        rows = min(block_rows, ysize - row)
+        block = scl_band.ReadAsArray(0, row, xsize, rows)
+        out_band.WriteArray((~np.isin(block, invalid_classes)).astype(np.uint8), 0, row)
+
+    out_ds = None
+    scl_ds = None
+    gdal.Unlink(warped_path)
+    return out_path
+
+def merge_masks(out_path, *mask_paths):
+    """Combine the validity masks of several archives into one bit-packed mask at out_path. A pixel
+    is valid if it is valid in any archive, like the stacks mosaicked from the masked archives."""
+    out_path = Path(out_path)
+    vrt_path = out_path.with_suffix(".vrt")
+    options = gdal.BuildVRTOptions(srcNodata=0, VRTNodata=0)
+    gdal.BuildVRT(str(vrt_path), [str(x) for x in mask_paths], options=options)
+    gdal.Translate(str(out_path), str(vrt_path), noData="none", creationOptions=MASK_OPTIONS)
+    vrt_path.unlink()
+    return out_path
+
+def stack(out_dir, *input_paths, data_type=None, dtype="float32", block_rows=1024, mask_path=None):
+    """Stack single band rasters on the same grid into one multiband GeoTIFF stored as dtype
+    ("uint16", "float16" or "float32", see STACK_DTYPE). The nodata value of every layer is mapped to
+    STACK_NODATA and, in half precision only, layers in STACK_SCALES are divided by their scale. Band
+    descriptions and scales record layer names and scales, see write_band_info. Pixels invalid in the optional validity mask at mask_path are set to
+    nodata in all bands, so the mosaic falls back to other archives there."""
     if data_type is None: stem = out_dir.stem
     else: stem = data_type
 
-    vrt_path = out_dir/f"{stem}.vrt"
-
     out_path = out_dir/f"{stem}.tif"
-    vrt = gdal.BuildVRT(str(vrt_path), to_merge, options=options)
-    gdal.Translate(str(out_path), vrt)
-
-    if vrt_path.exists(): vrt_path.unlink()
+    nodata = STACK_NODATA[dtype]
+
+    layers = [gdal.Open(str(x)) for x in input_paths]
+    xsize, ysize = layers[0].RasterXSize, layers[0].RasterYSize
+    gdal_type, options = stack_options(dtype)
+    out_ds = gdal.GetDriverByName("GTiff").Create(str(out_path), xsize, ysize, len(layers), gdal_type, options=options)
+    out_ds.SetProjection(layers[0].GetProjection())
+    out_ds.SetGeoTransform(layers[0].GetGeoTransform())
+    mask_band = gdal.Open(str(mask_path)).GetRasterBand(1) if mask_path is not None else None
+
+    for k, (input_path, layer) in enumerate(zip(input_paths, layers)):
+        name = Path(input_path).stem
+        scale = _lookup(name, STACK_SCALES, 1.0) if dtype == "float16" else 1.0
+        in_band, out_band = layer.GetRasterBand(1), out_ds.GetRasterBand(k+1)
+        in_nodata = in_band.GetNoDataValue()
+        out_band.SetDescription(name)
+        out_band.SetScale(scale)
+        out_band.SetNoDataValue(nodata)
+
+        for row in range(0, ysize, block_rows):
+            rows = min(block_rows, ysize - row)
+            block = in_band.ReadAsArray(0, row, xsize, rows).astype(np.float32)
+            if in_nodata is not None:
+                invalid = np.isnan(block) if np.isnan(in_nodata) else block == in_nodata
+            if scale != 1.0:
+                block /= scale
+            if in_nodata is not None:
+                block[invalid] = nodata
+            if mask_band is not None:
+                block[mask_band.ReadAsArray(0, row, xsize, rows) == 0] = nodata
+            out_band.WriteArray(block, 0, row)
+
+    out_ds = None
+    mask_band = None
+    layers = None
 
     return out_path
 
-def merge(out_path, *input_paths):
-    options = gdal.BuildVRTOptions(separate=False, srcNodata=-9999, VRTNodata=-9999) # TODO Avoid hardcoding
-    x = [str(x) for x in input_paths]
-    var = gdal.BuildVRT("combo.vrt", x, options=options)
-    var = None
-
-    gdal.Translate(str(out_path), 'combo.vrt')
-    Path('combo.vrt').unlink()
+def write_band_info(stack_paths, tile_dirs):
+    """Write the parts of a stack and the name, scale and nodata value of every band next to the
+    first tiles folder (<tile_dirs[0]>.json). stack_paths and tile_dirs list the parts in band order,
+    their tiles share names. Inference concatenates the parts and multiplies each band by its scale."""
+    parts, bands = [], []
+    for stack_path, tile_dir in zip(stack_paths, tile_dirs):
+        ds = gdal.Open(str(stack_path))
+        dtype = storage_dtype(ds.GetRasterBand(1))
+        parts.append({"name": Path(tile_dir).name, "dtype": dtype, "nodata": STACK_NODATA[dtype]})
+        for k in range(ds.RasterCount):
+            band = ds.GetRasterBand(k+1)
+            bands.append({"name": band.GetDescription(), "scale": band.GetScale() or 1.0, "nodata": STACK_NODATA[dtype]})
+        ds = None
+
+    info_path = Path(tile_dirs[0]).with_suffix(".json")
+    with open(info_path, "w") as ostream:
+        json.dump({"parts": parts, "bands": bands}, ostream, indent=2)
+    return info_path
+
+def merge(out_path, *input_paths, nodata=-9999, creation_options=None):
+    """Merge rasters into a single GeoTIFF at out_path. Prefer mosaic, which avoids writing the
+    full mosaic again."""
+    out_path = Path(out_path)
+    vrt_path = mosaic(out_path.with_suffix(".vrt"), *input_paths, nodata=nodata)
+    gdal.Translate(str(out_path), str(vrt_path), creationOptions=creation_options if creation_options is not None else [])
+    vrt_path.unlink()
 
     return out_path
 
+def _derived_band_xml(band, data_type, nodata, part_names, pixel_function):
+    sources = "".join(f'<SimpleSource><SourceFilename relativeToVRT="1">{name}</SourceFilename>'
+                      f'<SourceBand>{band}</SourceBand></SimpleSource>' for name in part_names)
+    return (f'<VRTRasterBand dataType="{data_type}" band="{band}" subClass="VRTDerivedRasterBand">'
+            f'<NoDataValue>{nodata}</NoDataValue><PixelFunctionType>{pixel_function}</PixelFunctionType>'
+            f'{sources}</VRTRasterBand>')
+
+def mosaic(vrt_path, *input_paths, nodata=-9999, overlap="first-valid", archives=None):
+    """Mosaic rasters with identical bands into a VRT at vrt_path, read by tiling without writing
+    the mosaic. Where inputs overlap, overlap decides which value is used:
+        "first-valid" -- the first input with valid data.
+        "least-cloudy" -- the input whose archive has the lowest cloud coverage, requires archives.
+        "max" -- the per band maximum of all valid inputs (GDAL >= 3.8 pixel function).
+
+    Arguments:
+        vrt_path {str, Path} -- Path of the VRT, usually in the event folder.
+        input_paths {str, Path} -- Rasters to mosaic.
+        (optional) nodata {int, float} -- Nodata value of the inputs and the mosaic.
+        (optional) overlap {str} -- Overlap resolution, see above.
+        (optional) archives {list} -- Sentinel-2 archives of the inputs, in the same order.
+
+    Returns:
+        vrt_path {Path} -- Path to the VRT."""
+    vrt_path = Path(vrt_path)
+    input_paths = [Path(x) for x in input_paths]
+
+    if overlap == "least-cloudy":
+        if archives is None or len(archives) != len(input_paths):
+            raise ValueError("Overlap mode 'least-cloudy' requires the archive of every input.")
+        covers = [cloud_cover(x) for x in archives]
+        covers = [100.0 if x is None else x for x in covers]
+        input_paths = [x for _, x in sorted(zip(covers, input_paths), key=lambda pair: pair[0])]
+    elif overlap not in ("first-valid", "max"):
+        raise ValueError(f"Unknown overlap mode {overlap}. Choose from first-valid, least-cloudy or max.")
+
+    # Later sources of a VRT are painted over earlier ones, so the preferred input comes last
+    to_merge = [str(x) for x in reversed(input_paths)]
+    options = gdal.BuildVRTOptions(separate=False, srcNodata=nodata, VRTNodata=nodata)
+    vrt = gdal.BuildVRT(str(vrt_path), to_merge, options=options)
+
+    if overlap == "max" and len(input_paths) > 1:
+        gt, xsize, ysize = vrt.GetGeoTransform(), vrt.RasterXSize, vrt.RasterYSize
+        bounds = (gt[0], gt[3] + ysize*gt[5], gt[0] + xsize*gt[1], gt[3])
+        projection, bands = vrt.GetProjection(), vrt.RasterCount
+        data_type = gdal.GetDataTypeName(vrt.GetRasterBand(1).DataType)
+        vrt = None
+
+        # Every input is padded to the full extent, then combined pixel by pixel
+        part_names = []
+        for k, input_path in enumerate(input_paths):
+            part_path = vrt_path.with_name(f"{vrt_path.stem}_part{k}.vrt")
+            part_options = gdal.BuildVRTOptions(outputBounds=bounds, xRes=gt[1], yRes=abs(gt[5]), srcNodata=nodata, VRTNodata=nodata)
+            gdal.BuildVRT(str(part_path), [str(input_path)], options=part_options)
+            part_names.append(part_path.name)
+
+        band_xml = "".join(_derived_band_xml(band+1, data_type, nodata, part_names, "max") for band in range(bands))
+        with open(vrt_path, "w") as ostream:
+            ostream.write(f'<VRTDataset rasterXSize="{xsize}" rasterYSize="{ysize}">'
+                          f'<SRS>{projection}</SRS><GeoTransform>{", ".join(repr(x) for x in gt)}</GeoTransform>'
+                          f'{band_xml}</VRTDataset>')
+        vrt = gdal.Open(str(vrt_path), gdal.GA_Update)
+
+    # Tiles are written like the inputs, e.g. in half precision
+    first = gdal.Open(str(input_paths[0]))
+    nbits = first.GetRasterBand(1).GetMetadataItem("NBITS", "IMAGE_STRUCTURE")
+    for band in range(vrt.RasterCount):
+        source_band = first.GetRasterBand(band+1)
+        vrt.GetRasterBand(band+1).SetDescription(source_band.GetDescription())
+        vrt.GetRasterBand(band+1).SetScale(source_band.GetScale() or 1.0)
+        if nbits is not None:
+            vrt.GetRasterBand(band+1).SetMetadataItem("NBITS", nbits, "IMAGE_STRUCTURE")
+    first = None
+    vrt = None
+
+    return vrt_path
+
+def remove_mosaic(vrt_path):
+    """Remove a mosaic VRT and the part VRTs of the "max" overlap mode. The inputs are kept."""
+    vrt_path = Path(vrt_path)
+    for part_path in vrt_path.parent.glob(f"{vrt_path.stem}_part*.vrt"):
+        part_path.unlink()
+    vrt_path.unlink(missing_ok=True)
+
 def tile(*raster_paths, tile_size=244, data_type="stacked"):
     tile_dir = singleraster_tiling(tile_size, *raster_paths, data_type=data_type)
     return tile_dir
 
-def run_default_preprocessing(project_dir, s2_zip_paths, extract_list=None, delete_all=True):
-    Mtic, mtic = time.time(), time.time()
+def preprocess_archive(s2_zip_path, step_folder, extract_list=EXTRACT_LIST, profiler=None, dem_dir=None, delete_all=True, step=0, num_steps=7,
+                       derivative_cache=None, cloud_mask=True):
+    """Extract, convert, add DEM derivatives, reproject and stack a single Sentinel-2 archive.
+    Returns the paths to the parts of the stack, one per kind in STACK_KINDS. The validity mask, if
+    any, is written next to them as "validity.tif". If delete_all is True all other files in step_folder are removed afterwards.
+
+    Arguments:
+        s2_zip_path {Path} -- Path to the Sentinel-2 archive.
+        step_folder {Path} -- Folder for the intermediate products of this archive.
+        (optional) extract_list {tuple} -- (band, resolution) pairs to extract.
+        (optional) profiler {Profiler} -- Profiler recording the stages.
+        (optional) dem_dir {str, Path} -- Local DEM directory used instead of the download.
+        (optional) delete_all {bool} -- Remove intermediate products except the stack.
+        (optional) step, num_steps {int} -- Step counters used in the log messages.
+        (optional) derivative_cache {DerivativeCache} -- If given, DEM derivatives are cropped from the
+            cache when it covers the DEM grid of the archive and stored in it otherwise.
+        (optional) cloud_mask {bool} -- Mask clouds, cloud shadows and nodata using the scene
+            classification of the archive. Masked pixels are nodata in the stack."""
+    if profiler is None:
+        profiler = Profiler(step_folder.name)
+    step_folder.mkdir(parents=True, exist_ok=True)
+
+    with profiler.stage("extract") as stage:
+        step_s2_list = extract(s2_zip_path, step_folder, extract_list)
+    logger.info(f"Sentinel bands extracted \t({step+1}/{num_steps} - {stage.wall:.2f}s|{profiler.elapsed:.2f}s)")
+
+    with profiler.stage("convert") as stage:
+        step_s2_list = convert_to_tif(step_s2_list, step_folder)
+    step_target_raster_path = step_s2_list[0]
+    logger.info(f"Sentinel images converted \t({step+2}/{num_steps} - {stage.wall:.2f}s|{profiler.elapsed:.2f}s)")
+
+    dem_grid, cache_key, step_dem_list = None, None, None
+    if derivative_cache is not None:
+        dem_plan = WarpPlan.from_raster(step_target_raster_path, x_res=30.0, y_res=30.0)
+        dem_source = Path(dem_dir).resolve() if dem_dir is not None else "copernicus"
+        dem_grid = (dem_source, dem_plan.projection, dem_plan.output_bounds, dem_plan.x_res, dem_plan.y_res)
+        cache_key = derivative_cache.lookup(*dem_grid)
+
+    if cache_key is not None:
+        # None if another worker evicted the entry since the lookup
+        with profiler.stage("dem_derivatives") as stage:
+            step_dem_list = derivative_cache.crop(cache_key, dem_grid[2], step_folder)
+        if step_dem_list is not None:
+            logger.info(f"DEM derivatives from cache \t({step+5}/{num_steps} - {stage.wall:.2f}s|{profiler.elapsed:.2f}s)")
+    if step_dem_list is None:
+        with profiler.stage("dem_download") as stage:
+            step_dem_path = download_dem(step_target_raster_path, step_folder, dem_dir=dem_dir)
+        logger.info(f"DEM downloaded \t\t\t({step+3}/{num_steps} - {stage.wall:.2f}s|{profiler.elapsed:.2f}s)")
+
+        with profiler.stage("dem_clip") as stage:
+            step_dem_path = clip_dem(step_dem_path, step_target_raster_path, step_folder)
+        logger.info(f"DEM clipped \t\t\t({step+4}/{num_steps} - {stage.wall:.2f}s|{profiler.elapsed:.2f}s)")
+
+        with profiler.stage("dem_derivatives") as stage:
+            step_dem_list = process_dem(step_dem_path, step_folder)
+            if derivative_cache is not None:
+                derivative_cache.store(*dem_grid, *step_dem_list)
+        logger.info(f"DEM processed \t\t\t({step+5}/{num_steps} - {stage.wall:.2f}s|{profiler.elapsed:.2f}s)")
+
+    with profiler.stage("reprojection") as stage:
+        step_dem_list = reproject_layers(*step_dem_list, target_raster_path=step_target_raster_path)
+        step_s2_list = reproject_layers(*step_s2_list, target_raster_path=step_target_raster_path)
+    logger.info(f"Reprojections completed \t({step+6}/{num_steps} - {stage.wall:.2f}s|{profiler.elapsed:.2f}s)")
+
+    with profiler.stage("stacking") as stage:
+        step_mask_path = validity_mask(s2_zip_path, step_target_raster_path, step_folder/"validity.tif") if cloud_mask else None
+        step_all_paths = step_s2_list + step_dem_list
+        step_stacked_paths = []
+        for kind in STACK_KINDS:
+            kind_paths = [x for x in step_all_paths if stack_kind(x) == kind]
+            step_stacked_paths.append(stack(step_folder, *kind_paths, data_type=stack_part_name(step_folder.stem, kind),
+                                            dtype=STACK_DTYPE[kind], mask_path=step_mask_path))
+    logger.info(f"All bands stacked \t\t({step+7}/{num_steps} - {stage.wall:.2f}s|{profiler.elapsed:.2f}s)")
+
+    if delete_all:
+        for intermediate in step_folder.iterdir():
+            if intermediate in (*step_stacked_paths, step_mask_path):
+                continue
+            if intermediate.is_dir():
+                shutil.rmtree(intermediate)
+            else:
+                intermediate.unlink()
+
+    return step_stacked_paths
+
+def run_default_preprocessing(project_dir, s2_zip_paths, extract_list=None, delete_all=True, label_path=None, profiler=None, dem_dir=None, cache=None, tile_size=244,
+                              overlap="first-valid", derivative_cache=None, cloud_mask=True, min_valid_fraction=0.0, memmap=False):
+    """Preprocess Sentinel-2 archives into tiles ready for inference. The stacks of all archives are
+    mosaicked through one VRT per part (see STACK_KINDS) in project_dir and tiled directly from it.
+    The tiles of the parts are written to tiles/stacked and tiles/stacked_<kind> with the same names,
+    tiles/stacked.json lists the parts and bands. With cloud_mask, the validity masks of all archives
+    are combined into project_dir/validity_mask.tif and tiles without enough valid pixels are not
+    written, so they are never inferred.
+
+    Arguments:
+        project_dir {str, Path} -- Folder for intermediate products and tiles.
+        s2_zip_paths {list} -- Paths to the Sentinel-2 archives.
+        (optional) extract_list {tuple} -- (band, resolution) pairs to extract.
+        (optional) delete_all {bool} -- Remove intermediate products once the tiles are written.
+        (optional) label_path {str, Path} -- Binary label raster tiled alongside the stack.
+        (optional) profiler {Profiler} -- Profiler recording the stages.
+        (optional) dem_dir {str, Path} -- Local DEM directory used instead of the download.
+        (optional) cache {StageCache} -- If given, per-archive stacks are kept and reused on reruns
+            as long as the archive and parameters are unchanged.
+        (optional) tile_size {int} -- Size of the square tiles in pixels.
+        (optional) overlap {str} -- Where archives overlap: "first-valid", "least-cloudy" or "max", see mosaic.
+        (optional) derivative_cache {DerivativeCache} -- Cache of DEM derivatives shared between events.
+        (optional) cloud_mask {bool} -- Mask clouds, cloud shadows and nodata from the scene classification.
+        (optional) min_valid_fraction {float} -- Tiles with at most this fraction of valid pixels are skipped.
+        (optional) memmap {bool} -- Write the mosaic once as a band-interleaved-by-pixel memmap
+            (project_dir/tiles/stacked.bip and one file per further part) instead of tile GeoTIFFs. Inference reads the tiles as
+            views of it. Not available with label_path.
+
+    Returns:
+        tile_dir {Path} -- or (tile_dir, label_tile_dir) if label_path is given. With memmap, the path
+            of the memmap sidecar (project_dir/tiles/stacked.json), accepted wherever a tiles folder is."""
+    if memmap and label_path is not None:
+        raise ValueError("Labels are only tiled into GeoTIFFs. Set memmap=False to tile a label.")
     num_images, num_steps = len(s2_zip_paths), 7*len(s2_zip_paths)+2
     project_dir = Path(project_dir)
+    if profiler is None:
+        profiler = Profiler(project_dir.name)
 
-    logger.info(f"Not Started \t\t\t(0/{num_steps} - {time.time()-mtic:.2f}s|{time.time()-Mtic:.2f}s)")
+    logger.info(f"Not Started \t\t\t(0/{num_steps} - 0.00s|{profiler.elapsed:.2f}s)")
     if extract_list is None:
         extract_list = EXTRACT_LIST
 
-    s2_list, dem_list, extract_folder_list, stacked_inference_paths = [], [], [], []
+    extract_folder_list, stacked_inference_paths = [], []
 
     for k, s2_zip_path in enumerate(s2_zip_paths):
+        s2_zip_path = Path(s2_zip_path)
         step_folder = project_dir/s2_zip_path.stem
-        step_folder.mkdir(parents=True, exist_ok=True)
         extract_folder_list.append(step_folder)
 
-        step_s2_list = extract(s2_zip_path, step_folder, extract_list)
-        logger.info(f"Sentinel bands extracted \t({7*k+1}/{num_steps} - {time.time()-mtic:.2f}s|{time.time()-Mtic:.2f}s)")
-        mtic=time.time()
-
-        step_s2_list = convert_to_tif(step_s2_list, step_folder)
-        s2_list.extend(step_s2_list)
-        step_target_raster_path = step_s2_list[0]
-        logger.info(f"Sentinel images converted \t({7*k+2}/{num_steps} - {time.time()-mtic:.2f}s|{time.time()-Mtic:.2f}s)")
-        mtic=time.time()
-
-        step_dem_path = download_dem(step_target_raster_path, step_folder)
-        logger.info(f"DEM downloaded \t\t\t({7*k+3}/{num_steps} - {time.time()-mtic:.2f}s|{time.time()-Mtic:.2f}s)")
-        mtic=time.time()
-
-        step_dem_path = clip_dem(step_dem_path, step_target_raster_path, step_folder)
-        logger.info(f"DEM clipped \t\t\t({7*k+4}/{num_steps} - {time.time()-mtic:.2f}s|{time.time()-Mtic:.2f}s)")
-        mtic=time.time()
-
-        step_dem_list = process_dem(step_dem_path, step_folder)
-        logger.info(f"DEM processed \t\t\t({7*k+5}/{num_steps} - {time.time()-mtic:.2f}s|{time.time()-Mtic:.2f}s)")
-        mtic=time.time()
-
-        step_dem_list = reproject_resample(*step_dem_list, target_raster_path=step_target_raster_path)
-        step_s2_list = reproject_resample(*step_s2_list, target_raster_path=step_target_raster_path)
-        logger.info(f"Reprojections completed \t({7*k+6}/{num_steps} - {time.time()-mtic:.2f}s|{time.time()-Mtic:.2f}s)")
-        mtic=time.time()
-
-        step_all_paths = step_s2_list + step_dem_list
-        step_stacked_path = stack(step_folder, *step_all_paths)
-        stacked_inference_paths.append(step_stacked_path)
-        stacked_paths = stacked_inference_paths
-        logger.info(f"All bands stacked \t\t({7*k+7}/{num_steps} - {time.time()-mtic:.2f}s|{time.time()-Mtic:.2f}s)")
-        mtic=time.time()
-
-    merged_path = merge(project_dir/f"{project_dir.name}.tif", *stacked_inference_paths)
-    logger.info(f"Stacked Paths merged \t\t({7*num_images+1}/{num_steps} - {time.time()-mtic:.2f}s|{time.time()-Mtic:.2f}s)")
-    mtic=time.time()
-
-    tile_dir = singleraster_tiling(244, merged_path, data_type="stacked")
-    logger.info(f"Tiles ready for inference \t({7*num_images+2}/{num_steps} - {time.time()-mtic:.2f}s|{time.time()-Mtic:.2f}s)")
+        if cache is not None:
+            stage_name = f"stack_{s2_zip_path.stem}"
+            stage_key = cache.key(s2_zip_path, extract_list=extract_list, dem_dir=dem_dir, stack_kinds=STACK_KINDS,
+                                  stack_dtype=STACK_DTYPE, cloud_mask=INVALID_SCL_CLASSES if cloud_mask else None)
+            if cache.is_valid(stage_name, stage_key):
+                stacked_inference_paths.append(cache.artifacts(stage_name)[:len(STACK_KINDS)])
+                logger.info(f"Stack of {s2_zip_path.name} is up to date \t({7*k+7}/{num_steps} - 0.00s|{profiler.elapsed:.2f}s)")
+                continue
+
+        step_stacked_paths = preprocess_archive(s2_zip_path, step_folder, extract_list, profiler=profiler, dem_dir=dem_dir,
+                                                delete_all=delete_all, step=7*k, num_steps=num_steps, derivative_cache=derivative_cache,
+                                                cloud_mask=cloud_mask)
+        stacked_inference_paths.append(step_stacked_paths)
+        if cache is not None:
+            step_mask_path = step_folder/"validity.tif"
+            cache.store(stage_name, stage_key, *step_stacked_paths, *([step_mask_path] if step_mask_path.exists() else []))
+
+    with profiler.stage("merge") as stage:
+        merged_paths = [mosaic(project_dir/f"{stack_part_name(project_dir.name, kind)}.vrt", *[x[k] for x in stacked_inference_paths],
+                               nodata=STACK_NODATA[STACK_DTYPE[kind]], overlap=overlap, archives=[Path(x) for x in s2_zip_paths])
+                        for k, kind in enumerate(STACK_KINDS)]
+
+        mask_path = project_dir/VALIDITY_MASK
+        mask_path.unlink(missing_ok=True)
+        step_mask_paths = [Path(x[0]).parent/"validity.tif" for x in stacked_inference_paths]
+        if cloud_mask and all(x.exists() for x in step_mask_paths):
+            merge_masks(mask_path, *step_mask_paths)
+        else:
+            mask_path = None
+    logger.info(f"Stacked Paths mosaicked \t\t({7*num_images+1}/{num_steps} - {stage.wall:.2f}s|{profiler.elapsed:.2f}s)")
+
+    with profiler.stage("tiling") as stage:
+        if memmap:
+            # The sidecar records the band information, write_band_info is not needed
+            tile_dir = write_memmap(merged_paths, project_dir/"tiles", tile_size, data_type="stacked", mask_path=mask_path,
+                                    min_valid_fraction=min_valid_fraction)
+        else:
+            part_names = [stack_part_name("stacked", kind) for kind in STACK_KINDS]
+            if label_path is None:
+                tile_dirs = [singleraster_tiling(tile_size, merged_paths[0], data_type=part_names[0], mask_path=mask_path,
+                                                 min_valid_fraction=min_valid_fraction)]
+            else:
+                tile_dir, label_tile_dir = paired_tiling(tile_size, merged_paths[0], label_path, data_type=part_names[0], label_type="label",
+                                                         mask_path=mask_path, min_valid_fraction=min_valid_fraction)
+                tile_dirs = [tile_dir]
+            # The other parts are tiled on the same windows, so their tiles carry the same names
+            tile_dirs += [singleraster_tiling(tile_size, merged_path, data_type=part_name, mask_path=mask_path,
+                                              min_valid_fraction=min_valid_fraction)
+                          for merged_path, part_name in zip(merged_paths[1:], part_names[1:])]
+            write_band_info(stacked_inference_paths[0], tile_dirs)
+            tile_dir = tile_dirs[0]
+        stage.tiles = len(tile_names(tile_dir))
+    logger.info(f"Tiles ready for inference \t({7*num_images+2}/{num_steps} - {stage.wall:.2f}s|{profiler.elapsed:.2f}s)")
 
     if delete_all:
-        for s2_path in s2_list:
-            Path(s2_path).unlink()
-
-        for dem_path in dem_list:
-            Path(dem_path).unlink()
-
-        for stacked_path in stacked_paths:
-            Path(stacked_path).unlink()
-
-        Path(merged_path).unlink()
+        for merged_path in merged_paths:
+            remove_mosaic(merged_path)
 
-        for extract_folder in extract_folder_list:
-            shutil.rmtree(extract_folder)
+        if cache is None:
+            for extract_folder in extract_folder_list:
+                shutil.rmtree(extract_folder)
 
         logger.info("Unnecessary project files removed.")
 
+    if label_path is not None:
+        return tile_dir, label_tile_dir
     return tile_dir
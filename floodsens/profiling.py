@@ -0,0 +1,160 @@
+"""Per-stage instrumentation of the processing pipeline. A Profiler records wall time, CPU time,
+resident memory, bytes read/written and tile counts for every stage it wraps and can dump
+the records as JSON for each event run."""
+import os
+import sys
+import json
+import time
+import datetime
+from pathlib import Path
+from contextlib import contextmanager
+from floodsens.logger import logger
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+try:
+    from importlib import metadata
+except ImportError:
+    metadata = None
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of the process since it started in MB or None if unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+def rss_mb():
+    """Return the current resident set size of the process in MB or None if unavailable."""
+    try:
+        with open("/proc/self/statm", "r") as istream:
+            resident = int(istream.read().split()[1])
+        return resident * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except (OSError, IndexError, ValueError, AttributeError):
+        return None
+
+def io_bytes():
+    """Return (bytes read, bytes written) by the process from storage or (None, None) if unavailable."""
+    try:
+        with open("/proc/self/io", "r") as istream:
+            counters = dict(line.split(": ") for line in istream.read().splitlines())
+        return int(counters["read_bytes"]), int(counters["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def _version():
+    try:
+        return metadata.version("floodsens")
+    except Exception:
+        return None
+
+
+class StageRecord():
+    """Measurements of a single pipeline stage. Tile counts are set by the caller."""
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.rss_start_mb = None
+        self.rss_end_mb = None
+        self.rss_delta_mb = None
+        self.peak_rss_process_mb = None
+        self.bytes_read = None
+        self.bytes_written = None
+        self.tiles = None
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class Profiler():
+    """Collects StageRecords for a pipeline run. Use the stage context manager to wrap a step:
+
+        with profiler.stage("extract") as stage:
+            ...
+            stage.tiles = 42
+
+    Arguments:
+        (optional) name {str} -- Name of the run, e.g. the event name."""
+    def __init__(self, name=None):
+        self.name = name
+        self.started = datetime.datetime.now().isoformat(timespec="seconds")
+        self.records = []
+        self._tic = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        """Wall time in seconds since the profiler was created."""
+        return time.perf_counter() - self._tic
+
+    @contextmanager
+    def stage(self, name):
+        """Measure the wrapped block and append its StageRecord to the records.
+
+        Memory is reported in two ways, neither of which is the peak of the stage itself:
+        rss_delta_mb is the change of the current resident set size between the start and the end
+        of the stage, so memory allocated and released within the stage does not show up, and
+        peak_rss_process_mb is the peak of the whole process so far (ru_maxrss), so every stage
+        after the largest one reports the peak of that stage.
+        bytes_read and bytes_written count storage I/O from /proc/self/io (Linux only). Reads
+        served from the page cache are not counted, so warm runs report few or no bytes read."""
+        record = StageRecord(name)
+        record.rss_start_mb = rss_mb()
+        read_0, written_0 = io_bytes()
+        wall_0, cpu_0 = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall = time.perf_counter() - wall_0
+            record.cpu = time.process_time() - cpu_0
+            record.rss_end_mb = rss_mb()
+            if record.rss_start_mb is not None and record.rss_end_mb is not None:
+                record.rss_delta_mb = record.rss_end_mb - record.rss_start_mb
+            record.peak_rss_process_mb = peak_rss_mb()
+            read_1, written_1 = io_bytes()
+            if read_0 is not None and read_1 is not None:
+                record.bytes_read = read_1 - read_0
+                record.bytes_written = written_1 - written_0
+            self.records.append(record)
+            logger.debug(f"Stage {name} finished in {record.wall:.2f}s (CPU {record.cpu:.2f}s)")
+
+    def summary(self):
+        """Aggregate records per stage name, since stages such as extract run once per archive.
+        Memory entries are the largest value over the calls."""
+        summary = {}
+        for record in self.records:
+            entry = summary.setdefault(record.name, {"calls": 0, "wall": 0.0, "cpu": 0.0, "bytes_read": 0, "bytes_written": 0, "tiles": 0,
+                                                     "rss_delta_mb": None, "peak_rss_process_mb": None})
+            entry["calls"] += 1
+            entry["wall"] += record.wall
+            entry["cpu"] += record.cpu
+            entry["bytes_read"] += record.bytes_read or 0
+            entry["bytes_written"] += record.bytes_written or 0
+            entry["tiles"] += record.tiles or 0
+            for key in ("rss_delta_mb", "peak_rss_process_mb"):
+                value = getattr(record, key)
+                if value is not None:
+                    entry[key] = value if entry[key] is None else max(entry[key], value)
+        return summary
+
+    def to_dict(self):
+        return {"name": self.name,
+                "floodsens_version": _version(),
+                "started": self.started,
+                "total_wall": self.elapsed,
+                "peak_rss_process_mb": peak_rss_mb(),
+                "stages": [record.to_dict() for record in self.records],
+                "summary": self.summary()}
+
+    def to_json(self, out_path):
+        """Write all records to out_path as JSON and return the path."""
+        out_path = Path(out_path)
+        with open(out_path, "w") as ostream:
+            json.dump(self.to_dict(), ostream, indent=2)
+        logger.info(f"Profile written to {out_path}.")
+        return out_path
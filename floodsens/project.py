@@ -4,6 +4,8 @@ import yaml
 from floodsens.logger import logger
 from floodsens.model import FloodsensModel
 from floodsens.event import Event
+from floodsens.scheduler import run_events
+from floodsens.state import StateStore, read_yaml_checkpoint
 
 class Project():
     """Project class to manage multiple models and events.
@@ -15,15 +17,23 @@ class Project():
         project_folder {str, Path} -- Path to the project folder.
         (optional) models {dict, list, FloodsensModel} -- Dictionary of FloodsensModel, list of FloodsensModel, or single FloodsensModel.
         (optional) event_collection {dict, list, Event} -- Dictionary of events, list of events, or single event.
-        (optional) event {Event} -- Event to be activated.
+        (optional) event {Event, str} -- Event (or its name) to be activated.
+
+    Models and events are kept in an SQLite state store ("project_state.sqlite") in the project folder,
+    updated incrementally by the methods below. Constructing a Project on an existing project folder
+    restores the models and events from the store unless they are passed explicitly.
 
     Methods:
         choose_event / activate_event -- Activate an event. Required to access the processing methods.
         save_to_yaml -- Save the project checkpoint to a yaml file.
-        load_from_yaml -- Load a project from a yaml checkpoint file.
+        from_yaml -- Load a project from a yaml checkpoint file.
+        save_state -- Write modified events to the project state store.
         load_models -- Load all models from a folder and its subfolders.
         load_event -- Load existing event from yaml checkpoint file.
         add_event -- Add a new event to the project.
+        run_ndwi -- Compute the NDWI baseline for several or all events.
+        run_all -- Run FloodSENS on several or all events with worker pools, without user interaction.
+        compare_models -- Run several models on the activated event in one pass.
         """
     def __init__(self, project_folder, models=None, event_collection=None, event=None):
         self.project_folder = Path(project_folder)
@@ -31,9 +41,14 @@ class Project():
         if not self.project_folder.exists():
             self.project_folder.mkdir(parents=True)
 
+        self._state = StateStore(self.project_folder/"project_state.sqlite")
+        store_models = models is not None
+        store_events = event_collection is not None
+
         if models is None:
-            self.models = {}
-        elif isinstance(models, dict):
+            models = self._state.models()
+
+        if isinstance(models, dict):
             self.models = models
         elif isinstance(models, list):
             self.models = {model.name: model for model in models}
@@ -41,10 +56,12 @@ class Project():
             self.models = {models.name: models}
         else:
             raise ValueError(f"models must be of type dict, list, or FloodsensModel. Got {type(models)} instead.")
+        self.models = {name: FloodsensModel(**model) if isinstance(model, dict) else model for name, model in self.models.items()}
 
         if event_collection is None:
-            self.event_collection = {}
-        elif isinstance(event_collection, dict):
+            event_collection = self._state.events()
+
+        if isinstance(event_collection, dict):
             self.event_collection = event_collection
         elif isinstance(event_collection, list):
             self.event_collection = {event.name: event for event in event_collection}
@@ -52,11 +69,24 @@ class Project():
             self.event_collection = {event_collection.name: event_collection}
         else:
             raise ValueError(f"event_collection must be of type dict, list, or Event. Got {type(event_collection)} instead.")
-
+        self.event_collection = {name: Event.from_dict(event, self.models) if isinstance(event, dict) else event for name, event in self.event_collection.items()}
+
+        if store_models:
+            for model in self.models.values():
+                self._state.put_model(model)
+        if store_events:
+            for event_instance in self.event_collection.values():
+                self._state.put_event(event_instance)
+
+        if event is None:
+            event = self._state.get_value("active_event")
+        if isinstance(event, dict):
+            event = event["name"]
+        if isinstance(event, str):
+            event = self.event_collection.get(event)
         if event is not None:
             self.event = event
-
-        self.save_to_yaml()
+            self._state.set_value("active_event", event.name)
 
     def __repr__(self) -> str:
         return f'{self.__class__.__name__}({self.project_folder}, {self.event_collection}, {self.models})'
@@ -86,22 +116,47 @@ class Project():
 
     @classmethod
     def from_yaml(cls, filename):
-        """Load a Project object from a yaml file.
+        """Load a Project object from a yaml file. The models and events are also written to the
+        project state store.
 
         Arguments:
             filename {str, Path} -- Path to the yaml file."""
-        with open(filename, "r") as istream:
-            data = yaml.load(istream, Loader=yaml.Loader)
-
+        data = read_yaml_checkpoint(filename)
         return cls(**data)
 
-    def save_to_yaml(self, overwrite=False):
+    def to_dict(self):
+        """Plain representation with the constructor arguments, safe to store as YAML or JSON."""
+        event = getattr(self, "event", None)
+        return {"project_folder": str(self.project_folder),
+                "models": {name: model.to_dict() for name, model in self.models.items()},
+                "event_collection": {name: event.to_dict() for name, event in self.event_collection.items()},
+                "event": event.name if event is not None else None}
+
+    def save_state(self, event_names=None):
+        """Write events to the project state store. Only needed after modifying events directly,
+        e.g. after project.event.run_floodsens(); Project methods update the store themselves.
+
+        Arguments:
+            (optional) event_names {list} -- Names of the events to write. Defaults to all events."""
+        if event_names is None:
+            event_names = list(self.event_collection.keys())
+        for event_name in event_names:
+            self._state.put_event(self.event_collection[event_name])
+
+    def save_to_yaml(self, overwrite=False, interactive=True):
         """Save the Project object to a yaml file. Can be loaded with the from_yaml method.
+        The project state store is updated as well.
 
         Arguments:
             overwrite {bool} -- Overwrite existing project folder.
+            interactive {bool} -- Ask before overwriting. If False, an existing file is only overwritten with overwrite=True.
         """
+        self.save_state()
+
         filename = self.project_folder/"project_checkpoint.yaml"
+        if not overwrite and filename.exists() and not interactive:
+            logger.info(f"\"{filename}\" already exists and was not overwritten.")
+            return
         if not overwrite and filename.exists():
             logger.warning(f"\"{filename.parent}\" project folder already exists. Load the project from this file or start new project in separate folder.")
             interrupt = input("Do you want to overwrite the existing project? (y/n): ")
@@ -111,10 +166,8 @@ class Project():
                 logger.info("Existing without overwriting.")
                 return
 
-        project_data = self.__dict__
-
         with open(filename, "w") as ostream:
-            yaml.dump(project_data, ostream)
+            yaml.safe_dump(self.to_dict(), ostream)
 
     def activate_event(self, event_name):
         """Activate an event from the event_collection that matches the event_name.
@@ -122,6 +175,7 @@ class Project():
         Arguments:
             event_name {str} -- Name of the event to be activated."""
         self.event = self.event_collection[event_name]
+        self._state.set_value("active_event", event_name)
         logger.info(f"Event {self.event.name} activated.")
 
     def choose_event(self):
@@ -145,6 +199,8 @@ class Project():
             loaded_models[model.name] = model
 
         self.models = loaded_models
+        for model in self.models.values():
+            self._state.put_model(model)
         logger.info(f"{len(self.models)} models loaded.")
 
         for model in self.models.values():
@@ -161,18 +217,25 @@ class Project():
             yaml_path {str, Path} -- Path to the yaml file containing the event."""
         event = Event.from_yaml(yaml_path)
         self.event_collection[event.name] = event
+        self._state.put_event(event)
         return event
 
-    def add_event(self, event_name, sentinel_archives, model=None):
+    def add_event(self, event_name, sentinel_archives, model=None, interactive=True):
         """Add a new event to the event_collection.
 
         Arguments:
             event_name {str} -- Name of the event.
             sentinel_archives {list} -- List of Sentinel-2 archives.
-            model {FloodsensModel} -- Model to be used for the event. If None, the user will be asked to choose a model."""
+            model {FloodsensModel} -- Model to be used for the event. If None, the user will be asked to choose a model.
+            interactive {bool} -- If False, the only loaded model is used instead of asking."""
         event_folder = self.project_folder/event_name
 
-        if model is None and len(self.models) > 0:
+        if model is None and not interactive:
+            if len(self.models) == 1:
+                model = list(self.models.values())[0]
+            else:
+                logger.warning(f"No model assigned to event {event_name}. {len(self.models)} models loaded.")
+        elif model is None and len(self.models) > 0:
             for i, model_name in enumerate(self.models.keys()):
                 print(f"{i+1}: {model_name}")
             choice = int(input("Choose a model by entering corresponding integer: "))
@@ -183,6 +246,116 @@ class Project():
 
         if len(self.event_collection) == 1:
             self.event = event
+            self._state.set_value("active_event", event.name)
 
+        self._state.put_event(event)
         event.save_to_yaml()
         return event
+
+    def run_ndwi(self, event_names=None, threshold=None, force=False):
+        """Compute the NDWI baseline for events in the event_collection. Events with unchanged inputs
+        are skipped. Failures are logged and do not stop the remaining events.
+
+        Arguments:
+            (optional) event_names {list} -- Names of the events to process. Defaults to all events.
+            (optional) threshold {float} -- If given, binary water masks are computed instead.
+            (optional) force {bool} -- Recompute even if cached results exist.
+
+        Returns:
+            results {dict} -- Event names mapped to the NDWI raster path or None if processing failed."""
+        if event_names is None:
+            event_names = list(self.event_collection.keys())
+
+        results = {}
+        for k, event_name in enumerate(event_names):
+            event = self.event_collection[event_name]
+            try:
+                results[event_name] = event.run_ndwi(threshold=threshold, force=force)
+                self._state.put_event(event)
+            except Exception:
+                logger.exception(f"NDWI failed for event {event_name}.")
+                results[event_name] = None
+            logger.info(f"NDWI processed for {k+1}/{len(event_names)} events.")
+
+        failed = [name for name, path in results.items() if path is None]
+        if failed:
+            logger.warning(f"NDWI failed for {len(failed)} events: {failed}")
+
+        return results
+
+    def compare_models(self, model_names=None, ensemble=True):
+        """Run several of the loaded models on the activated event. Preprocessing and tile reading
+        happen only once for all models.
+
+        Arguments:
+            (optional) model_names {list} -- Names of the models to compare. Defaults to all loaded models.
+            (optional) ensemble {bool} -- Also create the averaged map of all models.
+
+        Returns:
+            model_rasters {dict} -- Model names (and "ensemble") mapped to the output rasters."""
+        if model_names is None:
+            model_names = list(self.models.keys())
+        models = [self.models[name] for name in model_names]
+        model_rasters = self.event.run_models(models, ensemble=ensemble)
+
+        self._state.put_event(self.event)
+        for name, raster in model_rasters.items():
+            self._state.record_artifact(self.event.name, f"map_{name}", raster)
+        return model_rasters
+
+    def run_all(self, event_names=None, model=None, preprocess_workers=2, inference_workers=1, force=False, batch_size=4, output_format="GTiff",
+                vector_format=None, flood_mask=False):
+        """Run FloodSENS on events of the event_collection without user interaction. Preprocessing and
+        inference run in separate process pools and events flow from one to the other as soon as they
+        are ready. Failures are logged and summarised in "run_all_summary.json" in the project folder.
+        Scripts calling this method must guard their entry point with `if __name__ == "__main__":`.
+
+        Arguments:
+            (optional) event_names {list} -- Names of the events to process. Defaults to all events.
+            (optional) model {FloodsensModel} -- Model assigned to events without a model. Defaults to the only
+                loaded model if exactly one is loaded.
+            (optional) preprocess_workers {int} -- Number of events preprocessed concurrently.
+            (optional) inference_workers {int} -- Number of events inferred concurrently.
+            (optional) force {bool} -- Ignore cached stages and run everything again.
+            (optional) batch_size {int} -- Number of tiles per forward pass.
+            (optional) output_format {str} -- GDAL driver of the output rasters, e.g. "GTiff" or "COG".
+            (optional) vector_format {str} -- "gpkg" or "geojson" to also write flood polygons, see Event.run_floodsens.
+            (optional) flood_mask {bool} -- Also write thresholded uint8 flood masks, see Event.run_floodsens.
+
+        Returns:
+            summary {RunSummary} -- Completed events and failures."""
+        if event_names is None:
+            event_names = list(self.event_collection.keys())
+        if model is None and len(self.models) == 1:
+            model = list(self.models.values())[0]
+
+        events, summary_failed = [], {}
+        for event_name in event_names:
+            event = self.event_collection[event_name]
+            if event.model is None:
+                event.model = model
+            if event.model is None:
+                summary_failed[event_name] = ("setup", "No model assigned.")
+                logger.warning(f"Event {event_name} has no model assigned and is skipped.")
+                continue
+            events.append(event)
+
+        summary = run_events(events, preprocess_workers=preprocess_workers, inference_workers=inference_workers, force=force,
+                             inference_options={"batch_size": batch_size, "output_format": output_format,
+                                                "vector_format": vector_format, "flood_mask": flood_mask})
+        summary.failed.update(summary_failed)
+
+        for event_name, event in summary.completed.items():
+            self.event_collection[event_name] = event
+            if getattr(self, "event", None) is not None and self.event.name == event_name:
+                self.event = event
+            self._state.put_event(event)
+            self._state.record_artifact(event_name, "map", event.inferred_raster)
+            if event.flood_polygons is not None:
+                self._state.record_artifact(event_name, "flood_polygons", event.flood_polygons)
+            if event.flood_mask is not None:
+                self._state.record_artifact(event_name, "flood_mask", event.flood_mask)
+
+        summary.to_json(self.project_folder/"run_all_summary.json")
+        self.save_to_yaml(overwrite=True)
+        return summary
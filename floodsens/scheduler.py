@@ -0,0 +1,98 @@
+"""Batch scheduler for running many events unattended. Preprocessing (extraction, DEM download and
+derivatives, reprojection, tiling) and inference run in separate process pools with their own
+concurrency, pipelined so that an event enters inference as soon as its preprocessing is done."""
+import json
+import time
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from floodsens.logger import logger
+
+
+def _preprocess_worker(event, force):
+    event.run_preprocessing(force=force)
+    return event
+
+def _inference_worker(event, inference_options):
+    event.run_floodsens(interactive=False, **inference_options)
+    return event
+
+
+class RunSummary():
+    """Outcome of a batch run.
+
+    Attributes:
+        completed {dict} -- Event names mapped to the finished Event instances.
+        failed {dict} -- Event names mapped to (stage, error message).
+        wall {float} -- Wall time of the batch run in seconds."""
+    def __init__(self):
+        self.completed = {}
+        self.failed = {}
+        self.wall = 0.0
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(completed={len(self.completed)}, failed={len(self.failed)}, wall={self.wall:.1f}s)'
+
+    def to_json(self, out_path):
+        summary = {"completed": {name: str(event.inferred_raster) for name, event in self.completed.items()},
+                   "failed": {name: {"stage": stage, "error": error} for name, (stage, error) in self.failed.items()},
+                   "wall": self.wall}
+        with open(out_path, "w") as ostream:
+            json.dump(summary, ostream, indent=2)
+        return Path(out_path)
+
+
+def run_events(events, preprocess_workers=2, inference_workers=1, force=False, inference_options=None):
+    """Run preprocessing and inference for all events without user interaction. Failures are recorded
+    per event and do not stop the batch. Worker processes are spawned, so scripts calling this function
+    must guard their entry point with `if __name__ == "__main__":`.
+
+    Arguments:
+        events {list} -- Event instances with a model assigned.
+        (optional) preprocess_workers {int} -- Number of events preprocessed concurrently. Mostly I/O
+            (archive extraction, DEM download) and single threaded DEM derivatives.
+        (optional) inference_workers {int} -- Number of events inferred concurrently. Keep low, torch
+            already uses several threads per process.
+        (optional) force {bool} -- Ignore cached stages and run everything again.
+        (optional) inference_options {dict} -- Keyword arguments for Event.run_floodsens, e.g. batch_size.
+
+    Returns:
+        summary {RunSummary} -- Completed events and failures."""
+    tic = time.perf_counter()
+    summary = RunSummary()
+    total = len(events)
+    context = multiprocessing.get_context("spawn")
+    inference_options = inference_options if inference_options is not None else {}
+
+    with ProcessPoolExecutor(preprocess_workers, mp_context=context) as preprocess_pool, \
+         ProcessPoolExecutor(inference_workers, mp_context=context) as inference_pool:
+        preprocess_futures = {preprocess_pool.submit(_preprocess_worker, event, force): event.name for event in events}
+        inference_futures = {}
+
+        for k, future in enumerate(as_completed(preprocess_futures)):
+            name = preprocess_futures[future]
+            try:
+                event = future.result()
+            except Exception as error:
+                summary.failed[name] = ("preprocessing", repr(error))
+                logger.error(f"[{k+1}/{total} preprocessed] {name} failed: {error!r}")
+                continue
+            logger.info(f"[{k+1}/{total} preprocessed] {name}")
+            inference_futures[inference_pool.submit(_inference_worker, event, inference_options)] = name
+
+        for k, future in enumerate(as_completed(inference_futures)):
+            name = inference_futures[future]
+            try:
+                summary.completed[name] = future.result()
+            except Exception as error:
+                summary.failed[name] = ("inference", repr(error))
+                logger.error(f"[{k+1}/{len(inference_futures)} inferred] {name} failed: {error!r}")
+                continue
+            logger.info(f"[{k+1}/{len(inference_futures)} inferred] {name}")
+
+    summary.wall = time.perf_counter() - tic
+    logger.info(f"Batch run finished in {summary.wall:.1f}s: {len(summary.completed)} completed, {len(summary.failed)} failed.")
+    for name, (stage, error) in summary.failed.items():
+        logger.warning(f"\t{name} failed during {stage}: {error}")
+
+    return summary
@@ -0,0 +1,192 @@
+"""Indexed state store for projects. Models, events and run artifacts are kept as rows of a small
+SQLite database in the project folder, so adding or updating one event only writes that event and
+opening a project with hundreds of events does not parse a large YAML file."""
+import json
+import time
+import sqlite3
+from pathlib import Path, PurePath
+import yaml
+from floodsens.logger import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    name TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    name TEXT PRIMARY KEY,
+    event_folder TEXT NOT NULL,
+    model TEXT,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    event TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    path TEXT NOT NULL,
+    key TEXT,
+    created REAL NOT NULL,
+    PRIMARY KEY (event, stage, path)
+);
+CREATE INDEX IF NOT EXISTS events_model ON events (model);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class _LegacyLoader(yaml.Loader):
+    """Full YAML loader that reads pickled floodsens objects (Project, Event, FloodsensModel) as plain
+    dicts of their attributes instead of instances that skipped __init__."""
+
+def _construct_legacy_object(loader, suffix, node):
+    if suffix.split(".")[0] != "floodsens":
+        yield from loader.construct_python_object(suffix, node)
+        return
+    data = {}
+    yield data
+    data.update(loader.construct_mapping(node, deep=True))
+
+_LegacyLoader.add_multi_constructor("tag:yaml.org,2002:python/object:", _construct_legacy_object)
+
+def _plain(value):
+    """Convert legacy checkpoint values (paths, arrays, tensors) to the JSON types of current checkpoints."""
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, PurePath):
+        return str(value)
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return value
+
+
+def read_yaml_checkpoint(yaml_path):
+    """Read a YAML checkpoint with the safe loader. Checkpoints written by floodsens 0.2.1 and earlier
+    contain python object tags and are read with the full loader after a warning; only load those
+    from trusted sources. Events and models in legacy checkpoints are returned as plain dicts of their
+    attributes, which Event.from_dict and FloodsensModel accept like current checkpoints."""
+    with open(yaml_path, "r") as istream:
+        content = istream.read()
+    try:
+        return yaml.safe_load(content)
+    except yaml.constructor.ConstructorError:
+        logger.warning(f"{yaml_path} is a legacy checkpoint with python objects. Loading it with the unsafe YAML loader.")
+        return _plain(yaml.load(content, Loader=_LegacyLoader))
+
+
+class StateStore():
+    """SQLite backed store of the models, events and run artifacts of a project.
+
+    Arguments:
+        path {str, Path} -- Path to the database file. Created if it does not exist.
+
+    Methods:
+        put_model / models -- Insert or update a model, get all models.
+        put_event / event / events / event_names / remove_event -- Insert or update, look up and remove events.
+        record_artifact / artifacts -- Record and list products of event runs.
+        set_value / get_value -- Project level settings such as the active event.
+        import_yaml / export_yaml -- Convert from and to YAML project checkpoints."""
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path))
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.path})'
+
+    def close(self):
+        self.connection.close()
+
+    def put_model(self, model):
+        """Insert or update a model. Accepts a FloodsensModel or its to_dict representation."""
+        data = model if isinstance(model, dict) else model.to_dict()
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO models (name, path, data) VALUES (?, ?, ?)",
+                                    (data["name"], data["path"], json.dumps(data)))
+
+    def models(self):
+        rows = self.connection.execute("SELECT name, data FROM models ORDER BY name").fetchall()
+        return {name: json.loads(data) for name, data in rows}
+
+    def put_event(self, event):
+        """Insert or update an event. Accepts an Event or its to_dict representation."""
+        data = event if isinstance(event, dict) else event.to_dict()
+        model_name = data["model"]["name"] if data.get("model") is not None else None
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO events (name, event_folder, model, data, updated) VALUES (?, ?, ?, ?, ?)",
+                                    (data["name"], data["event_folder"], model_name, json.dumps(data), time.time()))
+
+    def event(self, name):
+        row = self.connection.execute("SELECT data FROM events WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(f"Event {name} not found in {self.path}.")
+        return json.loads(row[0])
+
+    def events(self):
+        rows = self.connection.execute("SELECT name, data FROM events ORDER BY name").fetchall()
+        return {name: json.loads(data) for name, data in rows}
+
+    def event_names(self, model=None):
+        """Names of all events, optionally only those using the given model name."""
+        if model is None:
+            rows = self.connection.execute("SELECT name FROM events ORDER BY name").fetchall()
+        else:
+            rows = self.connection.execute("SELECT name FROM events WHERE model = ? ORDER BY name", (model,)).fetchall()
+        return [row[0] for row in rows]
+
+    def remove_event(self, name):
+        with self.connection:
+            self.connection.execute("DELETE FROM events WHERE name = ?", (name,))
+            self.connection.execute("DELETE FROM artifacts WHERE event = ?", (name,))
+
+    def record_artifact(self, event_name, stage, path, key=None):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO artifacts (event, stage, path, key, created) VALUES (?, ?, ?, ?, ?)",
+                                    (event_name, stage, str(path), key, time.time()))
+
+    def artifacts(self, event_name, stage=None):
+        """List of (stage, path, key) of the artifacts recorded for an event."""
+        if stage is None:
+            rows = self.connection.execute("SELECT stage, path, key FROM artifacts WHERE event = ? ORDER BY created", (event_name,)).fetchall()
+        else:
+            rows = self.connection.execute("SELECT stage, path, key FROM artifacts WHERE event = ? AND stage = ? ORDER BY created", (event_name, stage)).fetchall()
+        return [(stage, Path(path), key) for stage, path, key in rows]
+
+    def set_value(self, key, value):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def get_value(self, key, default=None):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def import_yaml(self, yaml_path):
+        """Import models and events from a YAML project checkpoint (current or legacy format)."""
+        data = read_yaml_checkpoint(yaml_path)
+
+        for model in (data.get("models") or {}).values():
+            self.put_model(model)
+        for event in (data.get("event_collection") or {}).values():
+            self.put_event(event)
+
+        event = data.get("event")
+        if event is not None:
+            self.set_value("active_event", event if isinstance(event, str) else event["name"] if isinstance(event, dict) else event.name)
+
+        logger.info(f"Imported {len(data.get('models') or {})} models and {len(data.get('event_collection') or {})} events from {yaml_path}.")
+
+    def export_yaml(self, yaml_path, project_folder=None):
+        """Write the store as a YAML project checkpoint that Project.from_yaml can load."""
+        data = {"project_folder": str(project_folder if project_folder is not None else self.path.parent),
+                "models": self.models(),
+                "event_collection": self.events(),
+                "event": self.get_value("active_event")}
+        with open(yaml_path, "w") as ostream:
+            yaml.safe_dump(data, ostream)
+        return Path(yaml_path)
@@ -0,0 +1,109 @@
+"""Statistics of flood probability maps accumulated window by window while the map is written, so
+thresholds, flooded areas and histograms never require reading the output raster again."""
+import json
+from pathlib import Path
+import numpy as np
+from osgeo import gdal, osr
+from floodsens.archive import archive_index
+
+DEFAULT_THRESHOLDS = (0.3, 0.5, 0.7)
+
+
+def archive_footprint(zip_path, projection):
+    """Bounds (minX, minY, maxX, maxY) of a Sentinel-2 archive in projection, read from the header of
+    its B02 band. Archives in another UTM zone are transformed by their corners."""
+    ds = gdal.Open(archive_index(zip_path).vsizip("B02", "10m"))
+    gt, xsize, ysize = ds.GetGeoTransform(), ds.RasterXSize, ds.RasterYSize
+    source_srs, target_srs = osr.SpatialReference(), osr.SpatialReference()
+    source_srs.ImportFromWkt(ds.GetProjection())
+    target_srs.ImportFromWkt(projection)
+    ds = None
+
+    corners = [(gt[0] + col*gt[1], gt[3] + row*gt[5]) for col in (0, xsize) for row in (0, ysize)]
+    if not source_srs.IsSame(target_srs):
+        source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        target_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        transform = osr.CoordinateTransformation(source_srs, target_srs)
+        corners = [transform.TransformPoint(x, y)[:2] for x, y in corners]
+    xs, ys = [x for x, _ in corners], [y for _, y in corners]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+class MapStatistics():
+    """Running statistics of a flood probability map.
+
+    Arguments:
+        (optional) thresholds {tuple} -- Probabilities at which the flooded area is counted (>= threshold).
+        (optional) bins {int} -- Number of equal histogram bins between 0 and 1.
+        (optional) archives {list} -- Sentinel-2 archives of the map. Pixels are counted for every archive
+            whose footprint (see archive_footprint) contains them.
+        (optional) nodata {float} -- Nodata value of the map.
+
+    Methods:
+        add -- Accumulate a window of the map.
+        to_dict / to_json -- Pixel counts, areas in m2 and the histogram."""
+    def __init__(self, thresholds=DEFAULT_THRESHOLDS, bins=20, archives=None, nodata=-9999):
+        self.thresholds = tuple(thresholds)
+        self.bin_edges = np.linspace(0.0, 1.0, bins+1)
+        self.archives = [Path(x) for x in archives] if archives is not None else []
+        self.footprints = None
+        self.nodata = nodata
+
+        self.histogram = np.zeros(bins, dtype=np.int64)
+        self.valid_pixels = 0
+        self.flooded_pixels = np.zeros(len(self.thresholds), dtype=np.int64)
+        self.archive_pixels = {x.name: {"valid": 0, "flooded": np.zeros(len(self.thresholds), dtype=np.int64)} for x in self.archives}
+        self.pixel_area = None
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.thresholds}, {self.valid_pixels} valid pixels)'
+
+    def _count(self, array):
+        valid = (array != self.nodata) & ~np.isnan(array)
+        values = array[valid]
+        return values, np.array([np.count_nonzero(values >= threshold) for threshold in self.thresholds], dtype=np.int64)
+
+    def add(self, array, geotransform, projection=None):
+        """Accumulate a (rows, cols) probability window with geotransform. The projection of the map
+        is required with the first window if archives are counted."""
+        if self.pixel_area is None:
+            self.pixel_area = abs(geotransform[1]*geotransform[5])
+        if self.footprints is None:
+            if len(self.archives) > 0 and projection is None:
+                raise ValueError("The map projection is required to count pixels per archive.")
+            self.footprints = {x.name: archive_footprint(x, projection) for x in self.archives}
+        values, flooded = self._count(array)
+        self.valid_pixels += values.size
+        self.flooded_pixels += flooded
+        self.histogram += np.histogram(np.clip(values, 0.0, 1.0), bins=self.bin_edges)[0]
+
+        rows, cols = array.shape
+        for name, (min_x, min_y, max_x, max_y) in self.footprints.items():
+            col0 = int(np.clip(np.ceil((min_x - geotransform[0])/geotransform[1]), 0, cols))
+            col1 = int(np.clip(np.floor((max_x - geotransform[0])/geotransform[1]), 0, cols))
+            row0 = int(np.clip(np.ceil((max_y - geotransform[3])/geotransform[5]), 0, rows))
+            row1 = int(np.clip(np.floor((min_y - geotransform[3])/geotransform[5]), 0, rows))
+            if col1 <= col0 or row1 <= row0:
+                continue
+            values, flooded = self._count(array[row0:row1, col0:col1])
+            self.archive_pixels[name]["valid"] += values.size
+            self.archive_pixels[name]["flooded"] += flooded
+
+    def to_dict(self):
+        pixel_area = self.pixel_area if self.pixel_area is not None else 0.0
+        return {"thresholds": list(self.thresholds),
+                "pixel_area_m2": pixel_area,
+                "valid_pixels": int(self.valid_pixels),
+                "valid_area_m2": float(self.valid_pixels*pixel_area),
+                "flooded_pixels": {str(t): int(x) for t, x in zip(self.thresholds, self.flooded_pixels)},
+                "flooded_area_m2": {str(t): float(x*pixel_area) for t, x in zip(self.thresholds, self.flooded_pixels)},
+                "histogram": {"bin_edges": self.bin_edges.tolist(), "counts": self.histogram.tolist()},
+                "archives": {name: {"valid_pixels": int(counts["valid"]),
+                                    "flooded_pixels": {str(t): int(x) for t, x in zip(self.thresholds, counts["flooded"])}}
+                             for name, counts in self.archive_pixels.items()}}
+
+    def to_json(self, path):
+        path = Path(path)
+        with open(path, "w") as ostream:
+            json.dump(self.to_dict(), ostream, indent=2)
+        return path
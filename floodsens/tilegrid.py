@@ -0,0 +1,141 @@
+"""Index of the Sentinel-2 tiling grid. The footprints of all MGRS tiles are kept in a small SQLite
+database with an R-tree over their lon/lat bounds, built once from the ESA tiling grid shapefile, so
+tile footprints and the tiles at a point or in a bounding box are looked up without reading the
+shapefile."""
+import os
+import sqlite3
+from pathlib import Path
+from floodsens.logger import logger
+
+TILE_GRID_PATH = Path(os.environ.get("FLOODSENS_TILE_GRID", Path.home()/".floodsens"/"tile_grid.sqlite"))
+LEGACY_SHAPEFILE = Path("src/sentinel_zones/sentinel_2_index_shapefile.shp")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    min_lon REAL NOT NULL,
+    min_lat REAL NOT NULL,
+    max_lon REAL NOT NULL,
+    max_lat REAL NOT NULL,
+    footprint TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS tiles_rtree USING rtree(id, min_lon, max_lon, min_lat, max_lat);
+"""
+
+
+def _tile_name(name):
+    """Tile names are stored without the leading T of archive names (T32ULV -> 32ULV)."""
+    return name[1:] if len(name) == 6 and name[0] == "T" else name
+
+
+class TileGrid():
+    """Sentinel-2 tiling grid index.
+
+    Arguments:
+        (optional) path {str, Path} -- Path to the index database. Defaults to TILE_GRID_PATH
+            ($FLOODSENS_TILE_GRID or ~/.floodsens/tile_grid.sqlite). If it does not exist it is built
+            from src/sentinel_zones/sentinel_2_index_shapefile.shp when that file is present.
+
+    Methods:
+        build -- Build the index from the tiling grid shapefile.
+        bounds / footprint -- Lon/lat bounds and WKT footprint of tiles.
+        tiles_at / tiles_in -- Tiles at a point or intersecting a bounding box."""
+    def __init__(self, path=None):
+        self.path = Path(path) if path is not None else TILE_GRID_PATH
+        if not self.path.exists():
+            if not LEGACY_SHAPEFILE.exists():
+                raise FileNotFoundError(f"Tile grid index {self.path} not found. Build it with TileGrid.build(shapefile_path).")
+            self.build(LEGACY_SHAPEFILE, self.path)
+        self.connection = sqlite3.connect(str(self.path))
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.path})'
+
+    def close(self):
+        self.connection.close()
+
+    @classmethod
+    def build(cls, shapefile_path, out_path=None, name_field="Name"):
+        """Build the index from the Sentinel-2 tiling grid shapefile. Footprints are stored in WGS84.
+
+        Arguments:
+            shapefile_path {str, Path} -- Tiling grid shapefile (or any OGR readable file).
+            (optional) out_path {str, Path} -- Path of the index. Defaults to TILE_GRID_PATH.
+            (optional) name_field {str} -- Attribute holding the tile name.
+
+        Returns:
+            tile_grid {TileGrid} -- The new index."""
+        from osgeo import ogr, osr
+
+        out_path = Path(out_path) if out_path is not None else TILE_GRID_PATH
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = out_path.with_suffix(".tmp")
+        tmp_path.unlink(missing_ok=True)
+
+        source = ogr.Open(str(shapefile_path))
+        layer = source.GetLayer()
+        wgs84 = osr.SpatialReference()
+        wgs84.ImportFromEPSG(4326)
+        wgs84.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        layer_srs = layer.GetSpatialRef()
+        transform = None
+        if layer_srs is not None and not layer_srs.IsSame(wgs84):
+            layer_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            transform = osr.CoordinateTransformation(layer_srs, wgs84)
+
+        connection = sqlite3.connect(str(tmp_path))
+        connection.executescript(SCHEMA)
+        with connection:
+            for k, feature in enumerate(layer):
+                geometry = feature.GetGeometryRef().Clone()
+                if transform is not None:
+                    geometry.Transform(transform)
+                min_lon, max_lon, min_lat, max_lat = geometry.GetEnvelope()
+                connection.execute("INSERT INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   (k, _tile_name(feature.GetField(name_field)), min_lon, min_lat, max_lon, max_lat, geometry.ExportToWkt()))
+                connection.execute("INSERT INTO tiles_rtree VALUES (?, ?, ?, ?, ?)", (k, min_lon, max_lon, min_lat, max_lat))
+        connection.close()
+        source = None
+
+        os.replace(tmp_path, out_path)
+        logger.info(f"Tile grid index with {k+1} tiles written to {out_path}.")
+        return cls(out_path)
+
+    def bounds(self, *names):
+        """(min_lon, min_lat, max_lon, max_lat) of the given tiles, in the same order. Accepts names
+        with or without the leading T. Raises KeyError for unknown tiles."""
+        names = [_tile_name(x) for x in names]
+        placeholders = ", ".join("?"*len(names))
+        rows = self.connection.execute(f"SELECT name, min_lon, min_lat, max_lon, max_lat FROM tiles WHERE name IN ({placeholders})", names).fetchall()
+        found = {row[0]: row[1:] for row in rows}
+        missing = [x for x in names if x not in found]
+        if missing:
+            raise KeyError(f"Tiles {missing} not found in {self.path}.")
+        return [found[x] for x in names]
+
+    def footprint(self, name):
+        """WKT footprint of a tile in WGS84."""
+        row = self.connection.execute("SELECT footprint FROM tiles WHERE name = ?", (_tile_name(name),)).fetchone()
+        if row is None:
+            raise KeyError(f"Tile {name} not found in {self.path}.")
+        return row[0]
+
+    def tiles_in(self, min_lon, min_lat, max_lon, max_lat):
+        """Names of the tiles whose bounds intersect the bounding box."""
+        rows = self.connection.execute("SELECT tiles.name FROM tiles_rtree JOIN tiles ON tiles.id = tiles_rtree.id "
+                                       "WHERE tiles_rtree.max_lon >= ? AND tiles_rtree.min_lon <= ? AND tiles_rtree.max_lat >= ? AND tiles_rtree.min_lat <= ? "
+                                       "ORDER BY tiles.name", (min_lon, max_lon, min_lat, max_lat)).fetchall()
+        return [row[0] for row in rows]
+
+    def tiles_at(self, lon, lat, exact=True):
+        """Names of the tiles containing a point. Bounds are tested first, with exact=True the
+        candidates are refined against their footprints (requires OGR)."""
+        candidates = self.tiles_in(lon, lat, lon, lat)
+        if not exact or len(candidates) == 0:
+            return candidates
+
+        from osgeo import ogr
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(lon, lat)
+        return [x for x in candidates if ogr.CreateGeometryFromWkt(self.footprint(x)).Intersects(point)]
@@ -1,8 +1,7 @@
 import re
 import shutil
-import itertools
+import hashlib
 import zipfile
-import geopandas as gpd
 from pathlib import Path
 
 from floodsens.logger import logger
@@ -12,48 +11,78 @@ def download_sentinel2() -> list:
     # TODO with Google Earth Engine
     raise NotImplementedError("Download Sentinel-2 images from Copernicus Open Access Hub")
 
-def extract_metadata(paths): #FIXME Only for single image at the moment
-    time, zone = re.search(r'_(\d+)T.+_T(.....)_', paths[0].name).group(1, 2)
-
-    utm_df = gpd.read_file("src/sentinel_zones/sentinel_2_index_shapefile.shp")
-    utm_df = utm_df[utm_df.Name == zone]
-    aoi = utm_df.geometry.bounds.values[0]
+def fingerprint(*paths, **params):
+    """Return a short hash identifying the given files and parameters. Files are identified
+    by resolved path, size and modification time so large archives are never read.
+
+    Arguments:
+        paths {str, Path} -- Files whose state the hash depends on.
+        params -- Additional parameters the hash depends on (e.g. thresholds)."""
+    digest = hashlib.sha1()
+    for path in paths:
+        path = Path(path)
+        stat = path.stat()
+        digest.update(f"{path.resolve()}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    for key in sorted(params):
+        digest.update(f"{key}={params[key]}\n".encode())
+    return digest.hexdigest()[:16]
+
+def cloud_cover(zip_path):
+    """Cloud coverage assessment (percent) from the product metadata of a Sentinel-2 archive.
+    Returns None if the archive has no product metadata."""
+    from floodsens.archive import archive_index
+
+    member = archive_index(zip_path).metadata
+    if member is None:
+        return None
+    with zipfile.ZipFile(zip_path, 'r') as zip_file:
+        metadata = zip_file.read(member).decode(errors="ignore")
+
+    match = re.search(r'<Cloud_Coverage_Assessment>\s*([\d.]+)\s*<', metadata)
+    return float(match.group(1)) if match is not None else None
+
+def archives_metadata(paths, tile_grid=None):
+    """Sensing date, tile name and footprint bounds (min_lon, min_lat, max_lon, max_lat) of every
+    Sentinel-2 archive in paths, from the archive names and the tile grid index. All footprints are
+    looked up in a single query.
+
+    Arguments:
+        paths {list} -- Paths to Sentinel-2 archives.
+        (optional) tile_grid {TileGrid} -- Tile grid index. Defaults to TileGrid().
+
+    Returns:
+        metadata {list} -- (time, tile, aoi) per archive."""
+    from floodsens.tilegrid import TileGrid
+
+    names = [re.search(r'_(\d+)T.+_T(.....)_', Path(x).name).group(1, 2) for x in paths]
+    tile_grid = tile_grid if tile_grid is not None else TileGrid()
+    bounds = tile_grid.bounds(*[zone for _, zone in names])
+    return [(time, zone, aoi) for (time, zone), aoi in zip(names, bounds)]
+
+def extract_metadata(paths, tile_grid=None):
+    """Sensing date and footprint bounds of the first archive in paths, see archives_metadata."""
+    time, _, aoi = archives_metadata(paths[:1], tile_grid)[0]
 
     logger.info(f"AOI and time extracted from Sentinel-2 images")
 
     return time, aoi
 
 def extract(zip_path, extract_dir, extract_list, cleanup=True):
-    extract_dir = Path(extract_dir)
-    zip_file = zipfile.ZipFile(zip_path, 'r')
-
-    extractable_files = []
-    for file in zip_file.namelist():
-
-        match = list(filter(lambda x: all([x[0][0] in x[1], x[0][1] in x[1]]), zip(extract_list, itertools.repeat(file))))
+    """Extract the (band, resolution) pairs of extract_list from a Sentinel-2 archive directly into
+    extract_dir. Members are looked up in the archive index. cleanup is kept for compatibility, no
+    .SAFE folder structure is created anymore."""
+    from floodsens.archive import archive_index
 
-        if len(match) == 0:
-            continue
-        if len(match) == 1:
-            extractable_files.append(match[0][1])
-        if len(match) > 1:
-            raise ValueError(f"Filtering zip archive failed. Unexpected match ambiguity: {match}")
+    extract_dir = Path(extract_dir)
+    extractable_files = archive_index(zip_path).select(extract_list)
 
     extracted_files = []
-    for extractable_file in extractable_files:
-        zip_file.extract(extractable_file, extract_dir)
-        extractable_file = Path(extractable_file)
-        extracted_file = extract_dir/extractable_file.name
-        (extract_dir/extractable_file).rename(extracted_file)
-
-        extracted_files.append(extracted_file)
-
-    if cleanup: 
-        try:
-            shutil.rmtree(extract_dir/f"{zip_path.stem}.SAFE")
-        except FileNotFoundError:
-            logger.warning(f"Folder for clean up does no exist: {extract_dir/zip_path.stem}.SAFE")
-
+    with zipfile.ZipFile(zip_path, 'r') as zip_file:
+        for extractable_file in extractable_files:
+            extracted_file = extract_dir/Path(extractable_file).name
+            with zip_file.open(extractable_file) as istream, open(extracted_file, 'wb') as ostream:
+                shutil.copyfileobj(istream, ostream, 2**20)
+            extracted_files.append(extracted_file)
 
     extracted_files.sort()
     return extracted_files
@@ -0,0 +1,153 @@
+"""Vectorization of flooded regions while a map is written. Every window is thresholded and
+polygonized on its own; polygons inside a window are written immediately, polygons touching the
+window border are merged with the pending border polygons they share an edge with. Windows arrive
+row by row, so a pending polygon that does not reach the row being added is complete and written.
+Only polygons along the open row are kept, the full probability raster is never polygonized at once."""
+import os
+from pathlib import Path
+import numpy as np
+from osgeo import gdal, ogr, osr
+from floodsens.logger import logger
+
+VECTOR_DRIVERS = {".gpkg": "GPKG", ".geojson": "GeoJSON", ".json": "GeoJSON"}
+
+
+class FloodVectorizer():
+    """Streaming vectorizer of flood probability windows. Every polygon carries its area and
+    perimeter in units of the map projection (m for the UTM grids of Sentinel-2).
+
+    Arguments:
+        out_path {str, Path} -- Output vector, GeoPackage (.gpkg) or GeoJSON (.geojson).
+        projection {str} -- WKT of the map projection.
+        (optional) threshold {float} -- Pixels with a probability >= threshold are flooded.
+        (optional) nodata {float} -- Nodata value of the windows, never flooded.
+
+    Methods:
+        add -- Vectorize a window of the map. Windows are added row by row, from the top.
+        close -- Write the remaining border polygons and the output. Returns the summary."""
+    def __init__(self, out_path, projection, threshold=0.5, nodata=-9999):
+        self.out_path = Path(out_path)
+        driver_name = VECTOR_DRIVERS.get(self.out_path.suffix.lower())
+        if driver_name is None:
+            raise ValueError(f"Unknown vector format {self.out_path.suffix}. Choose from {list(VECTOR_DRIVERS.keys())}.")
+        self.threshold = threshold
+        self.nodata = nodata
+        self.srs = osr.SpatialReference()
+        self.srs.ImportFromWkt(projection)
+
+        self.tmp_path = self.out_path.with_name(f"{self.out_path.stem}.tmp{self.out_path.suffix}")
+        driver = ogr.GetDriverByName(driver_name)
+        if self.tmp_path.exists():
+            driver.DeleteDataSource(str(self.tmp_path))
+        self.datasource = driver.CreateDataSource(str(self.tmp_path))
+        self.layer = self.datasource.CreateLayer("flood", self.srs, ogr.wkbPolygon)
+        self.layer.CreateField(ogr.FieldDefn("area_m2", ogr.OFTReal))
+        self.layer.CreateField(ogr.FieldDefn("perimeter_m", ogr.OFTReal))
+        self.layer.StartTransaction()
+
+        self._border, self._row_top = [], None
+        self.polygons, self.flooded_area, self.largest_area = 0, 0.0, 0.0
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.out_path}, {self.threshold})'
+
+    def _write(self, geometry):
+        area = geometry.GetArea()
+        feature = ogr.Feature(self.layer.GetLayerDefn())
+        feature.SetGeometry(geometry)
+        feature.SetField("area_m2", area)
+        feature.SetField("perimeter_m", geometry.Boundary().Length())
+        self.layer.CreateFeature(feature)
+
+        self.polygons += 1
+        self.flooded_area += area
+        self.largest_area = max(self.largest_area, area)
+
+    def _merge(self, geometry):
+        """Union geometry with the pending border polygons it shares an edge with. Polygons touching
+        in a corner only stay separate, like the 4-connected polygons of gdal.Polygonize."""
+        pending = []
+        for border_geometry in self._border:
+            if border_geometry.Intersects(geometry):
+                union = geometry.Union(border_geometry)
+                if union.GetGeometryType() == ogr.wkbPolygon:
+                    geometry = union
+                    continue
+            pending.append(border_geometry)
+        pending.append(geometry)
+        self._border = pending
+
+    def _flush(self, min_y=None):
+        """Write the pending border polygons lying entirely above min_y, all of them if None."""
+        pending = []
+        for geometry in self._border:
+            if min_y is None or geometry.GetEnvelope()[2] > min_y:
+                self._write(geometry)
+            else:
+                pending.append(geometry)
+        self._border = pending
+
+    def add(self, array, geotransform):
+        """Vectorize the flooded pixels of a (rows, cols) probability window with geotransform.
+        Windows must be added row by row from the top, in any order within a row."""
+        # A new row starts below the open one: polygons not reaching down to it are complete
+        tolerance = abs(geotransform[1])/2
+        top = geotransform[3]
+        if self._row_top is not None and top > self._row_top + tolerance:
+            raise ValueError(f"Windows must be added row by row from the top, got a window at {top} after the row at {self._row_top}.")
+        if self._row_top is None or top < self._row_top - tolerance:
+            self._flush(min_y=top + tolerance)
+            self._row_top = top
+
+        with np.errstate(invalid="ignore"):
+            flooded = (array >= self.threshold) & (array != self.nodata)
+        if not flooded.any():
+            return
+        rows, cols = flooded.shape
+
+        window = gdal.GetDriverByName("MEM").Create("", cols, rows, 1, gdal.GDT_Byte)
+        window.SetGeoTransform(geotransform)
+        window.SetProjection(self.srs.ExportToWkt())
+        band = window.GetRasterBand(1)
+        band.WriteArray(flooded.astype(np.uint8))
+
+        memory = ogr.GetDriverByName("Memory").CreateDataSource("")
+        polygons = memory.CreateLayer("window", self.srs, ogr.wkbPolygon)
+        polygons.CreateField(ogr.FieldDefn("value", ogr.OFTInteger))
+        gdal.Polygonize(band, band, polygons, 0)
+
+        # Polygons reaching the window border may continue in the neighbouring window
+        min_x, max_x = geotransform[0], geotransform[0] + cols*geotransform[1]
+        max_y, min_y = geotransform[3], geotransform[3] + rows*geotransform[5]
+        for feature in polygons:
+            geometry = feature.GetGeometryRef()
+            env_min_x, env_max_x, env_min_y, env_max_y = geometry.GetEnvelope()
+            if (env_min_x < min_x + tolerance or env_max_x > max_x - tolerance or
+                    env_min_y < min_y + tolerance or env_max_y > max_y - tolerance):
+                self._merge(geometry.Clone())
+            else:
+                self._write(geometry)
+
+        memory = None
+        window = None
+
+    def close(self):
+        """Write the remaining border polygons and the output and return the summary statistics
+        (number of polygons, flooded and largest polygon area, threshold)."""
+        self._flush()
+
+        summary = self.summary()
+        self.layer.CommitTransaction()
+        self.layer.SetMetadata({key: str(value) for key, value in summary.items()})
+        self.layer = None
+        self.datasource = None
+        os.replace(self.tmp_path, self.out_path)
+
+        logger.info(f"{summary['polygons']} flood polygons ({summary['flooded_area_m2']/1e6:.2f} km2) written to {self.out_path}.")
+        return summary
+
+    def summary(self):
+        return {"polygons": self.polygons,
+                "flooded_area_m2": self.flooded_area,
+                "largest_polygon_m2": self.largest_area,
+                "threshold": self.threshold}
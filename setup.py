@@ -24,6 +24,9 @@ setup(
         'tifffile',
         'pandas'
     ],
+    entry_points = {
+        'console_scripts': ['floodsens=floodsens.cli:main'],
+    },
     dependency_links = [],
     description = "Flood Segmentation on Sentinel-2 images based on Machine Learning Models",
     license = 'MIT',
@@ -0,0 +1,111 @@
+"""Index of the members of Sentinel-2 archives and its cache next to the archive."""
+import os
+import json
+import zipfile
+import pytest
+
+import floodsens.archive as archive
+from floodsens.archive import archive_index
+
+GRANULE = "S2A_MSIL2A_20241030T103151_N0511_R008_T31SBD_20241030T140000.SAFE/GRANULE/L2A_T31SBD_A048800_20241030T103151/IMG_DATA"
+L2A_MEMBERS = [f"{GRANULE}/R10m/T31SBD_20241030T103151_B02_10m.jp2",
+               f"{GRANULE}/R10m/T31SBD_20241030T103151_B03_10m.jp2",
+               f"{GRANULE}/R20m/T31SBD_20241030T103151_B02_20m.jp2",
+               f"{GRANULE}/R20m/T31SBD_20241030T103151_B05_20m.jp2",
+               f"{GRANULE}/R20m/T31SBD_20241030T103151_SCL_20m.jp2",
+               "S2A_MSIL2A_20241030T103151_N0511_R008_T31SBD_20241030T140000.SAFE/MTD_MSIL2A.xml"]
+L1C_MEMBERS = ["S2A_MSIL1C_20241030T103151_N0511_R008_T31SBD_20241030T120000.SAFE/GRANULE/L1C_T31SBD_A048800_20241030T103151/IMG_DATA/T31SBD_20241030T103151_B02.jp2",
+               "S2A_MSIL1C_20241030T103151_N0511_R008_T31SBD_20241030T120000.SAFE/GRANULE/L1C_T31SBD_A048800_20241030T103151/IMG_DATA/T31SBD_20241030T103151_B05.jp2",
+               "S2A_MSIL1C_20241030T103151_N0511_R008_T31SBD_20241030T120000.SAFE/MTD_MSIL1C.xml"]
+
+
+@pytest.fixture(autouse=True)
+def _clear_memory():
+    archive._memory.clear()
+    yield
+    archive._memory.clear()
+
+
+def _archive(path, members):
+    with zipfile.ZipFile(path, "w") as zip_file:
+        for member in members:
+            zip_file.writestr(member, b"jp2")
+    return path
+
+
+def test_find_in_l2a_archive(tmp_path):
+    index = archive_index(_archive(tmp_path/"S2A_MSIL2A.zip", L2A_MEMBERS))
+    assert index.tile_id == "T31SBD"
+    assert index.sensing_time == "20241030T103151"
+    assert index.metadata.endswith("MTD_MSIL2A.xml")
+    assert len(index.entries) == 5
+
+    assert index.member("B02", "10m") == L2A_MEMBERS[0]
+    assert index.member("B02", "20m") == L2A_MEMBERS[2]
+    assert index.member("B05") == L2A_MEMBERS[3]
+    assert index.vsizip("SCL", "20m") == f"/vsizip/{tmp_path/'S2A_MSIL2A.zip'}/{L2A_MEMBERS[4]}"
+    with pytest.raises(ValueError):
+        index.find("B02")
+    with pytest.raises(ValueError):
+        index.find("B05", "10m")
+    assert index.select([("B05", "20m"), ("B02", "10m")]) == [L2A_MEMBERS[0], L2A_MEMBERS[3]]
+
+
+def test_find_in_l1c_archive(tmp_path):
+    index = archive_index(_archive(tmp_path/"S2A_MSIL1C.zip", L1C_MEMBERS))
+    assert index.metadata.endswith("MTD_MSIL1C.xml")
+    assert index.member("B02", "10m") == L1C_MEMBERS[0]
+    assert index.member("B02", "20m") == L1C_MEMBERS[0]
+    assert index.member("B05") == L1C_MEMBERS[1]
+    with pytest.raises(ValueError):
+        index.find("SCL", "20m")
+
+
+def test_index_is_cached_next_to_the_archive(tmp_path, monkeypatch):
+    zip_path = _archive(tmp_path/"S2A_MSIL2A.zip", L2A_MEMBERS)
+    index = archive_index(zip_path)
+    index_path = tmp_path/"S2A_MSIL2A.zip.index.json"
+    assert index_path.exists()
+    assert archive_index(zip_path) is index
+
+    # A new process reads the index file instead of the zip directory
+    archive._memory.clear()
+    monkeypatch.setattr(archive, "_parse", lambda zip_path: pytest.fail("archive parsed again"))
+    restored = archive_index(zip_path)
+    assert restored is not index
+    assert restored.entries == index.entries
+    assert restored.member("B02", "10m") == L2A_MEMBERS[0]
+
+
+def test_index_is_invalidated_by_size_and_mtime(tmp_path):
+    zip_path = _archive(tmp_path/"S2A_MSIL2A.zip", L2A_MEMBERS)
+    index = archive_index(zip_path)
+    stat = zip_path.stat()
+
+    # Same size, newer modification time
+    os.utime(zip_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**10))
+    assert archive_index(zip_path) is not index
+
+    # Archive replaced by a larger one with the original modification time
+    _archive(zip_path, L2A_MEMBERS + [f"{GRANULE}/R20m/T31SBD_20241030T103151_B06_20m.jp2"])
+    os.utime(zip_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    archive._memory.clear()
+    updated = archive_index(zip_path)
+    assert len(updated.entries) == 6
+    assert updated.member("B06", "20m").endswith("B06_20m.jp2")
+    with open(tmp_path/"S2A_MSIL2A.zip.index.json", "r") as istream:
+        assert len(json.load(istream)["entries"]) == 6
+
+
+def test_index_of_another_version_is_parsed_again(tmp_path):
+    zip_path = _archive(tmp_path/"S2A_MSIL2A.zip", L2A_MEMBERS)
+    index_path = tmp_path/"S2A_MSIL2A.zip.index.json"
+    archive_index(zip_path)
+    with open(index_path, "r") as istream:
+        data = json.load(istream)
+    data["version"], data["entries"] = archive.INDEX_VERSION + 1, []
+    with open(index_path, "w") as ostream:
+        json.dump(data, ostream)
+
+    archive._memory.clear()
+    assert len(archive_index(zip_path).entries) == 5
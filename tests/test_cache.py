@@ -0,0 +1,206 @@
+"""Stage cache of resumable event processing, the fingerprints its keys are built from and the
+derivative cache shared between events."""
+import os
+import pytest
+
+import floodsens.cache
+from floodsens.cache import StageCache, DerivativeCache
+from floodsens.utils import fingerprint
+
+RESOLUTION = 30.0
+
+
+def _input(tmp_path, content=b"archive"):
+    path = tmp_path/"S2A_MSIL2A_20241030.zip"
+    path.write_bytes(content)
+    return path
+
+
+def _touch(path, seconds):
+    """Move the modification time of path by seconds, independent of the file system resolution."""
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + int(seconds*1e9)))
+
+
+def test_fingerprint_depends_on_files_and_parameters(tmp_path):
+    path = _input(tmp_path)
+    key = fingerprint(path, threshold=0.5, tile_size=244)
+    assert key == fingerprint(path, tile_size=244, threshold=0.5)
+    assert key != fingerprint(path, threshold=0.6, tile_size=244)
+    assert key != fingerprint(path, threshold=0.5)
+    assert len(key) == 16
+
+
+def test_fingerprint_changes_with_size_and_mtime(tmp_path):
+    path = _input(tmp_path)
+    key = fingerprint(path)
+
+    _touch(path, 10)
+    touched = fingerprint(path)
+    assert touched != key
+
+    stat = path.stat()
+    path.write_bytes(b"archive, downloaded again")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert fingerprint(path) not in (key, touched)
+
+
+def test_stage_is_valid_after_store(tmp_path):
+    path = _input(tmp_path)
+    artifact = tmp_path/"tiles"
+    artifact.mkdir()
+    cache = StageCache(tmp_path)
+    key = cache.key(path, tile_size=244)
+    assert not cache.is_valid("preprocessing", key)
+
+    cache.store("preprocessing", key, artifact)
+    assert cache.is_valid("preprocessing", key)
+    assert not cache.is_pending("preprocessing", key)
+    assert cache.artifacts("preprocessing") == [artifact]
+
+    reloaded = StageCache(tmp_path)
+    assert reloaded.is_valid("preprocessing", key)
+    assert not reloaded.is_valid("preprocessing", cache.key(path, tile_size=512))
+
+
+def test_stage_is_stale_after_input_changes(tmp_path):
+    path = _input(tmp_path)
+    artifact = tmp_path/"out.tif"
+    artifact.write_bytes(b"map")
+    cache = StageCache(tmp_path)
+    cache.store("map", cache.key(path), artifact)
+
+    _touch(path, 10)
+    assert not cache.is_valid("map", cache.key(path))
+
+    cache.store("map", cache.key(path), artifact)
+    path.write_bytes(b"a different archive")
+    assert not cache.is_valid("map", cache.key(path))
+
+
+def test_stage_is_stale_without_artifacts(tmp_path):
+    path = _input(tmp_path)
+    artifact = tmp_path/"out.tif"
+    artifact.write_bytes(b"map")
+    cache = StageCache(tmp_path)
+    key = cache.key(path)
+    cache.store("map", key, artifact)
+
+    artifact.unlink()
+    assert not cache.is_valid("map", key)
+
+
+def test_resume_after_interrupted_stage(tmp_path):
+    path = _input(tmp_path)
+    cache = StageCache(tmp_path)
+    key = cache.key(path, batch_size=4)
+    cache.begin("inference", key)
+
+    # A new process finds the stage started but never stored
+    resumed = StageCache(tmp_path)
+    assert resumed.is_pending("inference", key)
+    assert not resumed.is_valid("inference", key)
+    assert not resumed.is_pending("inference", cache.key(path, batch_size=8))
+
+    resumed.store("inference", key, tmp_path)
+    assert not resumed.is_pending("inference", key)
+    assert StageCache(tmp_path).is_valid("inference", key)
+
+
+def test_invalidate(tmp_path):
+    path = _input(tmp_path)
+    cache = StageCache(tmp_path)
+    key = cache.key(path)
+    for stage in ("preprocessing", "inference", "map"):
+        cache.store(stage, key, tmp_path)
+
+    cache.invalidate("inference")
+    assert not cache.is_valid("inference", key)
+    assert cache.is_valid("map", key)
+    assert "inference" not in StageCache(tmp_path).stages
+
+    cache.invalidate()
+    assert cache.stages == {}
+    assert StageCache(tmp_path).stages == {}
+    assert not (tmp_path/"stage_cache.tmp").exists()
+
+
+def _layers(folder, origin=(500000.0, 5000000.0), size=20):
+    """DEM and HAND of a size x size grid at origin (upper left corner) in UTM zone 31N."""
+    np = pytest.importorskip("numpy")
+    gdal = pytest.importorskip("osgeo.gdal")
+    osr = pytest.importorskip("osgeo.osr")
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32631)
+    folder.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for k, name in enumerate(("10_DEM.tif", "13_HAND.tif")):
+        ds = gdal.GetDriverByName("GTiff").Create(str(folder/name), size, size, 1, gdal.GDT_Float32)
+        ds.SetGeoTransform((origin[0], RESOLUTION, 0.0, origin[1], 0.0, -RESOLUTION))
+        ds.SetProjection(srs.ExportToWkt())
+        ds.GetRasterBand(1).WriteArray(np.arange(size*size, dtype=np.float32).reshape(size, size) + 1000*k)
+        ds = None
+        paths.append(folder/name)
+    return paths, srs.ExportToWkt()
+
+
+def _bounds(origin=(500000.0, 5000000.0), size=20, offset=(0, 0)):
+    min_x, max_y = origin[0] + offset[1]*RESOLUTION, origin[1] - offset[0]*RESOLUTION
+    return (min_x, max_y - size*RESOLUTION, min_x + size*RESOLUTION, max_y)
+
+
+def test_derivative_cache_store_lookup_and_crop(tmp_path):
+    gdal = pytest.importorskip("osgeo.gdal")
+    layers, projection = _layers(tmp_path/"event")
+    cache = DerivativeCache(tmp_path/"cache")
+    key = cache.store("copernicus", projection, _bounds(), RESOLUTION, RESOLUTION, *layers)
+    assert cache.store("copernicus", projection, _bounds(), RESOLUTION, RESOLUTION, *layers) == key
+    assert [x.name for x in (tmp_path/"cache").iterdir() if x.is_dir()] == [key]
+
+    crop_bounds = _bounds(size=10, offset=(5, 4))
+    assert cache.lookup("copernicus", projection, crop_bounds, RESOLUTION, RESOLUTION) == key
+    assert cache.lookup("local", projection, crop_bounds, RESOLUTION, RESOLUTION) is None
+    assert cache.lookup("copernicus", projection, crop_bounds, 10.0, 10.0) is None
+    shifted = tuple(x + RESOLUTION/2 for x in crop_bounds)
+    assert cache.lookup("copernicus", projection, shifted, RESOLUTION, RESOLUTION) is None
+    assert cache.lookup("copernicus", projection, _bounds(size=10, offset=(15, 0)), RESOLUTION, RESOLUTION) is None
+
+    out_dir = tmp_path/"cropped"
+    out_dir.mkdir()
+    out_paths = cache.crop(key, crop_bounds, out_dir)
+    assert [x.name for x in out_paths] == ["10_DEM.tif", "13_HAND.tif"]
+    for out_path, layer in zip(out_paths, layers):
+        cropped, original = gdal.Open(str(out_path)).ReadAsArray(), gdal.Open(str(layer)).ReadAsArray()
+        assert cropped.shape == (10, 10)
+        assert (cropped == original[5:15, 4:14]).all()
+
+
+def test_derivative_cache_evicts_least_recently_used(tmp_path):
+    first_layers, projection = _layers(tmp_path/"first")
+    second_origin = (600000.0, 5000000.0)
+    second_layers, _ = _layers(tmp_path/"second", origin=second_origin)
+    cache = DerivativeCache(tmp_path/"cache", max_size_gb=1e-9)
+
+    first = cache.store("copernicus", projection, _bounds(), RESOLUTION, RESOLUTION, *first_layers)
+    assert cache.lookup("copernicus", projection, _bounds(), RESOLUTION, RESOLUTION) == first
+
+    # The cache only fits one entry, the entry just stored is kept
+    second = cache.store("copernicus", projection, _bounds(origin=second_origin), RESOLUTION, RESOLUTION, *second_layers)
+    assert cache.lookup("copernicus", projection, _bounds(), RESOLUTION, RESOLUTION) is None
+    assert cache.crop(first, _bounds(), tmp_path) is None
+    assert not (tmp_path/"cache"/first).exists()
+    assert cache.lookup("copernicus", projection, _bounds(origin=second_origin), RESOLUTION, RESOLUTION) == second
+
+    cache.evict()
+    assert not (tmp_path/"cache"/second).exists()
+    assert cache.lookup("copernicus", projection, _bounds(origin=second_origin), RESOLUTION, RESOLUTION) is None
+
+
+def test_derivative_cache_without_fcntl(tmp_path, monkeypatch):
+    monkeypatch.setattr(floodsens.cache, "fcntl", None)
+    cache = DerivativeCache(tmp_path)
+    with cache._lock():
+        cache._save({})
+    cache.evict()
+    assert cache.lookup("copernicus", "", _bounds(), RESOLUTION, RESOLUTION) is None
+    assert not (tmp_path/"index.lock").exists()
@@ -0,0 +1,99 @@
+"""Parser, exit codes and model resolution of the command line interface, with a stand-in project."""
+import sys
+import types
+import pytest
+
+from floodsens import cli
+
+
+class _Summary():
+    def __init__(self, failed):
+        self.failed = failed
+
+
+class _Event():
+    def __init__(self, name):
+        self.name = name
+        self.model = None
+        self.tile_size = 244
+
+
+class _Project():
+    """Records what run-project does with the project instead of running it."""
+    instances = []
+    failed = {}
+
+    def __init__(self, project_folder):
+        self.project_folder = project_folder
+        self.models = {"unet": "unet model", "deeplab": "deeplab model"}
+        self.event_collection = {"valencia": _Event("valencia"), "porto": _Event("porto")}
+        self.run_all_options = None
+        _Project.instances.append(self)
+
+    def load_models(self, model_folder):
+        self.models = {"loaded": f"model from {model_folder}"}
+
+    def save_state(self, event_names=None):
+        self.saved = event_names
+
+    def run_all(self, **options):
+        self.run_all_options = options
+        return _Summary(_Project.failed)
+
+
+@pytest.fixture
+def project(monkeypatch):
+    _Project.instances, _Project.failed = [], {}
+    module = types.ModuleType("floodsens.project")
+    module.Project = _Project
+    monkeypatch.setitem(sys.modules, "floodsens.project", module)
+    return _Project
+
+
+def test_parser():
+    args = cli.build_parser().parse_args(["run-project", "project", "--model", "unet", "--events", "valencia", "porto"])
+    assert args.func is cli._run_project
+    assert (args.model, args.events, args.preprocess_workers, args.inference_workers) == ("unet", ["valencia", "porto"], 2, 1)
+    args = cli.build_parser().parse_args(["infer", "tiles", "--model", "model.tar", "--cuda"])
+    assert args.func is cli._infer and args.cuda and not args.resume
+    with pytest.raises(SystemExit):
+        cli.build_parser().parse_args(["infer", "tiles"])
+    with pytest.raises(SystemExit):
+        cli.build_parser().parse_args([])
+
+
+def test_run_project_with_named_model(project, tmp_path):
+    assert cli.main(["run-project", str(tmp_path), "--model", "deeplab", "--events", "porto", "--tile-size", "128"]) == 0
+    instance = project.instances[0]
+    assert instance.run_all_options["model"] == "deeplab model"
+    assert instance.run_all_options["event_names"] == ["porto"]
+    assert instance.event_collection["porto"].model == "deeplab model"
+    assert instance.event_collection["porto"].tile_size == 128
+    assert instance.event_collection["valencia"].model is None
+    assert instance.saved == ["porto"]
+
+
+def test_run_project_model_from_loaded_models(project, tmp_path):
+    assert cli.main(["run-project", str(tmp_path), "--models", "models", "--model", "loaded"]) == 0
+    instance = project.instances[0]
+    assert instance.run_all_options["model"] == "model from models"
+    assert instance.run_all_options["event_names"] == ["valencia", "porto"]
+
+
+def test_run_project_without_model(project, tmp_path):
+    assert cli.main(["run-project", str(tmp_path)]) == 0
+    assert project.instances[0].run_all_options["model"] is None
+
+
+def test_exit_code_is_1_on_failure(project, tmp_path):
+    # Unknown model
+    assert cli.main(["run-project", str(tmp_path), "--model", "missing"]) == 1
+    assert project.instances[0].run_all_options is None
+    # An event failed during the run
+    project.failed = {"porto": ("inference", "RuntimeError()")}
+    assert cli.main(["run-project", str(tmp_path)]) == 1
+
+
+def test_debug_raises(project, tmp_path):
+    with pytest.raises(ValueError):
+        cli.main(["--log-level", "DEBUG", "run-project", str(tmp_path), "--model", "missing"])
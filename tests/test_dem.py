@@ -0,0 +1,73 @@
+"""Agreement of the TWI backends, including flat and nodata cells."""
+import importlib.util
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("osgeo")
+pytest.importorskip("pysheds")
+pytest.importorskip("demloader")
+
+from floodsens._dem import TWI_BACKENDS, twi_kernel, twi_backend
+
+BACKENDS = sorted(TWI_BACKENDS)
+
+
+def _block(rows=32, cols=48, seed=0):
+    """Flow accumulation and slope (degrees) with flat cells, nodata (-9999) and NaN in both."""
+    rng = np.random.default_rng(seed)
+    flow_accumulation = np.exp(rng.uniform(0.0, 12.0, (rows, cols))).astype(np.float32)
+    slope = rng.uniform(0.01, 60.0, (rows, cols)).astype(np.float32)
+    slope[0, :8] = 0
+    slope[1, :8] = -9999
+    flow_accumulation[2, :8] = 0
+    flow_accumulation[3, :8] = -9999
+    slope[4, :4], flow_accumulation[4, :4] = 0, 0
+    slope[5, :4] = np.nan
+    flow_accumulation[6, :4] = np.nan
+    return flow_accumulation, slope
+
+
+def _reference(flow_accumulation, slope):
+    """TWI in float64: 0 on flat cells, NaN where slope or flow accumulation is invalid."""
+    fa, slope = flow_accumulation.astype(np.float64), slope.astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        twi = np.log(fa/np.tan(np.radians(slope)))
+    twi[~((slope > 0) & (fa > 0))] = np.nan
+    twi[slope == 0] = 0
+    return twi
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backend_matches_reference(backend):
+    if backend != "numpy":
+        pytest.importorskip(backend)
+    flow_accumulation, slope = _block()
+    expected = _reference(flow_accumulation, slope)
+
+    twi = twi_kernel(flow_accumulation, slope, backend=backend)
+    assert twi.dtype == np.float32
+    assert np.array_equal(np.isnan(twi), np.isnan(expected))
+    assert np.all(twi[slope == 0] == 0)
+    assert np.all(np.isnan(twi[1, :8])) and np.all(np.isnan(twi[2:4, :8]))
+    assert np.all(np.isnan(twi[5:7, :4]))
+    np.testing.assert_allclose(twi, expected, rtol=1e-5, atol=1e-5, equal_nan=True)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backend_writes_to_out(backend):
+    if backend != "numpy":
+        pytest.importorskip(backend)
+    flow_accumulation, slope = _block()
+    out = np.full(flow_accumulation.shape, 123.0, dtype=np.float32)
+    twi = twi_kernel(flow_accumulation[:16], slope[:16], out=out[:16], backend=backend)
+    assert np.shares_memory(twi, out)
+    assert np.all(out[16:] == 123.0)
+
+
+def test_backends_agree():
+    available = [x for x in BACKENDS if x == "numpy" or importlib.util.find_spec(x) is not None]
+    flow_accumulation, slope = _block(seed=1)
+    results = [twi_kernel(flow_accumulation, slope, backend=x) for x in available]
+    for result in results[1:]:
+        np.testing.assert_allclose(result, results[0], rtol=1e-5, atol=1e-5, equal_nan=True)
+    assert twi_backend() in BACKENDS
@@ -0,0 +1,106 @@
+"""Model input of stacks stored as uint16 reflectances with float32 or half precision derivatives,
+and inference through the network cache of FloodsensModel."""
+import pickle
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("osgeo")
+
+from floodsens._network import MainNET
+from floodsens.constants import STACK_NODATA, STACK_SCALES
+from floodsens.inference import _model_input, run_inference
+from floodsens.model import FloodsensModel
+
+DERIVATIVES = ("10_DEM", "11_Slope", "12_Flowaccumulation", "13_HAND", "14_TWI")
+CHANNELS = list(range(14))
+
+
+def _stack(size=64, seed=0):
+    """Reflectance DNs and DEM derivatives of a synthetic tile, nodata in the top left corner."""
+    rng = np.random.default_rng(seed)
+    reflectance = rng.integers(1, 10000, size=(9, size, size)).astype(np.uint16)
+    derivative = np.stack([rng.uniform(0.0, 3000.0, (size, size)),
+                           rng.uniform(0.0, 45.0, (size, size)),
+                           np.exp(rng.uniform(0.0, 14.0, (size, size))),
+                           rng.uniform(0.0, 300.0, (size, size)),
+                           rng.uniform(-5.0, 25.0, (size, size))]).astype(np.float32)
+    reflectance[:, :4, :4] = STACK_NODATA["uint16"]
+    derivative[:, :4, :4] = STACK_NODATA["float32"]
+    return reflectance, derivative
+
+
+def _half_precision(derivative):
+    """Derivatives as stored with STACK_DTYPE["derivative"] = "float16", and their scales."""
+    scales = np.asarray([STACK_SCALES.get(name, 1.0) for name in DERIVATIVES], dtype=np.float32)
+    stored = derivative/scales[:, None, None]
+    stored[derivative == STACK_NODATA["float32"]] = STACK_NODATA["float16"]
+    return stored.astype(np.float16), scales
+
+
+def _inputs():
+    reflectance, derivative = _stack()
+    exact = _model_input(np.concatenate([reflectance, derivative]), CHANNELS, np.ones(14, dtype=np.float32),
+                         [STACK_NODATA["uint16"]]*9 + [STACK_NODATA["float32"]]*5)
+    half, half_scales = _half_precision(derivative)
+    rounded = _model_input(np.concatenate([reflectance, half]), CHANNELS, np.concatenate([np.ones(9, dtype=np.float32), half_scales]),
+                           [STACK_NODATA["uint16"]]*9 + [STACK_NODATA["float16"]]*5)
+    return reflectance, derivative, exact, rounded
+
+
+def test_model_input_is_exact_for_uint16_and_float32():
+    reflectance, derivative, exact, _ = _inputs()
+    assert exact.dtype == np.float32
+    assert np.array_equal(exact[:9, 4:, 4:], reflectance[:, 4:, 4:].astype(np.float32))
+    assert np.array_equal(exact[9:], derivative)
+    assert np.all(exact[:, :4, :4] == STACK_NODATA["float32"])
+
+
+def test_model_input_of_half_precision_derivatives():
+    _, derivative, exact, rounded = _inputs()
+    assert np.array_equal(rounded[:9], exact[:9])
+    assert np.all(rounded[:, :4, :4] == STACK_NODATA["float32"])
+    valid = exact[9:, 4:, 4:]
+    relative_error = np.abs(rounded[9:, 4:, 4:] - valid)/np.maximum(np.abs(valid), 1.0)
+    assert relative_error.max() <= 2.0**-11
+
+
+def test_predictions_of_half_precision_derivatives():
+    _, _, exact, rounded = _inputs()
+    valid = exact[:, 4:, 4:].reshape(14, -1)
+    means, stds = valid.mean(axis=1)[:, None, None], valid.std(axis=1)[:, None, None]
+
+    torch.manual_seed(0)
+    model = MainNET(in_channels=14, out_channels=1)
+    model.eval()
+    with torch.no_grad():
+        predictions = [torch.sigmoid(model(torch.from_numpy((x - means)/stds).float()[None])).numpy()
+                       for x in (exact, rounded)]
+    assert np.abs(predictions[0] - predictions[1]).max() < 1e-3
+
+
+def test_run_inference_loads_the_checkpoint_once(tmp_path, monkeypatch):
+    tifffile = pytest.importorskip("tifffile")
+    torch.manual_seed(0)
+    checkpoint_path = tmp_path/"unet.pth.tar"
+    torch.save({"model_state_dict": MainNET(in_channels=14, out_channels=1).state_dict(),
+                "model_means": [0.0]*14, "model_stds": [1.0]*14}, checkpoint_path)
+    tiles_folder = tmp_path/"tiles"/"stacked"
+    tiles_folder.mkdir(parents=True)
+    for name in ("Tile_0-0", "Tile_0-64"):
+        tifffile.imwrite(tiles_folder/f"{name}.tif", np.random.default_rng(0).random((64, 64, 14), dtype=np.float32),
+                         photometric="minisblack", planarconfig="contig")
+
+    loads = []
+    torch_load = torch.load
+    monkeypatch.setattr(torch, "load", lambda *args, **kwargs: loads.append(args) or torch_load(*args, **kwargs))
+    model = FloodsensModel(checkpoint_path, means=[0.0]*14, stds=[1.0]*14)
+    for _ in range(2):
+        output_folder = run_inference(model, tiles_folder, cuda=False)
+
+    assert len(loads) == 1
+    assert sorted(x.name for x in output_folder.iterdir()) == ["yhat_Tile_0-0.pkl", "yhat_Tile_0-64.pkl"]
+    with open(output_folder/"yhat_Tile_0-0.pkl", "rb") as istream:
+        result = pickle.load(istream)
+    assert result["map"].shape == (1, 64, 64)
+    assert len(result["importances"]) == 14
@@ -0,0 +1,47 @@
+"""Rasterization of label vectors onto the grid of one or several rasters."""
+import json
+import pytest
+
+np = pytest.importorskip("numpy")
+gdal = pytest.importorskip("osgeo.gdal")
+osr = pytest.importorskip("osgeo.osr")
+
+from floodsens.label import rasterize
+
+
+def _raster(path, origin, epsg=32631, size=10, resolution=10.0):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    ds = gdal.GetDriverByName("GTiff").Create(str(path), size, size, 1, gdal.GDT_UInt16)
+    ds.SetGeoTransform((origin[0], resolution, 0.0, origin[1], 0.0, -resolution))
+    ds.SetProjection(srs.ExportToWkt())
+    ds = None
+    return path
+
+
+def _label(path, ring, epsg=32631):
+    with open(path, "w") as ostream:
+        json.dump({"type": "FeatureCollection", "crs": {"type": "name", "properties": {"name": f"urn:ogc:def:crs:EPSG::{epsg}"}},
+                   "features": [{"type": "Feature", "properties": {},
+                                 "geometry": {"type": "Polygon", "coordinates": [ring + ring[:1]]}}]}, ostream)
+    return path
+
+
+def test_rasterize_onto_the_union_of_rasters(tmp_path):
+    rasters = [_raster(tmp_path/"a.tif", (500000.0, 5000100.0)), _raster(tmp_path/"b.tif", (500100.0, 5000100.0))]
+    label_path = _label(tmp_path/"label.geojson", [[500050.0, 5000050.0], [500150.0, 5000050.0], [500150.0, 5000010.0], [500050.0, 5000010.0]])
+
+    out_path = rasterize(label_path, rasters, tmp_path/"label.tif", all_touched=False)
+    ds = gdal.Open(str(out_path))
+    assert (ds.RasterXSize, ds.RasterYSize) == (20, 10)
+    assert ds.GetGeoTransform()[:4] == (500000.0, 10.0, 0.0, 5000100.0)
+    assert int(ds.ReadAsArray().sum()) == 10*4
+    assert not [x for x in gdal.ReadDir("/vsimem/") or [] if x.startswith("label_target_grid")]
+
+
+def test_rasterize_rejects_mixed_projections(tmp_path):
+    rasters = [_raster(tmp_path/"a.tif", (500000.0, 5000100.0)), _raster(tmp_path/"b.tif", (500000.0, 5000100.0), epsg=32632)]
+    label_path = _label(tmp_path/"label.geojson", [[500050.0, 5000050.0], [500060.0, 5000050.0], [500060.0, 5000040.0]])
+    with pytest.raises(ValueError, match="b.tif"):
+        rasterize(label_path, rasters, tmp_path/"label.tif")
+    assert not (tmp_path/"label.tif").exists()
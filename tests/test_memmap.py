@@ -0,0 +1,98 @@
+"""Memmap stacks: windows of the band-interleaved-by-pixel parts and their sidecar."""
+import json
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from floodsens._memmap import MemmapStack, tile_names, write_memmap
+
+GEOTRANSFORM = (500000.0, 10.0, 0.0, 5000000.0, 0.0, -10.0)
+TILE_SIZE = 4
+
+
+def _parts(rows=8, cols=12):
+    reflectance = np.arange(rows*cols*3, dtype=np.uint16).reshape(3, rows, cols)
+    derivative = np.linspace(-5.0, 3000.0, rows*cols*2, dtype=np.float32).reshape(2, rows, cols)
+    return reflectance, derivative
+
+
+def _sidecar(folder, *parts):
+    """Memmap stack of (bands, rows, cols) parts written without GDAL."""
+    info = {"interleave": "BIP", "parts": [], "geotransform": list(GEOTRANSFORM), "projection": "", "tile_size": TILE_SIZE,
+            "bands": [], "tiles": []}
+    for k, part in enumerate(parts):
+        data_name = "stacked.bip" if k == 0 else f"stacked_part{k}.bip"
+        array = np.memmap(folder/data_name, dtype=part.dtype, mode="w+", shape=part.shape[1:] + part.shape[:1])
+        array[:] = np.moveaxis(part, 0, -1)
+        array.flush()
+        del array
+        info["parts"].append({"data": data_name, "dtype": part.dtype.name, "shape": list(part.shape[1:] + part.shape[:1]), "nodata": 0})
+    rows, cols = parts[0].shape[1:]
+    info["tiles"] = [[f"Tile_{row}-{col}", row, col] for row in range(0, rows, TILE_SIZE) for col in range(0, cols, TILE_SIZE)]
+    with open(folder/"stacked.json", "w") as ostream:
+        json.dump(info, ostream)
+    return folder/"stacked.json"
+
+
+def test_window_of_a_single_part_is_a_view(tmp_path):
+    reflectance, _ = _parts()
+    stack = MemmapStack(_sidecar(tmp_path, reflectance))
+    window = stack.window("Tile_4-8")
+    assert window.shape == (TILE_SIZE, TILE_SIZE, 3)
+    assert np.shares_memory(window, stack.arrays[0])
+    assert np.array_equal(window, np.moveaxis(reflectance[:, 4:8, 8:12], 0, -1))
+
+    gt, projection, size = stack.georeference("Tile_4-8")
+    assert gt == (GEOTRANSFORM[0] + 8*10.0, 10.0, 0.0, GEOTRANSFORM[3] - 4*10.0, 0.0, -10.0)
+    assert size == TILE_SIZE
+
+
+def test_window_concatenates_parts(tmp_path):
+    reflectance, derivative = _parts()
+    stack = MemmapStack(_sidecar(tmp_path, reflectance, derivative))
+    window = stack.window("Tile_0-4")
+    assert window.shape == (TILE_SIZE, TILE_SIZE, 5)
+    assert window.dtype == np.float32
+    assert np.array_equal(window[..., :3], np.moveaxis(reflectance[:, :4, 4:8], 0, -1))
+    assert np.array_equal(window[..., 3:], np.moveaxis(derivative[:, :4, 4:8], 0, -1))
+    assert stack.names == tile_names(tmp_path/"stacked.json") == sorted(f"Tile_{r}-{c}" for r in (0, 4) for c in (0, 4, 8))
+
+
+def _raster(path, array, nodata=None):
+    gdal = pytest.importorskip("osgeo.gdal")
+    from osgeo import gdal_array
+    ds = gdal.GetDriverByName("GTiff").Create(str(path), array.shape[2], array.shape[1], array.shape[0],
+                                              gdal_array.NumericTypeCodeToGDALTypeCode(array.dtype.type))
+    ds.SetGeoTransform(GEOTRANSFORM)
+    for k, band in enumerate(array):
+        ds.GetRasterBand(k+1).WriteArray(band)
+        ds.GetRasterBand(k+1).SetDescription(f"layer_{k}")
+        if nodata is not None:
+            ds.GetRasterBand(k+1).SetNoDataValue(nodata)
+    ds = None
+    return path
+
+
+def test_write_memmap_round_trip(tmp_path):
+    pytest.importorskip("osgeo")
+    reflectance, derivative = _parts()
+    mask = np.ones((1, 8, 12), dtype=np.uint8)
+    mask[0, 4:, :4] = 0
+    raster_paths = [_raster(tmp_path/"stacked.tif", reflectance, nodata=0), _raster(tmp_path/"stacked_derivative.tif", derivative, nodata=-9999)]
+    mask_path = _raster(tmp_path/"validity_mask.tif", mask)
+
+    sidecar_path = write_memmap(raster_paths, tmp_path/"tiles", TILE_SIZE, mask_path=mask_path, block_rows=3)
+    with open(sidecar_path, "r") as istream:
+        info = json.load(istream)
+    assert [part["dtype"] for part in info["parts"]] == ["uint16", "float32"]
+    assert [part["nodata"] for part in info["parts"]] == [0, -9999]
+    assert [band["nodata"] for band in info["bands"]] == [0]*3 + [-9999]*2
+    assert (tmp_path/"tiles"/"stacked_part1.bip").exists()
+
+    stack = MemmapStack(sidecar_path)
+    assert "Tile_4-0" not in stack.names
+    assert len(stack.names) == 5
+    for name in stack.names:
+        row, col = stack.offsets[name]
+        expected = np.concatenate([reflectance, derivative])[:, row:row+TILE_SIZE, col:col+TILE_SIZE]
+        assert np.array_equal(stack.window(name), np.moveaxis(expected, 0, -1))
@@ -0,0 +1,37 @@
+"""Signatures of compute_ndwi, including the former (archives, threshold, project_dir) form."""
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("osgeo")
+
+import floodsens.ndwi as ndwi
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    def ndwi_raster(zip_path, out_path, threshold=None, no_data=-9999):
+        calls.append((zip_path, out_path, threshold))
+        return out_path
+    monkeypatch.setattr(ndwi, "ndwi_raster", ndwi_raster)
+    return calls
+
+
+def test_compute_ndwi(tmp_path, calls):
+    out_path = ndwi.compute_ndwi(["S2A_MSIL2A.zip"], tmp_path/"ndwi.tif", threshold=0.2)
+    assert out_path == tmp_path/"ndwi.tif"
+    assert calls == [("S2A_MSIL2A.zip", tmp_path/"ndwi.tif", 0.2)]
+
+
+@pytest.mark.parametrize("threshold", [0.2, 0, None])
+def test_former_signature_is_deprecated(tmp_path, calls, threshold):
+    with pytest.warns(DeprecationWarning):
+        out_path = ndwi.compute_ndwi(["S2A_MSIL2A.zip"], threshold, tmp_path)
+    assert out_path == str(tmp_path/"ndwi"/"ndwi.tif")
+    assert calls == [("S2A_MSIL2A.zip", tmp_path/"ndwi"/"ndwi.tif", threshold)]
+    assert (tmp_path/"ndwi").is_dir()
+
+
+def test_former_signature_without_project_dir():
+    with pytest.warns(DeprecationWarning), pytest.raises(TypeError):
+        ndwi.compute_ndwi(["S2A_MSIL2A.zip"], 0.2)
@@ -0,0 +1,43 @@
+"""Per-stage records of the Profiler, memory as a delta of the current RSS and the process peak."""
+import json
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import floodsens.profiling as profiling
+from floodsens.profiling import Profiler
+
+
+def test_memory_of_a_stage_is_a_delta(monkeypatch):
+    rss = iter([100.0, 612.0, 612.0, 300.0])
+    monkeypatch.setattr(profiling, "rss_mb", lambda: next(rss))
+    monkeypatch.setattr(profiling, "peak_rss_mb", lambda: 700.0)
+    profiler = Profiler("event")
+    with profiler.stage("stacking") as stage:
+        stage.tiles = 3
+    with profiler.stage("tiling"):
+        pass
+
+    stacking, tiling = profiler.records
+    assert (stacking.rss_start_mb, stacking.rss_end_mb, stacking.rss_delta_mb) == (100.0, 612.0, 512.0)
+    assert tiling.rss_delta_mb == -312.0
+    assert stacking.peak_rss_process_mb == tiling.peak_rss_process_mb == 700.0
+    assert profiler.summary()["stacking"]["tiles"] == 3
+
+
+def test_summary_and_json(tmp_path):
+    profiler = Profiler("event")
+    for _ in range(2):
+        with profiler.stage("extract"):
+            block = np.ones((1024, 1024, 8))
+    del block
+
+    entry = profiler.summary()["extract"]
+    assert entry["calls"] == 2
+    if profiling.rss_mb() is not None:
+        assert entry["rss_delta_mb"] == max(x.rss_delta_mb for x in profiler.records)
+    with open(profiler.to_json(tmp_path/"profile.json"), "r") as istream:
+        data = json.load(istream)
+    assert data["name"] == "event"
+    assert "peak_rss_process_mb" in data and "peak_rss_mb" not in data
+    assert len(data["stages"]) == 2 and "rss_delta_mb" in data["stages"][0]
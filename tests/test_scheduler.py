@@ -0,0 +1,52 @@
+"""Pipelined preprocessing and inference pools of run_events with stand-in events in spawned workers."""
+import json
+import pytest
+
+from floodsens.scheduler import run_events
+
+
+class _Event():
+    """Picklable stand-in for Event that fails in the stage given by fail."""
+    def __init__(self, name, fail=None):
+        self.name = name
+        self.fail = fail
+        self.preprocessed = False
+        self.inference_options = None
+        self.inferred_raster = None
+
+    def run_preprocessing(self, force=False):
+        if self.fail == "preprocessing":
+            raise RuntimeError(f"{self.name} preprocessing")
+        self.preprocessed = True
+        self.force = force
+
+    def run_floodsens(self, interactive=True, **options):
+        if self.fail == "inference":
+            raise ValueError(f"{self.name} inference")
+        assert self.preprocessed and not interactive
+        self.inference_options = options
+        self.inferred_raster = f"{self.name}/inferred.tif"
+
+
+def test_failures_do_not_stop_the_batch(tmp_path):
+    events = [_Event("valencia"), _Event("porto", fail="preprocessing"), _Event("lyon", fail="inference"), _Event("gent")]
+    summary = run_events(events, preprocess_workers=2, inference_workers=1, force=True, inference_options={"batch_size": 8})
+
+    assert sorted(summary.completed) == ["gent", "valencia"]
+    for event in summary.completed.values():
+        # Events come back from the workers with the state set there
+        assert event.preprocessed and event.force
+        assert event.inference_options == {"batch_size": 8}
+    assert summary.failed["porto"] == ("preprocessing", repr(RuntimeError("porto preprocessing")))
+    assert summary.failed["lyon"] == ("inference", repr(ValueError("lyon inference")))
+    assert summary.wall > 0
+
+    with open(summary.to_json(tmp_path/"summary.json"), "r") as istream:
+        data = json.load(istream)
+    assert data["completed"] == {"valencia": "valencia/inferred.tif", "gent": "gent/inferred.tif"}
+    assert data["failed"]["lyon"]["stage"] == "inference"
+
+
+def test_empty_batch():
+    summary = run_events([])
+    assert summary.completed == {} and summary.failed == {}
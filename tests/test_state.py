@@ -0,0 +1,92 @@
+"""Loading of checkpoints written by floodsens 0.2.1 and earlier, which dumped the __dict__ of
+Project and Event with python object tags."""
+from pathlib import Path
+import pytest
+import yaml
+
+from floodsens.event import Event
+from floodsens.model import FloodsensModel
+from floodsens.project import Project
+from floodsens.state import StateStore, read_yaml_checkpoint
+
+
+def _legacy(cls, **attributes):
+    """Instance with the attributes of a floodsens 0.2.1 object, without running __init__."""
+    instance = object.__new__(cls)
+    instance.__dict__.update(attributes)
+    return instance
+
+
+def _legacy_objects(tmp_path, means=None, stds=None):
+    model = _legacy(FloodsensModel, path=tmp_path/"models"/"unet.pth", name="unet",
+                    means=means if means is not None else [float(x) for x in range(14)],
+                    stds=stds if stds is not None else [1.0]*14, channels=list(range(14)))
+    event = _legacy(Event, event_folder=tmp_path/"events"/"valencia",
+                    sentinel_archives=[tmp_path/"S2A_MSIL2A_20241030.zip"], model=model, name="valencia",
+                    inferred_raster=None, ndwi_raster=tmp_path/"events"/"valencia"/"ndwi.tif")
+    return model, event
+
+
+def test_read_legacy_checkpoint_as_plain_data(tmp_path):
+    model, event = _legacy_objects(tmp_path)
+    yaml_path = tmp_path/"event_checkpoint.yaml"
+    with open(yaml_path, "w") as ostream:
+        yaml.dump(event.__dict__, ostream)
+
+    data = read_yaml_checkpoint(yaml_path)
+    assert data["event_folder"] == str(tmp_path/"events"/"valencia")
+    assert data["model"]["name"] == "unet"
+    assert data["model"]["means"] == list(range(14))
+    assert data["sentinel_archives"] == [str(tmp_path/"S2A_MSIL2A_20241030.zip")]
+
+
+def test_read_legacy_checkpoint_with_arrays(tmp_path):
+    np = pytest.importorskip("numpy")
+    model, _ = _legacy_objects(tmp_path, means=np.arange(14, dtype=np.float64), stds=np.ones(14))
+    yaml_path = tmp_path/"project_checkpoint.yaml"
+    with open(yaml_path, "w") as ostream:
+        yaml.dump({"project_folder": tmp_path/"project", "models": {"unet": model}}, ostream)
+
+    data = read_yaml_checkpoint(yaml_path)
+    assert data["models"]["unet"]["means"] == list(range(14))
+    assert data["models"]["unet"]["stds"] == [1.0]*14
+
+
+def test_event_from_legacy_checkpoint(tmp_path):
+    _, event = _legacy_objects(tmp_path)
+    yaml_path = tmp_path/"event_checkpoint.yaml"
+    with open(yaml_path, "w") as ostream:
+        yaml.dump(event.__dict__, ostream)
+
+    restored = Event.from_yaml(yaml_path)
+    assert restored.name == "valencia"
+    assert restored.ndwi_raster == tmp_path/"events"/"valencia"/"ndwi.tif"
+    assert isinstance(restored.model, FloodsensModel)
+    assert restored.model.stds == [1.0]*14
+
+
+def test_project_from_legacy_checkpoint(tmp_path):
+    model, event = _legacy_objects(tmp_path)
+    project_folder = tmp_path/"project"
+    legacy_project = _legacy(Project, project_folder=project_folder, models={"unet": model},
+                             event_collection={"valencia": event}, event=event)
+    yaml_path = tmp_path/"project_checkpoint.yaml"
+    with open(yaml_path, "w") as ostream:
+        yaml.dump(legacy_project.__dict__, ostream)
+
+    project = Project.from_yaml(yaml_path)
+    assert isinstance(project.models["unet"], FloodsensModel)
+    assert isinstance(project.event_collection["valencia"], Event)
+    assert project.event is project.event_collection["valencia"]
+    assert project.event.model is project.models["unet"]
+
+    state = StateStore(project_folder/"project_state.sqlite")
+    assert list(state.models()) == ["unet"]
+    assert state.event("valencia")["model"]["name"] == "unet"
+    assert state.get_value("active_event") == "valencia"
+
+    imported = StateStore(tmp_path/"imported.sqlite")
+    imported.import_yaml(yaml_path)
+    assert list(imported.models()) == ["unet"]
+    assert imported.get_value("active_event") == "valencia"
+    assert Path(imported.event("valencia")["event_folder"]) == tmp_path/"events"/"valencia"
@@ -0,0 +1,64 @@
+"""Running statistics of flood probability maps accumulated window by window."""
+import json
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("osgeo")
+
+import floodsens.stats as stats
+from floodsens.stats import MapStatistics
+
+GEOTRANSFORM = (500000.0, 10.0, 0.0, 5000000.0, 0.0, -10.0)
+
+
+def _windows():
+    """Two 4 x 4 windows side by side, the first with a nodata and a NaN pixel."""
+    first = np.array([[0.0, 0.1, 0.2, 0.3],
+                      [0.4, 0.5, 0.6, 0.7],
+                      [0.8, 0.9, 1.0, 0.25],
+                      [-9999, np.nan, 0.55, 0.05]], dtype=np.float32)
+    second = np.full((4, 4), 0.95, dtype=np.float32)
+    second[2:] = 0.45
+    gt = GEOTRANSFORM
+    return [(first, gt), (second, (gt[0] + 4*gt[1], gt[1], gt[2], gt[3], gt[4], gt[5]))]
+
+
+def _expected(values, thresholds):
+    return [int(np.count_nonzero(values >= t)) for t in thresholds]
+
+
+def test_histogram_and_area_per_threshold(tmp_path):
+    statistics = MapStatistics(thresholds=(0.3, 0.5, 0.7), bins=10)
+    for array, gt in _windows():
+        statistics.add(array, gt)
+
+    values = np.concatenate([x[(x != -9999) & ~np.isnan(x)] for x, _ in _windows()])
+    summary = statistics.to_dict()
+    assert summary["pixel_area_m2"] == 100.0
+    assert summary["valid_pixels"] == 30
+    assert summary["valid_area_m2"] == 3000.0
+    assert summary["flooded_pixels"] == dict(zip(["0.3", "0.5", "0.7"], _expected(values, (0.3, 0.5, 0.7))))
+    assert summary["flooded_area_m2"] == {key: 100.0*x for key, x in summary["flooded_pixels"].items()}
+    assert summary["histogram"]["counts"] == np.histogram(values, bins=np.linspace(0.0, 1.0, 11))[0].tolist()
+    assert sum(summary["histogram"]["counts"]) == 30
+    assert summary["archives"] == {}
+
+    with open(statistics.to_json(tmp_path/"statistics.json"), "r") as istream:
+        assert json.load(istream) == summary
+
+
+def test_pixels_per_archive(tmp_path, monkeypatch):
+    gt = GEOTRANSFORM
+    # The archive covers the two right columns of the first window and all of the second
+    footprint = (gt[0] + 2*gt[1], gt[3] + 4*gt[5], gt[0] + 8*gt[1], gt[3])
+    monkeypatch.setattr(stats, "archive_footprint", lambda zip_path, projection: footprint)
+    statistics = MapStatistics(thresholds=(0.5,), archives=[tmp_path/"S2A_MSIL2A.zip"])
+    with pytest.raises(ValueError):
+        statistics.add(*_windows()[0])
+
+    for array, window_gt in _windows():
+        statistics.add(array, window_gt, projection="EPSG:32631")
+    counts = statistics.to_dict()["archives"]["S2A_MSIL2A.zip"]
+    covered = np.concatenate([_windows()[0][0][:, 2:].ravel(), _windows()[1][0].ravel()])
+    assert counts["valid_pixels"] == covered.size
+    assert counts["flooded_pixels"] == {"0.5": _expected(covered, (0.5,))[0]}
@@ -0,0 +1,61 @@
+"""Tiling of stacks and labels with a validity mask."""
+import pytest
+
+np = pytest.importorskip("numpy")
+gdal = pytest.importorskip("osgeo.gdal")
+
+from floodsens._tile import paired_tiling, singleraster_tiling
+
+GEOTRANSFORM = (500000.0, 10.0, 0.0, 5000000.0, 0.0, -10.0)
+TILE_SIZE = 4
+
+
+def _raster(path, array, data_type=gdal.GDT_Float32, geotransform=GEOTRANSFORM):
+    ds = gdal.GetDriverByName("GTiff").Create(str(path), array.shape[2], array.shape[1], array.shape[0], data_type)
+    ds.SetGeoTransform(geotransform)
+    for k, band in enumerate(array):
+        ds.GetRasterBand(k+1).WriteArray(band)
+    ds = None
+    return path
+
+
+def _inputs(folder):
+    """8 x 12 stack and label, and a mask invalidating Tile_4-0 entirely and Tile_0-8 but one pixel."""
+    stack = np.arange(2*8*12, dtype=np.float32).reshape(2, 8, 12)
+    label = (np.arange(8*12).reshape(1, 8, 12) % 3 == 0).astype(np.uint8)
+    mask = np.ones((1, 8, 12), dtype=np.uint8)
+    mask[0, 4:, :4] = 0
+    mask[0, :4, 8:] = 0
+    mask[0, 0, 8] = 1
+    return (_raster(folder/"stacked.tif", stack), _raster(folder/"label.tif", label, gdal.GDT_Byte),
+            _raster(folder/"validity_mask.tif", mask, gdal.GDT_Byte), stack, label)
+
+
+def _names(folder):
+    return sorted(x.stem for x in folder.iterdir())
+
+
+def test_paired_tiling_skips_masked_pairs(tmp_path):
+    raster_path, label_path, mask_path, stack, label = _inputs(tmp_path)
+    out_dir, label_out_dir = paired_tiling(TILE_SIZE, raster_path, label_path, mask_path=mask_path)
+    assert _names(out_dir) == _names(label_out_dir) == ["Tile_0-0", "Tile_0-4", "Tile_0-8", "Tile_4-4", "Tile_4-8"]
+    assert (gdal.Open(str(out_dir/"Tile_4-8.tif")).ReadAsArray() == stack[:, 4:8, 8:12]).all()
+    assert (gdal.Open(str(label_out_dir/"Tile_4-8.tif")).ReadAsArray() == label[0, 4:8, 8:12]).all()
+
+    # Pairs with at most 1/16 valid pixels are skipped as well
+    out_dir, label_out_dir = paired_tiling(TILE_SIZE, raster_path, label_path, data_type="strict", label_type="strict_label",
+                                           mask_path=mask_path, min_valid_fraction=1/16)
+    assert _names(out_dir) == _names(label_out_dir) == ["Tile_0-0", "Tile_0-4", "Tile_4-4", "Tile_4-8"]
+
+
+def test_paired_and_single_tiling_cover_the_same_windows(tmp_path):
+    raster_path, label_path, mask_path, _, _ = _inputs(tmp_path)
+    out_dir, _ = paired_tiling(TILE_SIZE, raster_path, label_path, mask_path=mask_path, min_valid_fraction=0.5)
+    single_dir = singleraster_tiling(TILE_SIZE, raster_path, data_type="inference", mask_path=mask_path, min_valid_fraction=0.5)
+    assert _names(out_dir) == _names(single_dir)
+
+
+def test_paired_tiling_without_mask(tmp_path):
+    raster_path, label_path, _, _, _ = _inputs(tmp_path)
+    out_dir, label_out_dir = paired_tiling(TILE_SIZE, raster_path, label_path)
+    assert len(_names(out_dir)) == len(_names(label_out_dir)) == 6
@@ -0,0 +1,82 @@
+"""R-tree index of the Sentinel-2 tiling grid on a tiny grid of three tiles."""
+import json
+import sqlite3
+import pytest
+
+from floodsens.tilegrid import TileGrid, SCHEMA
+
+# Two overlapping squares and a diamond whose bounds contain points outside its footprint
+TILES = {"31TCJ": [(0.0, 40.0), (1.0, 40.0), (1.0, 41.0), (0.0, 41.0)],
+         "31TDJ": [(0.9, 40.0), (2.0, 40.0), (2.0, 41.0), (0.9, 41.0)],
+         "31TEK": [(3.0, 41.0), (4.0, 42.0), (3.0, 43.0), (2.0, 42.0)]}
+
+
+def _wkt(ring):
+    return "POLYGON ((" + ", ".join(f"{lon} {lat}" for lon, lat in ring + ring[:1]) + "))"
+
+
+def _grid(path):
+    """Index written like TileGrid.build, without reading a shapefile."""
+    connection = sqlite3.connect(str(path))
+    connection.executescript(SCHEMA)
+    with connection:
+        for k, (name, ring) in enumerate(TILES.items()):
+            lons, lats = [x[0] for x in ring], [x[1] for x in ring]
+            connection.execute("INSERT INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (k, name, min(lons), min(lats), max(lons), max(lats), _wkt(ring)))
+            connection.execute("INSERT INTO tiles_rtree VALUES (?, ?, ?, ?, ?)", (k, min(lons), max(lons), min(lats), max(lats)))
+    connection.close()
+    return TileGrid(path)
+
+
+def test_bounds_and_footprint(tmp_path):
+    grid = _grid(tmp_path/"tile_grid.sqlite")
+    assert grid.bounds("T31TEK", "31TCJ") == [(2.0, 41.0, 4.0, 43.0), (0.0, 40.0, 1.0, 41.0)]
+    assert grid.footprint("T31TCJ") == _wkt(TILES["31TCJ"])
+    with pytest.raises(KeyError):
+        grid.bounds("31TCJ", "32ULV")
+    with pytest.raises(KeyError):
+        grid.footprint("32ULV")
+    grid.close()
+
+
+def test_tiles_in_bounding_box(tmp_path):
+    grid = _grid(tmp_path/"tile_grid.sqlite")
+    assert grid.tiles_in(0.2, 40.2, 0.5, 40.5) == ["31TCJ"]
+    assert grid.tiles_in(0.5, 40.5, 2.5, 41.5) == ["31TCJ", "31TDJ", "31TEK"]
+    assert grid.tiles_in(5.0, 40.0, 6.0, 41.0) == []
+    grid.close()
+
+
+def test_tiles_at_point_by_bounds(tmp_path):
+    grid = _grid(tmp_path/"tile_grid.sqlite")
+    assert grid.tiles_at(0.95, 40.5, exact=False) == ["31TCJ", "31TDJ"]
+    assert grid.tiles_at(1.5, 40.5, exact=False) == ["31TDJ"]
+    assert grid.tiles_at(2.1, 41.1, exact=False) == ["31TEK"]
+    assert grid.tiles_at(10.0, 10.0) == []
+    grid.close()
+
+
+def test_missing_index_without_shapefile(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        TileGrid(tmp_path/"missing.sqlite")
+
+
+def test_build_and_refine_by_footprint(tmp_path):
+    pytest.importorskip("osgeo")
+    features = [{"type": "Feature", "properties": {"Name": name},
+                 "geometry": {"type": "Polygon", "coordinates": [[list(x) for x in ring + ring[:1]]]}}
+                for name, ring in TILES.items()]
+    shapefile_path = tmp_path/"grid.geojson"
+    with open(shapefile_path, "w") as ostream:
+        json.dump({"type": "FeatureCollection", "features": features}, ostream)
+
+    grid = TileGrid.build(shapefile_path, tmp_path/"tile_grid.sqlite")
+    assert grid.bounds("31TDJ") == [(0.9, 40.0, 2.0, 41.0)]
+    assert grid.tiles_at(0.95, 40.5) == ["31TCJ", "31TDJ"]
+    assert grid.tiles_at(3.0, 42.0) == ["31TEK"]
+    # Inside the bounds of the diamond, outside its footprint
+    assert grid.tiles_at(2.1, 41.1, exact=False) == ["31TEK"]
+    assert grid.tiles_at(2.1, 41.1) == []
+    grid.close()
@@ -0,0 +1,79 @@
+"""Streaming vectorization of flood probability windows, compared with polygonizing the full raster."""
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("osgeo")
+from osgeo import ogr, osr
+
+from floodsens.vectorize import FloodVectorizer
+
+GEOTRANSFORM = (500000.0, 10.0, 0.0, 5000000.0, 0.0, -10.0)
+
+
+def _projection():
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32631)
+    return srs.ExportToWkt()
+
+
+def _window_geotransform(row, col):
+    gt = GEOTRANSFORM
+    return (gt[0]+col*gt[1], gt[1], gt[2], gt[3]+row*gt[5], gt[4], gt[5])
+
+
+def _flood(size=32):
+    """Flood probabilities with a cross spanning all windows, a pond inside one window and two
+    pixels touching in a corner across a window border."""
+    flood = np.zeros((size, size), dtype=np.float32)
+    flood[2:30, 5:7] = 1.0
+    flood[10:12, :] = 1.0
+    flood[20:22, 20:23] = 1.0
+    flood[15, 15] = flood[16, 16] = 1.0
+    flood[0, :2] = -9999
+    return flood
+
+
+def _vectorize(out_path, flood, window):
+    vectorizer = FloodVectorizer(out_path, _projection())
+    for row in range(0, flood.shape[0], window):
+        for col in range(0, flood.shape[1], window):
+            vectorizer.add(flood[row:row+window, col:col+window], _window_geotransform(row, col))
+    return vectorizer.close()
+
+
+def _areas(out_path):
+    datasource = ogr.Open(str(out_path))
+    areas = sorted(feature.GetField("area_m2") for feature in datasource.GetLayer())
+    datasource = None
+    return areas
+
+
+def test_windows_match_full_raster(tmp_path):
+    flood = _flood()
+    full = _vectorize(tmp_path/"full.gpkg", flood, window=32)
+    windowed = _vectorize(tmp_path/"windowed.gpkg", flood, window=8)
+
+    assert full["polygons"] == windowed["polygons"] == 4
+    assert windowed["flooded_area_m2"] == pytest.approx(full["flooded_area_m2"])
+    assert windowed["flooded_area_m2"] == pytest.approx(100.0*np.count_nonzero(flood == 1.0))
+    assert windowed["largest_polygon_m2"] == pytest.approx(full["largest_polygon_m2"])
+    assert _areas(tmp_path/"windowed.gpkg") == pytest.approx(_areas(tmp_path/"full.gpkg"))
+
+
+def test_completed_polygons_are_written_per_row(tmp_path):
+    flood = np.zeros((16, 16), dtype=np.float32)
+    flood[2:4, 6:10] = 1.0
+    vectorizer = FloodVectorizer(tmp_path/"flood.geojson", _projection())
+    vectorizer.add(flood[:8, :8], _window_geotransform(0, 0))
+    vectorizer.add(flood[:8, 8:], _window_geotransform(0, 8))
+    assert len(vectorizer._border) == 1
+    assert vectorizer.polygons == 0
+
+    vectorizer.add(flood[8:, :8], _window_geotransform(8, 0))
+    assert len(vectorizer._border) == 0
+    assert vectorizer.polygons == 1
+    assert vectorizer.largest_area == pytest.approx(800.0)
+
+    with pytest.raises(ValueError):
+        vectorizer.add(flood[:8, :8], _window_geotransform(0, 0))
+    assert vectorizer.close()["polygons"] == 1